@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medguard_project.settings')
+# Under ASGI the home page runs the async analysis pipeline.
+os.environ.setdefault('MEDGUARD_ASYNC_PIPELINE', 'True')
 
 application = get_asgi_application()
+
+# Load the LLM now rather than on the first analysis.
+from medicinebot.agents.llm_gateway import llm_gateway  # noqa: E402
+
+llm_gateway.warm_up_in_background()
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "medicinebot.tracing.trace_middleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     # "corsheaders.middleware.CorsMiddleware", # Only if needed
     "django.middleware.common.CommonMiddleware",
@@ -97,6 +98,43 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# LLM summaries are cached per (model, prompt version, DB row, extracted fields).
+# In memory by default (LRU via MAX_ENTRIES, TTL via TIMEOUT); set
+# MEDGUARD_SUMMARY_CACHE=sqlite to keep them on disk across restarts/workers.
+SUMMARY_CACHE_ALIAS = "summaries"
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "summaries": (
+        {
+            "BACKEND": "medicinebot.cache_backends.SQLiteCache",
+            "LOCATION": BASE_DIR / "storage" / "summary_cache.sqlite3",
+            "TIMEOUT": 7 * 24 * 3600,
+            "OPTIONS": {"MAX_ENTRIES": 50000},
+        }
+        if os.getenv("MEDGUARD_SUMMARY_CACHE", "memory") == "sqlite"
+        else {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "medguard-summaries",
+            "TIMEOUT": 24 * 3600,
+            "OPTIONS": {"MAX_ENTRIES": 2000},
+        }
+    ),
+    # Exact (SHA-256) entries of the image result cache, see IMAGE_CACHE_*.
+    "image_results": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "medguard-image-results",
+        "TIMEOUT": 7 * 24 * 3600,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -144,6 +182,160 @@ LOGIN_URL = 'login' # The name of your login URL pattern
 MEDICINE_DATA_PATH = BASE_DIR.parent / "MajorProjectDataset.csv"
 # Define where the search index will be stored inside the project folder
 INDEX_STORAGE_PATH = BASE_DIR / "storage"
+# Compiled (memory-mapped) catalogue written by `manage.py compile_catalogue`.
+# Used instead of the CSV whenever it is up to date with it.
+MEDICINE_CATALOGUE_PATH = INDEX_STORAGE_PATH / "catalogue"
+# Seconds between checks for an updated CSV / compiled catalogue (0 = off).
+MEDICINE_CATALOGUE_WATCH_INTERVAL = 10
+# Reload the catalogue on SIGUSR2 (`manage.py reload_catalogue --pid ...`).
+MEDICINE_CATALOGUE_RELOAD_SIGNAL = True
+# Serve the home page from the async analysis pipeline (set by asgi.py).
+MEDGUARD_ASYNC_PIPELINE = os.getenv("MEDGUARD_ASYNC_PIPELINE", "False") == "True"
+# Queue home-page analyses as AnalysisJob rows for `manage.py run_analysis_worker`
+# instead of running them inside the request.
+ANALYSIS_JOB_QUEUE = os.getenv("MEDGUARD_JOB_QUEUE", "False") == "True"
+# Async pipeline without the job queue: send the page as soon as the search is
+# done and stream the LLM summary into it (server-sent events).
+SUMMARY_STREAMING = os.getenv("MEDGUARD_SUMMARY_STREAMING", "True") == "True"
+# Seconds a summary stream URL stays valid. A stream served by a worker
+# other than the one writing the summary polls the History row this often.
+SUMMARY_STREAM_MAX_AGE = 600
+SUMMARY_STREAM_POLL_INTERVAL = 1.0
+# All Ollama chat calls go through medicinebot.agents.llm_gateway (server:
+# OLLAMA_HOST). Concurrent requests per model ("default" for the rest);
+# keep it at or below the server's OLLAMA_NUM_PARALLEL.
+LLM_CONCURRENCY = {"default": int(os.getenv("MEDGUARD_LLM_CONCURRENCY", "2"))}
+# Seconds for one call (streams: for the first token and between tokens)
+# before the agents fall back to their non-LLM answer, and seconds to wait
+# for a free slot.
+LLM_TIMEOUT = float(os.getenv("MEDGUARD_LLM_TIMEOUT", "60"))
+LLM_QUEUE_TIMEOUT = 30
+# How long Ollama keeps a model loaded after a call ("-1" = forever).
+LLM_KEEP_ALIVE = os.getenv("MEDGUARD_LLM_KEEP_ALIVE", "30m")
+# Models loaded when a server / analysis worker starts.
+LLM_WARM_UP = os.getenv("MEDGUARD_LLM_WARM_UP", "True") == "True"
+LLM_WARM_UP_MODELS = ["phi3"]
+# Per-stage spans (medicinebot.tracing): timings for /metrics (Prometheus,
+# per process) and one JSON line per request on the "medicinebot.trace"
+# logger, for requests slower than TRACE_LOG_MIN_MS. /metrics needs
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is set; without one
+# it only answers with DEBUG on or to clients in INTERNAL_IPS.
+TRACING_ENABLED = os.getenv("MEDGUARD_TRACING", "True") == "True"
+TRACE_LOG = os.getenv("MEDGUARD_TRACE_LOG", "True") == "True"
+TRACE_LOG_MIN_MS = float(os.getenv("MEDGUARD_TRACE_LOG_MIN_MS", "1000"))
+METRICS_TOKEN = os.getenv("MEDGUARD_METRICS_TOKEN")
+INTERNAL_IPS = os.getenv("MEDGUARD_INTERNAL_IPS", "127.0.0.1,::1").split(",")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "medicinebot.trace": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
+ANALYSIS_WORKER_CONCURRENCY = 4
+# Workers reserved for barcode jobs (on top of ANALYSIS_WORKER_CONCURRENCY).
+ANALYSIS_WORKER_BARCODE_CONCURRENCY = 1
+# Seconds between a worker's sweeps for jobs left "running" by a dead worker.
+ANALYSIS_WORKER_REQUEUE_INTERVAL = 60
+# Where uploaded images and their thumbnails live. "filesystem" (LOCATION) or
+# "s3" (BUCKET, optional ENDPOINT_URL for MinIO & co.; needs boto3).
+BLOB_STORE = {
+    "BACKEND": os.getenv("MEDGUARD_BLOB_BACKEND", "filesystem"),
+    "LOCATION": INDEX_STORAGE_PATH / "blobs",
+    "BUCKET": os.getenv("MEDGUARD_BLOB_BUCKET", "medguard"),
+    "ENDPOINT_URL": os.getenv("MEDGUARD_BLOB_ENDPOINT_URL"),
+}
+# Longest side of the WebP thumbnails shown in the history.
+IMAGE_THUMBNAIL_SIZE = 320
+# History entries per page / per infinite-scroll request.
+HISTORY_PAGE_SIZE = 20
+# Uploads are decoded upright and downscaled before OCR / barcode decoding
+# (medicinebot/agents/image_prep.py): longest side in pixels, OCR JPEG quality.
+OCR_MAX_IMAGE_SIDE = 1600
+OCR_JPEG_QUALITY = 85
+BARCODE_MAX_IMAGE_SIDE = 1280
+# If the fast barcode pass finds nothing, ROI crops / contrast variants /
+# rotations are tried on this many threads for at most this many seconds.
+BARCODE_WORKERS = 4
+BARCODE_TIME_BUDGET = 1.5
+# Sample images + expected.json for `manage.py benchmark_barcodes`.
+BARCODE_SAMPLES_PATH = BASE_DIR / "samples" / "barcodes"
+# OCR engine (medicinebot/agents/ocr_backends.py): "google" (Cloud Vision),
+# "tesseract" (local, needs the tesseract binary), "stub" (returns
+# OCR_STUB_TEXT; tests / offline benchmarks) or a dotted class path.
+OCR_BACKEND = os.getenv("MEDGUARD_OCR_BACKEND", "google")
+# Long-lived Vision gRPC channels shared by all requests of a process.
+VISION_CHANNEL_POOL_SIZE = 4
+OCR_STUB_TEXT = os.getenv("MEDGUARD_OCR_STUB_TEXT", "")
+# Seconds the stub backend waits per image.
+OCR_STUB_LATENCY = 0.0
+# Reuse OCR text / barcodes / extracted fields for repeated package photos
+# (medicinebot/agents/image_cache.py): exact bytes via the "image_results"
+# cache, near-duplicates via perceptual hashes. Max pHash Hamming distance
+# (of 64 bits) per agent, None for exact matches only; dHash must also be
+# within IMAGE_CACHE_DHASH_DISTANCE. Both agents are exact-only: OCR text
+# carries the batch's dates and MRP, which a perceptual hash can't tell
+# apart, and a barcode names one exact product while two strengths of the
+# same brand look alike, so a new photo must be read again.
+IMAGE_CACHE_ENABLED = os.getenv("MEDGUARD_IMAGE_CACHE", "True") == "True"
+IMAGE_CACHE_ALIAS = "image_results"
+IMAGE_CACHE_NEAR_DISTANCE = {"ocr": None, "barcode": None}
+IMAGE_CACHE_DHASH_DISTANCE = 10
+# Photos per agent kept in the in-process near-duplicate index (oldest evicted).
+IMAGE_CACHE_MAX_ENTRIES = 20000
+# Minimum QRatio for an OCR line to be taken as the medicine name without the LLM.
+EXTRACTION_NAME_MIN_SCORE = 90
+# While the extraction agent works, the leading OCR lines are searched; a hit
+# scoring at least SPECULATIVE_SEARCH_MIN_SCORE (token sort ratio against its
+# line) is the search result, and the LLM isn't waited for when the parser
+# found the dates and MRP. STAGE_WORKERS: threads for stages run side by side.
+SPECULATIVE_SEARCH = os.getenv("MEDGUARD_SPECULATIVE_SEARCH", "True") == "True"
+SPECULATIVE_SEARCH_MIN_SCORE = 85
+STAGE_WORKERS = 8
+
+# Vector index of the catalogue (`manage.py build_index`). Embeddings come
+# from hashed words + character trigrams ("hashing", in process: a query
+# embeds in well under a millisecond) or from a local Ollama model
+# ("ollama", EMBEDDING_MODEL). Searches embed the query with whichever
+# built the index; with "ollama" that is an HTTP round trip per search,
+# which doesn't fit a millisecond latency budget.
+VECTOR_INDEX_PATH = INDEX_STORAGE_PATH / "vectors"
+EMBEDDING_BACKEND = os.getenv("MEDGUARD_EMBEDDING_BACKEND", "hashing")
+EMBEDDING_MODEL = "nomic-embed-text"
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_WORKERS = 4
+# Seconds a search waits for its query embedding (through the LLM gateway)
+# before it falls back to the fuzzy phases.
+EMBEDDING_QUERY_TIMEOUT = 2.0
+# Indexes with at least this many rows also get an IVF partition (searched
+# by probing VECTOR_IVF_NPROBE lists); smaller ones are scanned exactly.
+VECTOR_IVF_MIN_ROWS = 20000
+VECTOR_IVF_NPROBE = 8
+# Where name / barcode searches and type-ahead look: "memory" (the catalogue
+# above, loaded by each worker) or "database" (the Medicine table, filled by
+# `manage.py sync_medicines`, shortlisted through its SQLite FTS5 trigram
+# index; no semantic stage). Batch search still loads the catalogue.
+SEARCH_BACKEND = os.getenv("MEDGUARD_SEARCH_BACKEND", "memory")
+# Text search fuses fuzzy name scores with embedding similarity when a
+# current vector index exists: (fuzzy, semantic) weights, the fused score
+# a match needs, and how many nearest rows the semantic stage adds.
+SEARCH_FUSION_WEIGHTS = (0.6, 0.4)
+SEARCH_FUSED_MIN_SCORE = 0.6
+SEARCH_SEMANTIC_TOP_K = 20
+# Batch search (`manage.py search_batch`) scores blocks of queries against
+# the union of their shortlists, this many cells per block. Raise it on
+# hosts with many cores.
+SEARCH_BATCH_CELL_BUDGET = 20_000
+# Type-ahead (/api/autocomplete/): suggestions per request, characters typed
+# before it answers, and the most edits a misspelt word is corrected by
+# (memory backend; the database one needs a 3-letter word to look up).
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_MIN_CHARS = 2
+AUTOCOMPLETE_MAX_QUERY_LENGTH = 100
+AUTOCOMPLETE_MAX_EDITS = 2
 
 # Ensure the storage directory exists
 os.makedirs(INDEX_STORAGE_PATH, exist_ok=True)
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medguard_project.settings')
 
 application = get_wsgi_application()
+
+# Load the LLM now rather than on the first analysis.
+from medicinebot.agents.llm_gateway import llm_gateway  # noqa: E402
+
+llm_gateway.warm_up_in_background()
@@ -0,0 +1,33 @@
+# medicinebot/agents/async_clients.py
+
+import asyncio
+import weakref
+
+import ollama
+from google.cloud import vision
+
+from .ocr_backends import vision_credentials
+
+# httpx / grpc.aio connections belong to the event loop that opened them, so
+# keep one client per loop (normally just the ASGI server's) and share it
+# between requests instead of opening a new connection for every call.
+_ollama_clients = weakref.WeakKeyDictionary()
+_vision_clients = weakref.WeakKeyDictionary()
+
+
+def ollama_client():
+    """``ollama.AsyncClient`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _ollama_clients.get(loop)
+    if client is None:
+        client = _ollama_clients[loop] = ollama.AsyncClient()
+    return client
+
+
+def vision_client():
+    """``vision.ImageAnnotatorAsyncClient`` for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _vision_clients.get(loop)
+    if client is None:
+        client = _vision_clients[loop] = vision.ImageAnnotatorAsyncClient(credentials=vision_credentials())
+    return client
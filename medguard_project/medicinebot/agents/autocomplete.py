@@ -0,0 +1,220 @@
+# medicinebot/agents/autocomplete.py
+
+import bisect
+import re
+
+import numpy as np
+from rapidfuzz import process as rf_process
+from rapidfuzz.distance import Levenshtein
+
+from .ean import split_eans
+from .name_index import normalize_name
+
+# Completions of the word being typed whose names are gathered, most common first.
+MAX_EXPANSIONS = 64
+# Rows the most selective word of a query may bring in; beyond that the
+# longest posting lists are cut (a two-letter prefix matches half the catalogue).
+ROW_BUDGET = 10000
+# A misspelt word is compared with the words sharing its first letters,
+# using as few of them as keeps the comparison under this many words.
+TYPO_SCAN_LIMIT = 5000
+# Shorter words are never corrected: they have too many near neighbours.
+TYPO_MIN_LENGTH = 4
+
+# Match quality of a query word, summed per name for the ranking.
+EXACT, PREFIX, TYPO = 3, 2, 1
+
+# Past the last normalized character ([a-z0-9]), for bisecting a prefix range.
+_AFTER = "\x7f"
+# The first word of normalize_name(name), without normalizing all of it.
+_FIRST_WORD = re.compile(r"[a-z0-9]+")
+
+
+def display_ean(key):
+    """A 14-digit lookup key as it is printed on the pack (EAN-13 / EAN-8 / UPC-A)."""
+    digits = key.lstrip("0")
+    for length in (8, 12, 13):
+        if len(digits) <= length:
+            return digits.zfill(length)
+    return key
+
+
+class AutocompleteIndex:
+    """
+    Type-ahead over one catalogue snapshot.
+
+    The distinct words of the names, sorted, form the prefix index: the
+    completions of a prefix are one ``bisect`` range of the array. Names
+    come from the token posting lists the catalogue's ``NameIndex``
+    already has, and a forward index (row -> its words) checks the other
+    words of the query against them. A word with no match is corrected
+    within ``max_edits`` (bounded Levenshtein, rapidfuzz ``score_cutoff``)
+    against the words sharing its first letters.
+    """
+
+    def __init__(self, catalogue, max_edits=2):
+        self.catalogue = catalogue
+        self.max_edits = max_edits
+        self.postings = catalogue.name_index.tokens
+        size = len(catalogue.names)
+
+        # Delta updates leave empty posting lists behind for words no name has any more.
+        postings = sorted(((w, ids) for w, ids in self.postings.items() if len(ids)), key=lambda p: p[0])
+        self.words = [w for w, _ in postings]
+        # Fixed-width copy: ``astype("U<n>")`` cuts every word to n characters in C.
+        self.word_array = np.array(self.words, dtype=str)
+        lists = [ids for _, ids in postings]
+        self.word_lengths = np.fromiter(map(len, self.words), dtype=np.int32, count=len(self.words))
+        self.word_counts = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+
+        # The postings turned around: the words of row r are
+        # forward_words[forward_offsets[r]:forward_offsets[r + 1]].
+        rows = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int32)
+        word_ids = np.repeat(np.arange(len(self.words), dtype=np.int32), self.word_counts)
+        self.forward_words = word_ids[np.argsort(rows, kind="stable")]
+        self.forward_offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=self.forward_offsets[1:])
+
+        self.name_lengths = np.fromiter(map(len, catalogue.names), dtype=np.int32, count=size)
+        # Each name's first word, so names starting with what was typed rank first.
+        position = {w: i for i, w in enumerate(self.words)}
+        self.first_words = np.fromiter(
+            (position.get(m.group() if (m := _FIRST_WORD.search(n.lower())) else "", -1) for n in catalogue.names),
+            dtype=np.int32, count=size,
+        )
+
+    def __len__(self):
+        return len(self.words)
+
+    # ---------------------------------------------------------------------
+    def _range(self, prefix):
+        return bisect.bisect_left(self.words, prefix), bisect.bisect_left(self.words, prefix + _AFTER)
+
+    def _completions(self, word):
+        lo, hi = self._range(word)
+        # "c" could be anything; "capsule" and "cream" are what it usually turns into.
+        ids = lo + np.argsort(-self.word_counts[lo:hi], kind="stable")
+        quality = np.full(len(ids), PREFIX, dtype=np.int16)
+        if hi > lo and self.words[lo] == word:
+            # The word itself, already complete, goes first.
+            ids = np.concatenate(([lo], ids[ids != lo]))
+            quality[0] = EXACT
+        return ids, quality
+
+    def _corrections(self, word, partial):
+        none = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16)
+        if len(word) < TYPO_MIN_LENGTH:
+            return none
+        edits = min(self.max_edits, 1 if len(word) < 8 else 2)
+        for keep in range(1, len(word)):
+            lo, hi = self._range(word[:keep])
+            if hi - lo <= TYPO_SCAN_LIMIT:
+                break
+        else:
+            return none
+        if hi == lo:
+            return none
+        choices = self.word_array[lo:hi]
+
+        if partial:
+            # Distance to the closest prefix of each word, of about the typed length.
+            distance = None
+            for n in range(max(1, len(word) - edits), len(word) + edits + 1):
+                d = rf_process.cdist(
+                    [word], choices.astype(f"U{n}").tolist(), scorer=Levenshtein.distance,
+                    score_cutoff=edits, dtype=np.int32,
+                )[0]
+                distance = d if distance is None else np.minimum(distance, d)
+        else:
+            distance = rf_process.cdist(
+                [word], choices.tolist(), scorer=Levenshtein.distance, score_cutoff=edits, dtype=np.int32,
+            )[0]
+
+        close = np.flatnonzero(distance <= edits)
+        ids = lo + close[np.lexsort((-self.word_counts[lo + close], distance[close]))]
+        return ids, np.full(len(ids), TYPO, dtype=np.int16)
+
+    def _matches(self, word, partial):
+        """``(word ids, qualities)`` of the vocabulary words one query word stands for, best first."""
+        if partial:
+            ids, quality = self._completions(word)
+            return (ids, quality) if len(ids) else self._corrections(word, partial)
+        i = bisect.bisect_left(self.words, word)
+        if i < len(self.words) and self.words[i] == word:
+            return np.array([i]), np.array([EXACT], dtype=np.int16)
+        ids, quality = self._corrections(word, partial)
+        return (ids, quality) if len(ids) else self._completions(word)
+
+    def _rows(self, ids, quality):
+        """Sorted rows of the names containing one of the words, and the best quality of each."""
+        rows, qualities, total = [], [], 0
+        for i, q in zip(ids[:MAX_EXPANSIONS].tolist(), quality.tolist()):
+            posting = self.postings[self.words[i]][:ROW_BUDGET - total]
+            rows.append(posting)
+            qualities.append(np.full(len(posting), q, dtype=np.int16))
+            total += len(posting)
+            if total >= ROW_BUDGET:
+                break
+        rows, qualities = np.concatenate(rows), np.concatenate(qualities)
+        order = np.lexsort((-qualities, rows))
+        rows, qualities = rows[order], qualities[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        return rows[first], qualities[first]
+
+    def _quality_in(self, rows, ids, quality):
+        """Best quality of the words found in each of ``rows`` (0: none), read off the forward index."""
+        table = np.zeros(len(self.words), dtype=np.int16)
+        table[ids] = quality
+        starts = self.forward_offsets[rows]
+        lengths = self.forward_offsets[rows + 1] - starts
+        # Every row here came out of a posting list, so none has zero words.
+        bounds = np.zeros(len(rows), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=bounds[1:])
+        positions = np.arange(lengths.sum()) + np.repeat(starts - bounds, lengths)
+        return np.maximum.reduceat(table[self.forward_words[positions]], bounds)
+
+    # ---------------------------------------------------------------------
+    def complete(self, query, limit=8):
+        """
+        Up to ``limit`` ``{"name", "eans"}`` suggestions for ``query`` as typed
+        so far (its last word may be unfinished), best first: names matching
+        the most words best, then those starting with the query, then the
+        shortest.
+        """
+        words = normalize_name(query).split()
+        if not words:
+            return []
+        partial = query[-1:].isalnum()
+        matches = [self._matches(w, partial and i == len(words) - 1) for i, w in enumerate(words)]
+        leading = matches[0][0]
+        # A word with no match (or none alongside the others, below) doesn't
+        # blank the list: a typo past the edit budget leaves the rest to narrow it.
+        matches = [m for m in matches if len(m[0])]
+        if not matches:
+            return []
+
+        # The most selective word picks the rows; the others only filter them.
+        matches.sort(key=lambda m: self.word_counts[m[0]].sum())
+        rows, score = self._rows(*matches[0])
+        for ids, quality in matches[1:]:
+            found = self._quality_in(rows, ids, quality)
+            keep = found > 0
+            if keep.any():
+                rows, score = rows[keep], score[keep] + found[keep]
+
+        starts = np.isin(self.first_words[rows], leading)
+        # Some extra rows for duplicate names and rows removed by a delta.
+        order = np.lexsort((rows, self.name_lengths[rows], ~starts, -score))[:limit * 4]
+
+        results, seen = [], set()
+        for row in rows[order].tolist():
+            record = self.catalogue.record(row)
+            name = self.catalogue.names[row]
+            if record is None or name in seen:
+                continue
+            seen.add(name)
+            results.append({"name": name, "eans": [display_ean(k) for k in split_eans(record.get("EAN"))]})
+            if len(results) == limit:
+                break
+        return results
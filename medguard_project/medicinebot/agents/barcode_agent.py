@@ -1,26 +1,299 @@
 # medicinebot/agents/barcode_agent.py
 
-from PIL import Image
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+import cv2
+import numpy as np
+from django.conf import settings
 from pyzbar.pyzbar import decode
 
+from .ean import is_valid_gtin
+from ..tracing import annotate, cache_event, traced, upload_size
+from .image_cache import fingerprint, image_cache
+from .image_prep import prepare_for_barcode
+
+# Whole-image time budget for the fallback attempts (seconds).
+BARCODE_TIME_BUDGET = 1.5
+BARCODE_WORKERS = 4
+# Candidate regions taken from the localization pass.
+MAX_ROIS = 3
+ROTATIONS = (30, -30, 60, -60)
+# ~6 px per module for an EAN-13 filling the crop
+MIN_CROP_WIDTH = 600
+# Independent reads (fast pass or fallbacks) that must agree on an EAN-8
+# before it is returned without waiting for the other attempts.
+EAN8_AGREEMENT = 2
+
+# zbar and OpenCV release the GIL, so attempts really run in parallel.
+# Shared by all requests: each request's attempts check its own stop flag,
+# so the ones still queued when it returns don't run on the next one's budget.
+_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, "BARCODE_WORKERS", BARCODE_WORKERS),
+    thread_name_prefix="barcode",
+)
+
+
+class _Stopped(Exception):
+    """The request an attempt belongs to has already returned."""
+
+
+def _payloads(image):
+    """Decoded strings found in ``image`` (numpy uint8 or PIL)."""
+    return [b.data.decode("utf-8", "replace") for b in decode(image)]
+
+
+def _best_gtin(payloads):
+    """
+    The longest valid GTIN in ``payloads``. An 8-digit hit is weak evidence:
+    a partial scan of a larger code sometimes passes the EAN-8 check digit,
+    so callers keep looking for a 12/13/14-digit code before settling.
+    """
+    found = [p for p in payloads if is_valid_gtin(p)]
+    return max(found, key=len) if found else None
+
+
+# ----------------------------------------------------------------------
+# Variants: each takes a grayscale uint8 array and returns one to scan.
+# ----------------------------------------------------------------------
+
+def _rotate(gray, angle):
+    h, w = gray.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    bw, bh = int(h * sin + w * cos), int(h * cos + w * sin)
+    matrix[0, 2] += bw / 2 - w / 2
+    matrix[1, 2] += bh / 2 - h / 2
+    return cv2.warpAffine(gray, matrix, (bw, bh), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+def _otsu(gray):
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    return cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def _adaptive(gray):
+    # Uneven light / shadows across the pack
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10)
+
+
+def _clahe(gray):
+    # Low-contrast print
+    return cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(gray)
+
+
+def locate_barcodes(gray, limit=MAX_ROIS):
+    """
+    Likely 1D-barcode regions, best first, as ``(box, angle)``: the four
+    corners of the region and the direction the code reads in (degrees).
+
+    Bars are strong edges that all point the same way. The structure tensor
+    (locally averaged gradient products) measures both: its trace is the
+    edge energy and its coherence how aligned the edges are, at any angle.
+    Printed text has the energy but not the coherence.
+    """
+    small = gray.astype(np.float32)
+    gx = cv2.Scharr(small, cv2.CV_32F, 1, 0)
+    gy = cv2.Scharr(small, cv2.CV_32F, 0, 1)
+    window = (15, 15)
+    jxx = cv2.blur(gx * gx, window)
+    jyy = cv2.blur(gy * gy, window)
+    jxy = cv2.blur(gx * gy, window)
+    energy = jxx + jyy
+    coherence = np.sqrt((jxx - jyy) ** 2 + 4 * jxy ** 2) / (energy + 1e-6)
+
+    strong = energy > np.percentile(energy, 75)
+    mask = ((coherence > 0.75) & strong).astype(np.uint8) * 255
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (15, 15)))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (9, 9)))
+
+    candidates = []
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < gray.size * 0.001:
+            continue
+        region = np.zeros(mask.shape, np.uint8)
+        cv2.drawContours(region, [contour], -1, 1, -1)
+        region = region.astype(bool)
+        # Mean gradient orientation = across the bars = reading direction
+        angle = 0.5 * np.degrees(np.arctan2(2 * jxy[region].sum(), (jxx - jyy)[region].sum()))
+        score = area * float(coherence[region].mean())
+        candidates.append((score, cv2.boxPoints(cv2.minAreaRect(contour)), angle))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    return [(box, angle) for _, box, angle in candidates[:limit]]
+
+
+def _crop(gray, roi, scale=1.0, margin=0.2):
+    """Crop of a located region, turned so its bars are vertical (``roi`` from an image ``scale`` times smaller)."""
+    box, angle = roi
+    box = box * scale
+    center = box.mean(axis=0)
+    matrix = cv2.getRotationMatrix2D((float(center[0]), float(center[1])), angle, 1.0)
+    corners = cv2.transform(box[None, :, :], matrix)[0]
+    (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+    pad_x, pad_y = (x1 - x0) * margin, (y1 - y0) * margin
+    x0, y0 = int(max(x0 - pad_x, 0)), int(max(y0 - pad_y, 0))
+    x1, y1 = int(x1 + pad_x), int(y1 + pad_y)
+    # Only warp the neighbourhood of the region, not the whole photo.
+    matrix[0, 2] -= x0
+    matrix[1, 2] -= y0
+    crop = cv2.warpAffine(gray, matrix, (max(x1 - x0, 1), max(y1 - y0, 1)), flags=cv2.INTER_LINEAR, borderValue=255)
+    if crop.shape[1] < MIN_CROP_WIDTH:
+        # zbar needs a few pixels per module
+        factor = MIN_CROP_WIDTH / crop.shape[1]
+        crop = cv2.resize(crop, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+    return crop
+
+
+class _FullSize:
+    """
+    Full-resolution grayscale image, decoded only if an attempt needs it.
+
+    Works on the upload's bytes, read once by the request thread: the
+    attempts must not seek/read the shared file object concurrently.
+    """
+
+    def __init__(self, data, stop):
+        self._data = data
+        self._stop = stop
+        self._lock = threading.Lock()
+        self._gray = None
+
+    def get(self):
+        with self._lock:
+            if self._gray is None:
+                # The slowest step of an attempt: not worth it for a request that's gone.
+                if self._stop.is_set():
+                    raise _Stopped()
+                img, _ = prepare_for_barcode(self._data, max_side=0)
+                self._gray = np.asarray(img)
+            return self._gray
+
+
+def _attempts(small, full, original_size):
+    """(name, callable) fallbacks in the order they are worth trying."""
+    scale = max(original_size) / max(small.shape)
+    attempts = []
+    for i, roi in enumerate(locate_barcodes(small)):
+        attempts.append((f"roi-{i}", lambda roi=roi: _payloads(_crop(small, roi))))
+        if scale > 1.01:
+            attempts.append((f"roi-{i}-full", lambda roi=roi: _payloads(_crop(full.get(), roi, scale))))
+    attempts += [
+        ("clahe", lambda: _payloads(_clahe(small))),
+        ("otsu", lambda: _payloads(_otsu(small))),
+        ("adaptive", lambda: _payloads(_adaptive(small))),
+    ]
+    attempts += [(f"rotate{angle}", lambda angle=angle: _payloads(_rotate(small, angle))) for angle in ROTATIONS]
+    if scale > 1.01:
+        attempts.append(("full", lambda: _payloads(full.get())))
+    return attempts
+
+
+def _run_attempt(attempt, stop):
+    # Attempts can't be interrupted once running, but the rest of a
+    # finished request's queue is skipped here.
+    if stop.is_set():
+        return []
+    try:
+        return attempt()
+    except _Stopped:
+        return []
+
+
+@traced("barcode")
 def run_barcode_agent(image_file):
     """
-    Decodes the first barcode found in the provided image file object.
-    
+    Decodes the first barcode found in the provided image file object
+    (or reuses the code read from an earlier copy of the same photo).
+
     :param image_file: A Django InMemoryUploadedFile object.
     :return: Decoded barcode data (str) or None.
     """
+    annotate(upload_bytes=upload_size(image_file))
+    try:
+        fp = fingerprint(image_file)
+    except Exception as e:
+        print(f"Barcode decoding error: {e}")
+        return None
+    if fp is not None:
+        cached = image_cache.get("barcode", fp)
+        cache_event("barcode", cached is not None)
+        if cached is not None:
+            return cached
+
+    barcode = _decode(image_file)
+    if fp is not None:
+        image_cache.set("barcode", fp, barcode)
+    return barcode
+
+
+def _decode(image_file):
+    """
+    Tiered: one fast pass on the downscaled grayscale image; if that finds no
+    valid EAN, ROI crops from gradient-based localization, contrast /
+    binarization variants, rotations and a full-size pass run in a small
+    thread pool, and the first valid EAN-13/UPC/GTIN-14 (correct GS1 check
+    digit) wins. An EAN-8 wins once EAN8_AGREEMENT reads (the fast pass
+    included) agree on it. Other EAN-8 and non-GTIN reads are only returned
+    if nothing better turns up within BARCODE_TIME_BUDGET seconds.
+    """
+    start = time.perf_counter()
     try:
-        # Open the image file object
-        img = Image.open(image_file)
-        
-        barcodes = decode(img)
-        
-        if barcodes:
-            return barcodes[0].data.decode('utf-8')
-        else:
-            return None
-            
+        image_file.seek(0)
+        data = image_file.read()
+        image_file.seek(0)
+        # Upright, grayscale, downscaled (see image_prep)
+        img, stats = prepare_for_barcode(data)
+        small = np.asarray(img)
+
+        payloads = _payloads(small)
+        ean = _best_gtin(payloads)
+        if ean and len(ean) > 8:
+            print(f"Barcode Agent: {ean} (fast pass, {(time.perf_counter() - start) * 1000:.0f} ms)")
+            return ean
+        # An EAN-8, or anything that isn't a GTIN (QR code, damaged read),
+        # is only a fallback until a second variant confirms it.
+        fallback = ean or (payloads[0] if payloads else None)
+        ean8_reads = Counter([ean] if ean else [])
+
+        budget = getattr(settings, "BARCODE_TIME_BUDGET", BARCODE_TIME_BUDGET)
+        stop = threading.Event()
+        full = _FullSize(data, stop)
+        futures = {
+            _pool.submit(_run_attempt, attempt, stop): name
+            for name, attempt in _attempts(small, full, stats["original_size"])
+        }
+        try:
+            remaining = budget - (time.perf_counter() - start)
+            for future in as_completed(futures, timeout=max(remaining, 0)):
+                try:
+                    payloads = future.result()
+                except Exception as e:
+                    print(f"Barcode Agent: {futures[future]} failed: {e}")
+                    continue
+                ean = _best_gtin(payloads)
+                if ean:
+                    ean8_reads[ean] += len(ean) == 8
+                if ean and (len(ean) > 8 or ean8_reads[ean] >= EAN8_AGREEMENT):
+                    print(f"Barcode Agent: {ean} ({futures[future]}, {(time.perf_counter() - start) * 1000:.0f} ms)")
+                    return ean
+                if ean and not is_valid_gtin(fallback or ""):
+                    fallback = ean
+                fallback = fallback or (payloads[0] if payloads else None)
+        except TimeoutError:
+            print(f"Barcode Agent: time budget ({budget}s) exhausted.")
+        finally:
+            stop.set()
+            for future in futures:
+                future.cancel()
+
+        if fallback:
+            print(f"Barcode Agent: settling for {fallback} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        return fallback
+
     except Exception as e:
         print(f"Barcode decoding error: {e}")
-        return None
\ No newline at end of file
+        return None
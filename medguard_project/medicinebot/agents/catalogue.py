@@ -0,0 +1,549 @@
+# medicinebot/agents/catalogue.py
+
+import bisect
+import copy
+import hashlib
+import json
+import os
+import shutil
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from .ean import ean_lookup_keys, normalize_ean, split_eans
+from .name_index import NameIndex
+
+COMPILED_FORMAT_VERSION = 2
+MANIFEST_NAME = "manifest.json"
+
+
+class StringColumn:
+    """
+    Read-only string column backed by a memory-mapped string table.
+
+    ``offsets[i]:offsets[i + 1]`` is the UTF-8 slice of row ``i`` inside
+    ``data``; ``nulls[i]`` marks missing cells. Every worker that opens the
+    same files shares one copy of them through the OS page cache.
+    """
+
+    def __init__(self, offsets, data, nulls):
+        # Plain ndarray views over the maps: indexing a np.memmap is slow.
+        self.offsets = np.asarray(offsets)
+        self.data = np.asarray(data)
+        self.nulls = np.asarray(nulls)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if self.nulls[i]:
+            return float("nan")  # what pandas gives for a missing cell
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        """Decode the whole column in one pass (much faster than row-by-row)."""
+        raw = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [
+            float("nan") if null else raw[offsets[i]:offsets[i + 1]].decode("utf-8")
+            for i, null in enumerate(self.nulls.tolist())
+        ]
+
+
+class OverlayColumn:
+    """
+    Copy-on-write view of a column: ``overrides`` (row_id -> value) shadow
+    ``base``, and rows past its end are appended ones. A delta changes a
+    few names without copying (or decoding) the others.
+    """
+
+    def __init__(self, base):
+        if isinstance(base, OverlayColumn):
+            self.base, self.overrides, self.size = base.base, dict(base.overrides), base.size
+        else:
+            self.base, self.overrides, self.size = base, {}, len(base)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if i in self.overrides:
+            return self.overrides[i]
+        return self.base[i]
+
+    def __setitem__(self, i, value):
+        self.overrides[i] = value
+
+    def append(self, value):
+        self.overrides[self.size] = value
+        self.size += 1
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        values = list(_as_list(self.base))
+        values.extend([None] * (self.size - len(values)))
+        for i, value in self.overrides.items():
+            values[i] = value
+        return values
+
+
+def _as_list(values):
+    return values.tolist() if isinstance(values, (StringColumn, OverlayColumn)) else values
+
+
+def name_hash(name):
+    """Stable 64-bit key of a name (Python's ``hash`` differs between processes)."""
+    return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def ean_hash(key):
+    """A normalized 14-digit EAN key as an integer."""
+    return int(key)
+
+
+class ArrayLookup:
+    """
+    Read-only ``key -> row_id`` mapping over two (memory-mapped) arrays:
+    ``hashes`` sorted, ``rows`` aligned with it, binary-searched in place.
+    Rows sharing a hash are checked with ``key_at``
+    (row_id -> its key) when the hash is not the key itself.
+    """
+
+    def __init__(self, hashes, rows, hash_key, key_at=None):
+        # Plain ndarray views: searching a np.memmap is slower.
+        self.hashes = np.asarray(hashes)
+        self.rows = np.asarray(rows)
+        self.hash_key = hash_key
+        self.key_at = key_at
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        h = self.hash_key(key)
+        # bisect over the array is quicker than np.searchsorted for one key.
+        i = bisect.bisect_left(self.hashes, h)
+        while i < len(self.hashes) and self.hashes[i] == h:
+            row_id = int(self.rows[i])
+            if self.key_at is None or self.key_at(row_id) == key:
+                return row_id
+            i += 1
+        return default
+
+
+class LookupOverlay:
+    """
+    Copy-on-write ``key -> row_id`` mapping: ``overrides`` shadow ``base``
+    (an ``ArrayLookup``); a None override is a deleted key. Supports the
+    dict methods the catalogue and its callers use.
+    """
+
+    def __init__(self, base, overrides=None):
+        self.base = base
+        self.overrides = overrides or {}
+
+    def copy(self):
+        return LookupOverlay(self.base, dict(self.overrides))
+
+    def get(self, key, default=None):
+        if key in self.overrides:
+            row_id = self.overrides[key]
+            return default if row_id is None else row_id
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        row_id = self.get(key)
+        if row_id is None:
+            raise KeyError(key)
+        return row_id
+
+    def __setitem__(self, key, row_id):
+        self.overrides[key] = row_id
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.overrides[key] = None
+
+    def setdefault(self, key, row_id):
+        current = self.get(key)
+        if current is None:
+            self.overrides[key] = row_id
+            return row_id
+        return current
+
+
+def _first_rows(keys):
+    """``(sorted unique keys, first row of each)`` for a row-aligned key array."""
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first], order[first].astype(np.int32)
+
+
+class Catalogue:
+    """
+    One immutable snapshot of the medicine catalogue and its lookup indexes.
+
+    ``columns`` maps each CSV column to a row-aligned sequence (plain lists
+    for a CSV load, memory-mapped arrays for a compiled catalogue). A
+    compiled catalogue also brings its name / EAN lookups as arrays, so
+    names are only decoded for the rows a search looks at.
+    """
+
+    def __init__(self, columns, source, records=None, name_index=None, name_lookup=None, ean_lookup=None):
+        self.columns = columns
+        self.column_names = list(columns)
+        self.source = str(source)
+        names = columns["Name"]
+        self.names = names if isinstance(names, StringColumn) else [str(n) for n in names]
+        self.size = len(self.names)
+        self.records = records
+        # row_id -> record for rows changed/added by a delta (None = removed).
+        self.row_overrides = {}
+        self.name_index = name_index or NameIndex(self.names)
+        self.name_lookup = name_lookup
+        self.ean_lookup = ean_lookup
+        if name_lookup is None:
+            self.name_lookup, self.ean_lookup = {}, {}
+            for row_id, name in enumerate(self.names):
+                # First occurrence wins, same as the old `.iloc[0]` on a mask.
+                self.name_lookup.setdefault(name, row_id)
+            for row_id, cell in enumerate(_as_list(columns.get("EAN", ()))):
+                for code in split_eans(cell):
+                    for key in ean_lookup_keys(code):
+                        self.ean_lookup.setdefault(key, row_id)
+
+    def record(self, row_id):
+        """The catalogue row as a dict (shared, treat it as read-only)."""
+        if row_id in self.row_overrides:
+            return self.row_overrides[row_id]
+        if self.records is not None:
+            return self.records[row_id]
+        return {col: values[row_id] for col, values in self.columns.items()}
+
+    def candidate_rows(self, query, limit=300):
+        """Row ids of the name-index shortlist for ``query``, in row order."""
+        return self.name_index.shortlist(query, limit)
+
+    def candidates(self, query, limit=300):
+        """Names of the name-index shortlist for ``query`` (what the fuzzy scorers look at)."""
+        return [self.names[i] for i in self.candidate_rows(query, limit)]
+
+    def find_ean(self, identifier):
+        row_id = self.ean_lookup.get(normalize_ean(identifier))
+        return None if row_id is None else self.record(row_id)
+
+    def find_name(self, name):
+        row_id = self.name_lookup.get(name)
+        return None if row_id is None else self.record(row_id)
+
+    def live_rows(self):
+        """Row ids that have not been removed by a delta."""
+        return (i for i in range(self.size) if self.row_overrides.get(i, True) is not None)
+
+    # ---------------------------------------------------------------------
+    def _index_eans(self, row_id, record):
+        for code in split_eans(record.get("EAN")):
+            for key in ean_lookup_keys(code):
+                self.ean_lookup.setdefault(key, row_id)
+
+    def _unindex_eans(self, row_id, record):
+        for code in split_eans(record.get("EAN")):
+            for key in ean_lookup_keys(code):
+                if self.ean_lookup.get(key) == row_id:
+                    del self.ean_lookup[key]
+
+    def apply_delta(self, added=(), removed=(), changed=None):
+        """
+        Return a new snapshot with the given row changes, without rebuilding.
+
+        ``added`` is a list of records, ``removed`` a list of row ids and
+        ``changed`` a ``{row_id: record}`` dict. Removed rows become
+        tombstones so row ids stay stable; only the posting lists, lookup
+        entries and records they touch are rewritten. ``self`` is not
+        modified, so searches that already hold it keep a consistent view.
+        """
+        new = copy.copy(self)
+        new.names = OverlayColumn(self.names)
+        new.name_lookup = self.name_lookup.copy()
+        new.ean_lookup = self.ean_lookup.copy()
+        new.row_overrides = dict(self.row_overrides)
+        index_added, index_removed = {}, {}
+        orphaned = set()
+
+        def drop(row_id):
+            old = new.record(row_id)
+            name = new.names[row_id]
+            new._unindex_eans(row_id, old)
+            index_removed[row_id] = name
+            new.names[row_id] = ""
+            new.row_overrides[row_id] = None
+            if new.name_lookup.get(name) == row_id:
+                del new.name_lookup[name]
+                orphaned.add(name)
+
+        def put(row_id, record):
+            name = str(record["Name"])
+            new.names[row_id] = name
+            new.row_overrides[row_id] = record
+            new._index_eans(row_id, record)
+            index_added[row_id] = name
+            if new.name_lookup.get(name, row_id) >= row_id:
+                new.name_lookup[name] = row_id
+
+        for row_id in removed:
+            drop(row_id)
+        for row_id, record in (changed or {}).items():
+            drop(row_id)
+            put(row_id, record)
+        for record in added:
+            new.names.append("")
+            put(len(new.names) - 1, record)
+
+        orphaned = {name for name in orphaned if name not in new.name_lookup}
+        if orphaned:
+            # A removed row may have shadowed a duplicate name further down.
+            for row_id, name in enumerate(new.names):
+                if name in orphaned:
+                    new.name_lookup[name] = row_id
+                    orphaned.discard(name)
+
+        new.size = len(new.names)
+        new.name_index = self.name_index.updated(index_added, index_removed)
+        return new
+
+
+# ---------------------------------------------------------------------
+# Loaders
+# ---------------------------------------------------------------------
+def read_catalogue_csv(csv_path):
+    """Parse the CSV with pandas (imported here so workers that use a compiled catalogue never load it)."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_path, dtype={"EAN": str})
+    df["EAN"] = df["EAN"].astype(str).str.strip()
+    df["Name"] = df["Name"].fillna("").astype(str).str.strip()
+    return df
+
+
+def catalogue_from_frame(df, source):
+    columns = {col: df[col].tolist() for col in df.columns}
+    return Catalogue(columns, source, records=df.to_dict("records"))
+
+
+def load_csv_catalogue(csv_path):
+    return catalogue_from_frame(read_catalogue_csv(csv_path), csv_path)
+
+
+def _nan_to_none(values):
+    # NaN != NaN would make every row with an empty cell look "changed".
+    return [None if v != v else v for v in values]
+
+
+def _row_fingerprints(catalogue):
+    columns = [_nan_to_none(_as_list(catalogue.columns[c])) for c in catalogue.column_names]
+    rows = list(zip(*columns))
+    rows.extend([None] * (catalogue.size - len(rows)))
+    for row_id, record in catalogue.row_overrides.items():
+        if record is not None:
+            rows[row_id] = tuple(_nan_to_none(record[c] for c in catalogue.column_names))
+    return rows
+
+
+def diff_catalogue(catalogue, df):
+    """
+    Compare the live rows of ``catalogue`` with a freshly read CSV frame.
+
+    Rows are matched on (Name, n-th occurrence of that Name), so duplicate
+    names in the CSV are handled. Returns ``(added, removed, changed)`` in
+    the shape ``Catalogue.apply_delta`` expects, or None if the columns
+    changed and only a full rebuild makes sense.
+    """
+    column_names = list(df.columns)
+    if column_names != catalogue.column_names:
+        return None
+
+    old_rows = _row_fingerprints(catalogue)
+    seen = Counter()
+    old_ids = {}
+    for row_id in catalogue.live_rows():
+        name = catalogue.names[row_id]
+        seen[name] += 1
+        old_ids[(name, seen[name])] = row_id
+
+    new_rows = zip(*(_nan_to_none(df[c].tolist()) for c in column_names))
+    name_pos = column_names.index("Name")
+    seen.clear()
+    added, changed = [], {}
+    for row in new_rows:
+        name = str(row[name_pos])
+        seen[name] += 1
+        row_id = old_ids.pop((name, seen[name]), None)
+        if row_id is not None and old_rows[row_id] == row:
+            continue
+        record = {c: float("nan") if v is None else v for c, v in zip(column_names, row)}
+        if row_id is None:
+            added.append(record)
+        else:
+            changed[row_id] = record
+    removed = sorted(old_ids.values())
+    return added, removed, changed
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"source_mtime_ns": stat.st_mtime_ns, "source_size": stat.st_size}
+
+
+def compile_catalogue(csv_path, out_dir):
+    """
+    Write the compiled catalogue for ``csv_path`` into ``out_dir``.
+
+    Numeric columns become ``.npy`` arrays, text columns an offsets array
+    plus one UTF-8 string table, and the name index is stored in CSR form
+    so workers don't have to rebuild it. The directory is written next to
+    its final location and swapped in with a rename.
+    """
+    df = read_catalogue_csv(csv_path)
+    out_dir = Path(out_dir)
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    manifest = {
+        "format": COMPILED_FORMAT_VERSION,
+        "rows": len(df),
+        "source": str(csv_path),
+        **_source_stamp(csv_path),
+        "columns": [],
+    }
+    for i, col in enumerate(df.columns):
+        stem = f"c{i:02d}"
+        series = df[col]
+        if series.dtype.kind in "biuf":
+            np.save(tmp_dir / f"{stem}.values.npy", series.to_numpy(dtype=np.float64))
+            manifest["columns"].append({"name": col, "kind": "float", "file": stem})
+            continue
+
+        nulls = series.isna().to_numpy()
+        encoded = [b"" if null else str(v).encode("utf-8") for v, null in zip(series.tolist(), nulls)]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        np.save(tmp_dir / f"{stem}.offsets.npy", offsets)
+        np.save(tmp_dir / f"{stem}.nulls.npy", nulls)
+        (tmp_dir / f"{stem}.strings.bin").write_bytes(b"".join(encoded))
+        manifest["columns"].append({"name": col, "kind": "string", "file": stem})
+
+    # name / EAN -> first row, as sorted arrays the workers search in place.
+    names = df["Name"].tolist()
+    hashes, rows = _first_rows(np.array([name_hash(n) for n in names], dtype=np.uint64))
+    np.save(tmp_dir / "names.hashes.npy", hashes)
+    np.save(tmp_dir / "names.rows.npy", rows)
+    ean_keys, ean_rows = [], []
+    for row_id, cell in enumerate(df["EAN"].tolist() if "EAN" in df.columns else ()):
+        for code in split_eans(cell):
+            for key in ean_lookup_keys(code):
+                ean_keys.append(ean_hash(key))
+                ean_rows.append(row_id)
+    ean_keys, first = _first_rows(np.array(ean_keys, dtype=np.int64))
+    np.save(tmp_dir / "eans.keys.npy", ean_keys)
+    np.save(tmp_dir / "eans.rows.npy", np.array(ean_rows, dtype=np.int32)[first])
+
+    index = NameIndex(names).to_arrays()
+    for table, (keys, offsets, ids) in index.items():
+        # Fixed-width and sorted, so workers can map and search it in place.
+        np.save(tmp_dir / f"{table}.keys.npy", np.array(keys, dtype=str))
+        np.save(tmp_dir / f"{table}.offsets.npy", offsets)
+        np.save(tmp_dir / f"{table}.ids.npy", ids)
+
+    (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    old_dir = out_dir.with_name(f"{out_dir.name}.old-{os.getpid()}")
+    if out_dir.exists():
+        out_dir.rename(old_dir)
+    tmp_dir.rename(out_dir)
+    # Workers that still have the old files mapped keep reading them fine.
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def load_compiled_catalogue(compiled_dir):
+    compiled_dir = Path(compiled_dir)
+    manifest = json.loads((compiled_dir / MANIFEST_NAME).read_text(encoding="utf-8"))
+    if manifest.get("format") != COMPILED_FORMAT_VERSION:
+        raise ValueError(f"unsupported compiled catalogue format {manifest.get('format')}")
+
+    columns = {}
+    for col in manifest["columns"]:
+        stem = compiled_dir / col["file"]
+        if col["kind"] == "float":
+            columns[col["name"]] = np.load(f"{stem}.values.npy", mmap_mode="r")
+        else:
+            columns[col["name"]] = StringColumn(
+                np.load(f"{stem}.offsets.npy", mmap_mode="r"),
+                np.memmap(f"{stem}.strings.bin", dtype=np.uint8, mode="r")
+                if os.path.getsize(f"{stem}.strings.bin") else np.zeros(0, dtype=np.uint8),
+                np.load(f"{stem}.nulls.npy", mmap_mode="r"),
+            )
+
+    tables = {}
+    for table in ("trigrams", "tokens"):
+        tables[table] = (
+            np.load(compiled_dir / f"{table}.keys.npy", mmap_mode="r"),
+            np.load(compiled_dir / f"{table}.offsets.npy", mmap_mode="r"),
+            np.load(compiled_dir / f"{table}.ids.npy", mmap_mode="r"),
+        )
+    name_index = NameIndex.from_arrays(manifest["rows"], **tables)
+
+    names = columns["Name"]
+    name_lookup = ArrayLookup(
+        np.load(compiled_dir / "names.hashes.npy", mmap_mode="r"),
+        np.load(compiled_dir / "names.rows.npy", mmap_mode="r"),
+        name_hash, key_at=names.__getitem__,
+    )
+    ean_lookup = ArrayLookup(
+        np.load(compiled_dir / "eans.keys.npy", mmap_mode="r"),
+        np.load(compiled_dir / "eans.rows.npy", mmap_mode="r"),
+        ean_hash,
+    )
+    catalogue = Catalogue(
+        columns, compiled_dir, name_index=name_index,
+        name_lookup=LookupOverlay(name_lookup), ean_lookup=LookupOverlay(ean_lookup),
+    )
+    return catalogue, manifest
+
+
+def compiled_is_current(compiled_dir, csv_path):
+    """True if ``compiled_dir`` was built from the CSV as it is on disk right now."""
+    if not compiled_dir:
+        return False
+    manifest_path = Path(compiled_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return False
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if manifest.get("format") != COMPILED_FORMAT_VERSION:
+        return False  # written by an older version: recompile it
+    if not csv_path or not os.path.exists(csv_path):
+        return True  # the compiled copy is all we have
+    stamp = _source_stamp(csv_path)
+    return all(manifest.get(k) == v for k, v in stamp.items())
+
+
+def load_catalogue(csv_path, compiled_dir=None):
+    """Prefer an up-to-date compiled catalogue; fall back to parsing the CSV."""
+    if compiled_dir and compiled_is_current(compiled_dir, csv_path):
+        catalogue, _ = load_compiled_catalogue(compiled_dir)
+        return catalogue
+    if compiled_dir and Path(compiled_dir, MANIFEST_NAME).exists():
+        print(f"Catalogue: compiled copy at {compiled_dir} is stale, reading {csv_path} instead.")
+    return load_csv_catalogue(csv_path)
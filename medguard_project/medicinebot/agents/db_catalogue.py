@@ -0,0 +1,242 @@
+# medicinebot/agents/db_catalogue.py
+
+from django.db import DatabaseError, connection
+from django.db.models import Max
+from rapidfuzz.distance import Levenshtein
+
+from ..models import Medicine, MedicineBarcode
+from .autocomplete import TYPO_MIN_LENGTH, display_ean
+from .ean import normalize_ean, split_eans
+from .name_index import normalize_name
+
+FTS_TABLE = "medicinebot_medicine_fts"
+VOCAB_TABLE = "medicinebot_medicine_fts_vocab"
+
+# bm25 scores every row a MATCH returns, so the fallback query only uses the
+# rarest trigrams, up to this many postings per shortlisted name (or this
+# share of the catalogue, if more): "syr" or "250" would each pull in a tenth
+# of the catalogue and rank none of it better.
+POSTINGS_PER_CANDIDATE = 10
+POSTINGS_SHARE = 0.01
+# Type-ahead: names read from the index per suggestion asked for, before
+# they are ordered like the in-memory suggestions.
+SUGGESTION_SCAN = 25
+
+# CSV header -> Medicine field (the CSV header really is "Type ", with the space).
+COLUMN_FIELDS = {
+    "Name": "name",
+    "Type ": "medicine_type",
+    "Uses": "used_for",
+    "Content": "content",
+    "Side Effects": "side_effects",
+    "EAN": "ean",
+}
+
+
+def medicine_record(medicine):
+    """A Medicine as the dict the in-memory catalogue returns for its row (CSV headers as keys)."""
+    return {column: getattr(medicine, field) for column, field in COLUMN_FIELDS.items()}
+
+
+def query_tokens(query):
+    """Distinct normalized words of ``query`` (under 3 characters FTS5's trigram tokenizer can't match them)."""
+    return list(dict.fromkeys(t for t in normalize_name(query).split() if len(t) >= 3))
+
+
+def token_trigrams(token):
+    return [token[i:i + 3] for i in range(len(token) - 2)]
+
+
+def _starts_word(word, name_words, max_edits):
+    """A word of the name starts with ``word`` (or nearly: within the edits ``AutocompleteIndex`` allows)."""
+    if any(n.startswith(word) for n in name_words):
+        return True
+    if len(word) < TYPO_MIN_LENGTH or not max_edits:
+        return False
+    edits = min(max_edits, 1 if len(word) < 8 else 2)
+    # Against the name word's beginnings of about the typed length.
+    return any(
+        Levenshtein.distance(word, n[:size], score_cutoff=edits) <= edits
+        for n in name_words
+        for size in range(max(1, len(word) - edits), len(word) + edits + 1)
+    )
+
+
+def _narrow(rows, words, max_edits, partial=True):
+    """
+    ``(name, ean)`` rows matching the typed words; a word no row matches is
+    skipped. Like ``AutocompleteIndex``, only the last word (while it is
+    still being typed, ``partial``) is a prefix; the others match as whole
+    words when some name has them.
+    """
+    split = [(row, normalize_name(row[0]).split()) for row in rows]
+    matched = False
+    for i, word in enumerate(words):
+        kept = []
+        if not (partial and i == len(words) - 1):
+            kept = [(row, name_words) for row, name_words in split if word in name_words]
+        kept = kept or [(row, name_words) for row, name_words in split if _starts_word(word, name_words, max_edits)]
+        if kept:
+            split, matched = kept, True
+    return [row for row, _ in split] if matched else []
+
+
+def fts_available():
+    """True if the database has the FTS5 name index (SQLite, migration 0009)."""
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+class DatabaseCatalogue:
+    """
+    The search agent's catalogue when SEARCH_BACKEND = "database": the
+    ``Medicine`` table (filled by ``manage.py sync_medicines``) instead of
+    a copy of the CSV in every worker.
+
+    ``candidates`` plays the part of the in-memory ``NameIndex``: indexed
+    FTS5 ``MATCH`` queries ranked by bm25 narrow the table down to a
+    shortlist for the fuzzy scorers, reading posting lists rather than
+    every name.
+
+    The row count is read once per process and again on each ``refresh``
+    (the search agent's reload), not on every search.
+    """
+
+    source = "database"
+
+    def __init__(self):
+        self.size = 0
+        self.refresh()
+
+    def refresh(self):
+        """Recount the rows (after ``manage.py sync_medicines``); returns the new size."""
+        # Rows are numbered 0..n-1 by the sync; the max comes off the unique index.
+        last = Medicine.objects.aggregate(last=Max("row"))["last"]
+        self.size = 0 if last is None else last + 1
+        return self.size
+
+    def _doc_frequencies(self, cursor, grams):
+        """``{trigram: names containing it}`` for those of ``grams`` in the index."""
+        placeholders = ", ".join(["%s"] * len(grams))
+        cursor.execute(f"SELECT term, doc FROM {VOCAB_TABLE} WHERE term IN ({placeholders})", list(grams))
+        return dict(cursor.fetchall())
+
+    def _match(self, cursor, match, limit):
+        cursor.execute(
+            f"SELECT m.row, m.name FROM {FTS_TABLE} f JOIN medicinebot_medicine m ON m.id = f.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s ORDER BY f.rank LIMIT %s",
+            [match, limit],
+        )
+        return [name for _, name in sorted(cursor.fetchall())]
+
+    def candidates(self, query, limit=300):
+        """
+        Up to ``limit`` catalogue names for ``query``, in catalogue order
+        (small catalogues: every name).
+
+        1. Every word of the query is in the index: the names containing
+           all of them.
+        2. Otherwise (typos, OCR noise), or if no name has them all: the
+           names sharing the most of the query's rarest trigrams.
+        """
+        if self.size <= limit:
+            return list(Medicine.objects.values_list("name", flat=True))
+
+        tokens = query_tokens(query)
+        grams = sorted({g for token in tokens for g in token_trigrams(token)})
+        if not grams:
+            return []
+        with connection.cursor() as cursor:
+            doc_freq = self._doc_frequencies(cursor, grams)
+            if all(g in doc_freq for g in grams):
+                names = self._match(cursor, " AND ".join(f'"{t}"' for t in tokens), limit)
+                if names:
+                    return names
+
+            budget = max(limit * POSTINGS_PER_CANDIDATE, int(self.size * POSTINGS_SHARE))
+            rarest, total = [], 0
+            for gram, doc in sorted(doc_freq.items(), key=lambda item: (item[1], item[0])):
+                if rarest and total + doc > budget:
+                    break
+                rarest.append(gram)
+                total += doc
+            if not rarest:
+                return []
+            return self._match(cursor, " OR ".join(f'"{g}"' for g in rarest), limit)
+
+    def complete(self, query, limit=8, max_edits=2):
+        """
+        Type-ahead from the FTS5 index, as ``AutocompleteIndex.complete``
+        returns it: names with each word typed (the last one, unfinished,
+        as a prefix; a word none has is left out), those starting with the
+        first word first,
+        then the shortest. Words under 3 characters can't be looked up, only
+        narrow down the others' names. With no such name, a misspelt word
+        is matched within ``max_edits`` among the ``candidates`` shortlist.
+        """
+        words = normalize_name(query).split()
+        tokens = [w for w in words if len(w) >= 3]
+        if not tokens:
+            return []
+        partial = query[-1:].isalnum()
+        scan = limit * SUGGESTION_SCAN
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT m.name, m.ean FROM {FTS_TABLE} f JOIN medicinebot_medicine m ON m.id = f.rowid "
+                f"WHERE {FTS_TABLE} MATCH %s ORDER BY f.rank LIMIT %s",
+                [" AND ".join(f'"{t}"' for t in tokens), scan],
+            )
+            rows = _narrow(cursor.fetchall(), words, 0, partial)
+        if not rows:
+            names = self.candidates(query, scan)
+            eans = dict(Medicine.objects.filter(name__in=names).order_by("-row").values_list("name", "ean"))
+            rows = _narrow([(name, eans.get(name)) for name in names], words, max_edits, partial)
+
+        rows.sort(key=lambda row: (not normalize_name(row[0]).startswith(words[0]), len(row[0]), row[0]))
+        results, seen = [], set()
+        for name, ean in rows:
+            if name in seen:
+                continue
+            seen.add(name)
+            results.append({"name": name, "eans": [display_ean(k) for k in split_eans(ean)]})
+            if len(results) == limit:
+                break
+        return results
+
+    def find_name(self, name):
+        medicine = Medicine.objects.filter(name=name).order_by("row").first()
+        return None if medicine is None else medicine_record(medicine)
+
+    def find_ean(self, identifier):
+        key = normalize_ean(identifier)
+        if key is None:
+            return None
+        barcode = (
+            MedicineBarcode.objects.filter(code=key)
+            .select_related("medicine")
+            .order_by("medicine__row")
+            .first()
+        )
+        return None if barcode is None else medicine_record(barcode.medicine)
+
+
+def load_database_catalogue():
+    """A ``DatabaseCatalogue``, or None (with the reason printed) if the database can't serve searches."""
+    try:
+        if not fts_available():
+            print("SearchAgent ERROR: SEARCH_BACKEND is \"database\" but the FTS5 name index is missing "
+                  "(SQLite only; run `manage.py migrate`).")
+            return None
+        catalogue = DatabaseCatalogue()
+        size = catalogue.size
+    except DatabaseError as e:
+        print(f"SearchAgent ERROR opening the database catalogue: {e}")
+        return None
+    if not size:
+        print("SearchAgent ERROR: the Medicine table is empty; run `manage.py sync_medicines`.")
+        return None
+    print(f" Search Agent: Searching {size} medicines in the database (FTS5).")
+    return catalogue
@@ -0,0 +1,68 @@
+# medicinebot/agents/ean.py
+
+import re
+
+# Several codes can share one catalogue cell: "8901571007356, 8901571007363"
+_EAN_SEPARATORS = re.compile(r"[,;/|]+")
+_NON_DIGIT = re.compile(r"\D")
+
+GTIN_LENGTH = 14
+
+
+def gtin_check_digit(body):
+    """GS1 mod-10 check digit for the digits in ``body`` (check digit excluded)."""
+    total = 0
+    for i, ch in enumerate(reversed(body)):
+        total += int(ch) * (3 if i % 2 == 0 else 1)
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_gtin(code):
+    """True if ``code`` is an EAN-8 / UPC-A / EAN-13 / GTIN-14 with a correct check digit."""
+    if not code or not code.isdigit() or len(code) not in (8, 12, 13, 14):
+        return False
+    return gtin_check_digit(code[:-1]) == code[-1]
+
+
+def normalize_ean(raw):
+    """
+    Canonical lookup key for a scanned or catalogue barcode.
+
+    Every EAN-8, UPC-A and EAN-13 is zero-padded to a 14-digit GTIN, so
+    "036000291452" (UPC-A) and "0036000291452" (EAN-13) hit the same entry and
+    codes that lost their leading zeros in a spreadsheet still match.
+    Returns None if there is nothing that looks like a barcode.
+    """
+    if raw is None:
+        return None
+    digits = _NON_DIGIT.sub("", str(raw))
+    if not digits or len(digits) > GTIN_LENGTH:
+        return None
+    return digits.zfill(GTIN_LENGTH)
+
+
+def split_eans(cell):
+    """All normalized codes stored in one catalogue cell (may be empty)."""
+    if not isinstance(cell, str):
+        return []
+    codes = []
+    for part in _EAN_SEPARATORS.split(cell):
+        key = normalize_ean(part)
+        if key and int(key):
+            codes.append(key)
+    return codes
+
+
+def ean_lookup_keys(key):
+    """
+    Keys under which a catalogue code should be indexed.
+
+    Codes that fail the checksum were most likely typed in without their
+    check digit, so the completed code is indexed as well.
+    """
+    keys = [key]
+    if not is_valid_gtin(key):
+        completed = normalize_ean(key.lstrip("0") + gtin_check_digit(key.lstrip("0")))
+        if completed:
+            keys.append(completed)
+    return keys
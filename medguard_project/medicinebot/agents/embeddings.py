@@ -0,0 +1,125 @@
+# medicinebot/agents/embeddings.py
+
+import re
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+EMBEDDING_MODEL = "nomic-embed-text"
+HASHING_DIM = 1024
+# Seconds a search waits for its query vector (slot included) before it
+# gives up on the semantic phase.
+QUERY_TIMEOUT = 2.0
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class OllamaEmbedder:
+    """
+    Embeddings from a local Ollama model (``ollama pull nomic-embed-text``).
+    One ``/api/embed`` call per batch; the client is thread-safe, so batches
+    can be sent from several threads at once. Query embeddings go through
+    the LLM gateway (its slots, and EMBEDDING_QUERY_TIMEOUT), since they
+    sit on the request path: an HTTP round trip per search, so an index
+    built with it gives up the in-process latency of ``HashingEmbedder``.
+    """
+
+    def __init__(self, model=None, host=None):
+        import ollama
+
+        self.model = model or getattr(settings, "EMBEDDING_MODEL", EMBEDDING_MODEL)
+        self.host = host
+        self.client = ollama.Client(host=host)
+        # nomic-embed-text is trained with task prefixes.
+        self._prefixes = ("search_document: ", "search_query: ") if self.model.startswith("nomic-embed") else ("", "")
+
+    @property
+    def id(self):
+        return f"ollama:{self.model}"
+
+    def _embed(self, texts):
+        response = self.client.embed(model=self.model, input=texts)
+        return _normalize(np.asarray(response["embeddings"], dtype=np.float32))
+
+    def embed_documents(self, texts):
+        return self._embed([self._prefixes[0] + t for t in texts])
+
+    def embed_query(self, text):
+        if self.host:
+            return self._embed([self._prefixes[1] + text])[0]
+        from .llm_gateway import llm_gateway
+
+        embeddings = llm_gateway.embed(
+            self.model, [self._prefixes[1] + text],
+            timeout=getattr(settings, "EMBEDDING_QUERY_TIMEOUT", QUERY_TIMEOUT),
+        )
+        return _normalize(np.asarray(embeddings, dtype=np.float32))[0]
+
+
+class HashingEmbedder:
+    """
+    Model-free embeddings: words and character trigrams hashed into
+    HASHING_DIM signed buckets. Lexical rather than semantic, but fully
+    offline, deterministic and fast, and the trigrams still line up
+    garbled OCR spellings with the right name.
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim or getattr(settings, "EMBEDDING_HASHING_DIM", HASHING_DIM)
+
+    @property
+    def id(self):
+        return f"hashing:{self.dim}"
+
+    def _features(self, text):
+        for word in WORD_RE.findall(text.lower()):
+            yield word
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield "#" + padded[i:i + 3]
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+    def embed_documents(self, texts):
+        return _normalize(np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32))
+
+    def embed_query(self, text):
+        return _normalize(self._vector(text)[None, :])[0]
+
+
+def _normalize(vectors):
+    # Unit vectors: cosine similarity is then a plain dot product.
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+EMBEDDERS = {
+    "ollama": OllamaEmbedder,
+    "hashing": HashingEmbedder,
+}
+
+
+def embedder_from_id(embedder_id):
+    """The embedder that produced an index, from its manifest ``embedder`` id."""
+    kind, _, arg = embedder_id.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(dim=int(arg))
+    if kind == "ollama":
+        return OllamaEmbedder(model=arg)
+    raise ImproperlyConfigured(f"Unknown embedder in vector index: {embedder_id!r}")
+
+
+def get_embedder(name=None):
+    """A new embedder for ``name`` (default: settings.EMBEDDING_BACKEND)."""
+    name = name or getattr(settings, "EMBEDDING_BACKEND", "hashing")
+    try:
+        return EMBEDDERS[name]()
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown EMBEDDING_BACKEND: {name!r}")
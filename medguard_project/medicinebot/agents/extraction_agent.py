@@ -1,65 +1,132 @@
-import ollama
+import asyncio
 import json
 
-def run_extraction_agent(raw_text: str) -> dict:
+from django.conf import settings
+from django.utils import timezone
+
+from .field_parser import extract_fields, format_month_year, format_price, name_candidates, parse_date
+from ..tracing import annotate, cache_event, traced
+from .image_cache import cache_enabled, image_cache
+from .llm_gateway import LLMError, llm_gateway
+from .search_agent import search_agent_instance
+
+EXTRACTION_MODEL = "phi3"
+
+FIELDS = ("Name", "MFG Date", "Expiry Date", "MRP")
+
+# What each field looks like, used to build a prompt for only the missing ones.
+FIELD_HINTS = {
+    "Name": """The brand name of the medicine (e.g., "Crocin", "Rantac 150", "Zenadol").
+    This is almost always at the top and in the largest font.
+    This is NOT an instruction (like "Store at room temperature"), a company name (like "GSK"), or an ingredient (like "Paracetamol").""",
+    "MFG Date": """The manufacturing date (e.g., "04/2024", "MFG: 05/25").""",
+    "Expiry Date": """The expiry date (e.g., "03/2026", "EXP: 04/27").""",
+    "MRP": """The price (e.g., "Rs. 25.50", "MRP: ₹30.00").""",
+}
+
+FIELD_EXAMPLES = {
+    "Name": "Crocin Advance",
+    "MFG Date": "Not Found",
+    "Expiry Date": "10/2025",
+    "MRP": "Rs. 20.00",
+}
+
+
+def _detect_name(raw_text):
+    """Best catalogue name among the leading OCR lines, or None if nothing is a confident match."""
+    min_score = getattr(settings, "EXTRACTION_NAME_MIN_SCORE", 90)
+    best = None
+    for candidate in name_candidates(raw_text):
+        match = search_agent_instance.match_name(candidate, min_score)
+        if match and (best is None or match[1] > best[1]):
+            best = match
+    return best[0] if best else None
+
+
+def _parsed_fields(raw_text, name):
+    """``name`` plus the dates and MRP the parser found (others are None), and the parsed expiry date."""
+    parsed = extract_fields(raw_text)
+    return {
+        "Name": name,
+        "MFG Date": format_month_year(parsed["MFG Date"]) if parsed["MFG Date"] else None,
+        "Expiry Date": format_month_year(parsed["Expiry Date"]) if parsed["Expiry Date"] else None,
+        "MRP": format_price(parsed["MRP"]) if parsed["MRP"] else None,
+    }, parsed["Expiry Date"]
+
+
+def _rule_based_fields(raw_text):
+    """Fields the parser and the catalogue could resolve on their own (others are None)."""
+    return _parsed_fields(raw_text, _detect_name(raw_text))
+
+
+def extract_with_name(raw_text, name):
     """
-    Extracts structured data from raw OCR text using a more robust prompt.
+    Extraction result for a package whose name is already known (a
+    speculative search hit), or None if the parser alone can't fill the
+    dates and MRP, i.e. the LLM would still be needed.
     """
-    
-    # This new prompt gives examples and tells the AI what NOT to look for.
-    prompt = f"""
+    extracted_data, expiry = _parsed_fields(raw_text, name)
+    if any(value is None for value in extracted_data.values()):
+        return None
+    return _flag_expired({"fields": extracted_data, "expiry": expiry})
+
+
+def _build_prompt(raw_text, missing):
+    fields = "\n".join(
+        f"{n}.  **{field}:** {FIELD_HINTS[field]}" for n, field in enumerate(missing, 1)
+    )
+    example = json.dumps({field: FIELD_EXAMPLES[field] for field in missing}, indent=2, ensure_ascii=False)
+    return f"""
 You are an expert pharmacist. Your job is to parse the raw text from a medicine package and extract specific details.
 The raw text is: "{raw_text}"
 
 You MUST extract the following fields.
-1.  **Name:** The brand name of the medicine (e.g., "Crocin", "Rantac 150", "Zenadol"). 
-    This is almost always at the top and in the largest font.
-    This is NOT an instruction (like "Store at room temperature"), a company name (like "GSK"), or an ingredient (like "Paracetamol").
-2.  **MFG Date:** The manufacturing date (e.g., "04/2024", "MFG: 05/25").
-3.  **Expiry Date:** The expiry date (e.g., "03/2026", "EXP: 04/27").
-4.  **MRP:** The price (e.g., "Rs. 25.50", "MRP: ₹30.00").
+{fields}
 
 If a field is not present in the text, you MUST return "Not Found".
 Respond ONLY with a valid JSON object in the format below.
 
 Example:
-{{
-  "Name": "Crocin Advance",
-  "MFG Date": "Not Found",
-  "Expiry Date": "10/2025",
-  "MRP": "Rs. 20.00"
-}}
+{example}
 
 JSON:
 """
 
-    print(f"--- Extraction Agent DEBUG ---\nPrompting with text: {raw_text[:100]}...")
 
+def _run_llm(raw_text, missing):
+    """Ask phi3 for the ``missing`` fields only; errors come back as the old error values."""
+    try:
+        response = llm_gateway.chat(EXTRACTION_MODEL, [{'role': 'user', 'content': _build_prompt(raw_text, missing)}])
+    except LLMError as e:
+        print(f"Extraction Agent ERROR: {e}")
+        return {"Name": "Error", "MFG Date": "Error", "Expiry Date": "Error", "MRP": "Error"}
+    return _parse_llm_response(response)
+
+
+async def _arun_llm(raw_text, missing):
+    try:
+        response = await llm_gateway.achat(EXTRACTION_MODEL, [{'role': 'user', 'content': _build_prompt(raw_text, missing)}])
+    except LLMError as e:
+        print(f"Extraction Agent ERROR: {e}")
+        return {"Name": "Error", "MFG Date": "Error", "Expiry Date": "Error", "MRP": "Error"}
+    return _parse_llm_response(response)
+
+
+def _parse_llm_response(response):
+    response_text = ""
     try:
-        response = ollama.chat(model='phi3', messages=[{'role': 'user', 'content': prompt}])
         response_text = response['message']['content']
-        
+
         # Clean the response to ensure it's valid JSON
         # Find the first { and the last }
         json_start = response_text.find('{')
         json_end = response_text.rfind('}') + 1
-        
+
         if json_start == -1 or json_end == 0:
             print(f"Extraction Agent ERROR: AI did not return a JSON object. Response: {response_text}")
             return {"Name": "Error: No JSON", "MFG Date": "Error", "Expiry Date": "Error", "MRP": "Error"}
 
-        json_string = response_text[json_start:json_end]
-        
-        extracted_data = json.loads(json_string)
-        
-        # Check for expiry
-        expiry_date = extracted_data.get('Expiry Date', 'Not Found')
-        is_expired = False # Implement date comparison logic here if you want
-        
-        extracted_data['Is Expired'] = is_expired
-
-        print(f"Extraction Agent: Extracted data -> {extracted_data}")
-        return extracted_data
+        return json.loads(response_text[json_start:json_end])
 
     except json.JSONDecodeError:
         print(f"Extraction Agent ERROR: Failed to decode JSON from AI response. Response: {response_text}")
@@ -67,3 +134,90 @@ JSON:
     except Exception as e:
         print(f"Extraction Agent ERROR: {e}")
         return {"Name": "Error", "MFG Date": "Error", "Expiry Date": "Error", "MRP": "Error"}
+
+
+@traced("extraction")
+def run_extraction_agent(raw_text: str) -> dict:
+    """
+    Extracts structured data from raw OCR text.
+
+    Dates and MRP go through the rule-based parser and the name is matched
+    against the catalogue first; phi3 is only asked for what is still missing,
+    so most package scans never wait on the LLM.
+    """
+
+    print(f"--- Extraction Agent DEBUG ---\nPrompting with text: {raw_text[:100]}...")
+
+    annotate(text_bytes=len(raw_text.encode("utf-8")))
+    cached = image_cache.get_for_text("extraction", raw_text) if cache_enabled() else None
+    cache_event("extraction", cached is not None)
+    if cached is not None:
+        return _flag_expired(cached)
+
+    extracted_data, expiry = _rule_based_fields(raw_text)
+    missing = [field for field in FIELDS if extracted_data[field] is None]
+
+    annotate(llm_fields=len(missing))
+    llm_data = None
+    if missing:
+        print(f"Extraction Agent: Asking LLM for {missing}")
+        llm_data = _run_llm(raw_text, missing)
+    else:
+        print("Extraction Agent: All fields parsed without the LLM.")
+    result = _finish(extracted_data, expiry, missing, llm_data)
+    if _cacheable(result):
+        image_cache.set_for_text("extraction", raw_text, result)
+    return _flag_expired(result)
+
+
+@traced("extraction")
+async def arun_extraction_agent(raw_text: str) -> dict:
+    """Async version of ``run_extraction_agent`` for the ASGI pipeline."""
+
+    print(f"--- Extraction Agent DEBUG ---\nPrompting with text: {raw_text[:100]}...")
+
+    annotate(text_bytes=len(raw_text.encode("utf-8")))
+    cached = await image_cache.aget_for_text("extraction", raw_text) if cache_enabled() else None
+    cache_event("extraction", cached is not None)
+    if cached is not None:
+        return _flag_expired(cached)
+
+    # Name matching scores catalogue rows: keep it off the event loop.
+    extracted_data, expiry = await asyncio.to_thread(_rule_based_fields, raw_text)
+    missing = [field for field in FIELDS if extracted_data[field] is None]
+
+    annotate(llm_fields=len(missing))
+    llm_data = None
+    if missing:
+        print(f"Extraction Agent: Asking LLM for {missing}")
+        llm_data = await _arun_llm(raw_text, missing)
+    else:
+        print("Extraction Agent: All fields parsed without the LLM.")
+    result = _finish(extracted_data, expiry, missing, llm_data)
+    if _cacheable(result):
+        await image_cache.aset_for_text("extraction", raw_text, result)
+    return _flag_expired(result)
+
+
+def _finish(extracted_data, expiry, missing, llm_data):
+    """Fields with the LLM's answers filled in, plus the parsed expiry date (or None)."""
+    for field in missing:
+        extracted_data[field] = llm_data.get(field, "Not Found")
+    if expiry is None and missing:
+        expiry = parse_date(extracted_data["Expiry Date"], end_of_month=True)
+    return {"fields": extracted_data, "expiry": expiry}
+
+
+def _cacheable(result):
+    # A failed LLM call is worth retrying on the next upload.
+    return cache_enabled() and not any(str(v).startswith("Error") for v in result["fields"].values())
+
+
+def _flag_expired(result):
+    # Checked against today on every call, cached or not
+    extracted_data = dict(result["fields"])
+    expiry = result["expiry"]
+    extracted_data['Is Expired'] = expiry is not None and expiry < timezone.localdate()
+
+    print(f"Extraction Agent: Extracted data -> {extracted_data}")
+    return extracted_data
@@ -0,0 +1,148 @@
+# medicinebot/agents/field_parser.py
+
+import calendar
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+_MONTHS = {
+    "JAN": 1, "FEB": 2, "MAR": 3, "APR": 4, "MAY": 5, "JUN": 6, "JUL": 7,
+    "AUG": 8, "SEP": 9, "SEPT": 9, "OCT": 10, "NOV": 11, "DEC": 12,
+}
+
+# "05/25", "05/2025", "05-2025", "5.25", "12/05/2025", "MAY 2025", "MAY-25", "MAY.2025"
+_DATE_VALUE = (
+    r"(?P<value>"
+    r"\d{1,2}\s?[/.\-]\s?\d{1,2}\s?[/.\-]\s?\d{2,4}"
+    r"|\d{1,2}\s?[/.\-]\s?\d{2,4}"
+    r"|[A-Z]{3,9}\.?\s?[/.\-']?\s?\d{2,4}"
+    r")(?!\d)"
+)
+_SEP = r"[\s:.\-/()]*"
+# Optional "DATE" / "DT" / "ON" after the label, possibly on the next line.
+_LABEL_TAIL = rf"(?:{_SEP}(?:DATE|DT|ON)\b)?{_SEP}"
+
+_MFG_LABEL = r"\b(?:MANUFACTURED|MANUFACTURING|MFG|MFD|DOM)"
+_EXPIRY_LABEL = r"\b(?:EXPIRATION|EXPIRY|EXPIRES|EXP|USE\s+BEFORE|USE\s+BY|BEST\s+BEFORE)"
+
+MFG_RE = re.compile(rf"{_MFG_LABEL}{_LABEL_TAIL}{_DATE_VALUE}", re.IGNORECASE)
+EXPIRY_RE = re.compile(rf"{_EXPIRY_LABEL}{_LABEL_TAIL}{_DATE_VALUE}", re.IGNORECASE)
+
+_AMOUNT = r"(?P<value>\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)"
+_CURRENCY = r"(?:RS\.?|₹|INR|RUPEES)"
+_MRP_LABEL = r"(?:M\s?\.?\s?R\s?\.?\s?P\b\.?|PRICE)"
+
+# Most specific first: "MRP ... Rs 30" beats "MRP 30" beats a bare "Rs 30",
+# so "MRP per strip of 10 tablets Rs. 30.00" is read as 30.00, not 10.
+MRP_PATTERNS = (
+    re.compile(rf"{_MRP_LABEL}[^₹\n]{{0,40}}?{_CURRENCY}\s*{_AMOUNT}", re.IGNORECASE),
+    re.compile(rf"{_MRP_LABEL}[\s:.\-]*{_AMOUNT}", re.IGNORECASE),
+    re.compile(rf"{_CURRENCY}\s*{_AMOUNT}", re.IGNORECASE),
+)
+
+# Lines that are clearly not the brand name.
+NOISE_LINE_RE = re.compile(
+    rf"{_MFG_LABEL}|{_EXPIRY_LABEL}|{_MRP_LABEL}|{_CURRENCY}\s*\d|\bB\.?\s?NO\b|\bBATCH\b|\bLIC\b",
+    re.IGNORECASE,
+)
+
+
+def parse_date(value, end_of_month=False):
+    """
+    Turn a printed package date into a ``date`` (None if it isn't one).
+
+    Month/year dates map to the first day of the month, or the last one with
+    ``end_of_month`` — a medicine labelled "EXP 04/27" is usable all April.
+    """
+    if not value:
+        return None
+    text = str(value).strip().upper()
+    parts = re.findall(r"[A-Z]+|\d+", text)
+    try:
+        if len(parts) == 3 and all(p.isdigit() for p in parts):
+            day, month, year = (int(p) for p in parts)
+        elif len(parts) == 2:
+            day = None
+            month = (_MONTHS.get(parts[0][:4]) or _MONTHS.get(parts[0][:3])) if parts[0].isalpha() else int(parts[0])
+            year = int(parts[1])
+        else:
+            return None
+        if not month or not 1 <= month <= 12:
+            return None
+        if year < 100:
+            year += 2000
+        if not 2000 <= year <= 2099:
+            return None
+        last_day = calendar.monthrange(year, month)[1]
+        if day is None:
+            day = last_day if end_of_month else 1
+        return date(year, month, day) if 1 <= day <= last_day else None
+    except ValueError:
+        return None
+
+
+def parse_price(value):
+    """'₹1,250.50' / 'Rs. 30' / '30.00' -> Decimal (None if no amount)."""
+    match = re.search(_AMOUNT, str(value or ""))
+    if not match:
+        return None
+    try:
+        return Decimal(match.group("value").replace(",", ""))
+    except InvalidOperation:
+        return None
+
+
+def format_month_year(value):
+    return value.strftime("%m/%Y")
+
+
+def format_price(value):
+    return f"₹{value:.2f}"
+
+
+def extract_fields(raw_text):
+    """
+    Rule-based MFG date / expiry date / MRP extraction from OCR text.
+
+    Returns ``{"MFG Date": date|None, "Expiry Date": date|None, "MRP": Decimal|None}``;
+    None means "not confidently found" and is left to the LLM.
+    """
+    text = raw_text or ""
+    fields = {"MFG Date": None, "Expiry Date": None, "MRP": None}
+
+    match = MFG_RE.search(text)
+    if match:
+        fields["MFG Date"] = parse_date(match.group("value"))
+    match = EXPIRY_RE.search(text)
+    if match:
+        fields["Expiry Date"] = parse_date(match.group("value"), end_of_month=True)
+
+    for pattern in MRP_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            price = parse_price(match.group("value"))
+            if price:
+                fields["MRP"] = price
+                break
+
+    # A manufacturing date after the expiry date means one of them was misread.
+    if fields["MFG Date"] and fields["Expiry Date"] and fields["MFG Date"] > fields["Expiry Date"]:
+        fields["MFG Date"] = fields["Expiry Date"] = None
+    return fields
+
+
+def name_candidates(raw_text, max_lines=5):
+    """
+    Leading OCR lines that could hold the brand name, plus adjacent pairs
+    ("Crocin" / "Advance" are often printed on separate lines).
+    """
+    lines = []
+    for line in (raw_text or "").splitlines():
+        line = line.strip()
+        if len(line) < 3 or not re.search(r"[A-Za-z]{2}", line) or NOISE_LINE_RE.search(line):
+            continue
+        lines.append(line)
+        if len(lines) == max_lines:
+            break
+    pairs = [f"{a} {b}" for a, b in zip(lines, lines[1:])]
+    return lines + pairs
@@ -0,0 +1,300 @@
+# medicinebot/agents/image_cache.py
+
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .image_prep import load_image
+
+# Max Hamming distance (of 64 bits) for a near-duplicate photo to reuse a
+# result, per agent; None = exact bytes only. Both hashes must agree. OCR
+# text holds the batch's MFG/EXP dates and MRP, which look the same to a
+# perceptual hash from one batch to the next; a barcode names one exact
+# product, and packs of two strengths of a brand look alike. Both agents
+# are exact bytes only.
+NEAR_DISTANCE = {"ocr": None, "barcode": None}
+DHASH_DISTANCE = 10
+MAX_INDEX_ENTRIES = 20000
+
+
+def cache_enabled():
+    return getattr(settings, "IMAGE_CACHE_ENABLED", True)
+
+
+def fingerprint(image_file):
+    """``Fingerprint`` of an upload, or None when the cache is off."""
+    return Fingerprint.of(image_file) if cache_enabled() else None
+
+
+def phash(gray):
+    """64-bit DCT hash: the low frequencies of a 32x32 thumbnail vs their median."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()[1:]  # drop the DC term (overall brightness)
+    bits = low > np.median(low)
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def dhash(gray):
+    """64-bit gradient hash: is each pixel of a 9x8 thumbnail brighter than its right neighbour."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class Fingerprint:
+    """SHA-256 of the uploaded bytes plus perceptual hashes of the picture."""
+
+    __slots__ = ("sha256", "phash", "dhash")
+
+    def __init__(self, data):
+        self.sha256 = hashlib.sha256(data).hexdigest()
+        try:
+            # A 64 px decode is plenty for 8x8 hashes (JPEG draft makes it cheap).
+            img, _ = load_image(data, 64, "L")
+            gray = np.asarray(img)
+            self.phash, self.dhash = phash(gray), dhash(gray)
+        except Exception as e:
+            print(f"Image Cache: can't hash image ({e}), exact matches only")
+            self.phash = self.dhash = None
+
+    @classmethod
+    def of(cls, image_file):
+        image_file.seek(0)
+        data = image_file.read()
+        image_file.seek(0)
+        return cls(data)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes in Hamming space. Children are
+    keyed by their distance to the parent, so by the triangle inequality a
+    radius-r search only visits children at distance d-r..d+r.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = self.root
+        if node is None:
+            self.root = [value, {item}, {}]
+            self.size += 1
+            return
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].add(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, {item}, {}]
+                self.size += 1
+                return
+            node = child
+
+    def discard(self, value, item):
+        """Forget ``item``; its node stays (as a routing point) until the next rebuild."""
+        node = self.root
+        while node is not None:
+            d = hamming(value, node[0])
+            if d == 0:
+                node[1].discard(item)
+                return
+            node = node[2].get(d)
+
+    def search(self, value, radius):
+        """``(distance, item)`` for every item within ``radius``, nearest first."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            for child_d, child in node[2].items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        found.sort(key=lambda f: f[0])
+        return found
+
+
+class ImageResultCache:
+    """
+    Agent results (OCR text, barcode, extracted fields) for photos seen before.
+
+    Exact repeats are found by SHA-256 of the bytes in the Django cache
+    alias ``IMAGE_CACHE_ALIAS`` (size and TTL come from its settings; the
+    default LocMemCache is per process, point the alias at a shared
+    backend such as Redis to share it between workers). Near-duplicates (the same box shot again, slightly
+    moved or re-lit) are found through a per-process BK-tree of pHashes,
+    confirmed with dHash, and then resolve to the SHA-256 entry of the
+    earlier photo. The tree keeps the newest IMAGE_CACHE_MAX_ENTRIES
+    photos per agent.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, "IMAGE_CACHE_ALIAS", "image_results")
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._trees = {}
+        self._entries = {}  # kind -> OrderedDict(sha256 -> (phash, dhash)), oldest first
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _key(kind, sha256):
+        return f"image:{kind}:{sha256}"
+
+    def _near_distance(self, kind):
+        return getattr(settings, "IMAGE_CACHE_NEAR_DISTANCE", NEAR_DISTANCE).get(kind)
+
+    def _near(self, kind, fp):
+        """SHA-256s of indexed photos that look like ``fp``, nearest first."""
+        radius = self._near_distance(kind)
+        if radius is None or fp.phash is None:
+            return []
+        dhash_radius = getattr(settings, "IMAGE_CACHE_DHASH_DISTANCE", DHASH_DISTANCE)
+        with self._lock:
+            tree, entries = self._trees.get(kind), self._entries.get(kind, {})
+            if tree is None:
+                return []
+            return [
+                (d, sha256) for d, sha256 in tree.search(fp.phash, radius)
+                if sha256 != fp.sha256 and hamming(entries[sha256][1], fp.dhash) <= dhash_radius
+            ]
+
+    def _index(self, kind, fp):
+        if fp.phash is None or self._near_distance(kind) is None:
+            return
+        limit = getattr(settings, "IMAGE_CACHE_MAX_ENTRIES", MAX_INDEX_ENTRIES)
+        with self._lock:
+            tree = self._trees.setdefault(kind, BKTree())
+            entries = self._entries.setdefault(kind, OrderedDict())
+            if fp.sha256 in entries:
+                entries.move_to_end(fp.sha256)
+                return
+            entries[fp.sha256] = (fp.phash, fp.dhash)
+            tree.add(fp.phash, fp.sha256)
+            while len(entries) > limit:
+                old, (old_phash, _) = entries.popitem(last=False)
+                tree.discard(old_phash, old)
+            if tree.size > 2 * max(len(entries), 1):
+                self._rebuild(kind)
+
+    def _forget(self, kind, sha256):
+        with self._lock:
+            entry = self._entries.get(kind, {}).pop(sha256, None)
+            if entry is not None:
+                self._trees[kind].discard(entry[0], sha256)
+
+    def _rebuild(self, kind):
+        # Drop the nodes left behind by evictions.
+        tree = BKTree()
+        for sha256, (value, _) in self._entries[kind].items():
+            tree.add(value, sha256)
+        self._trees[kind] = tree
+
+    def get(self, kind, fp):
+        """Cached result of agent ``kind`` for this photo or a near-duplicate, else None."""
+        value = self.backend.get(self._key(kind, fp.sha256))
+        if value is not None:
+            self._count("exact")
+            print(f"Image Cache: {kind} exact hit {fp.sha256[:12]}")
+            return value
+        return self._get_near(kind, fp)
+
+    def _get_near(self, kind, fp):
+        for distance, sha256 in self._near(kind, fp):
+            value = self.backend.get(self._key(kind, sha256))
+            if value is None:
+                self._forget(kind, sha256)  # evicted from the shared cache
+                continue
+            self._count("near")
+            print(f"Image Cache: {kind} near hit {fp.sha256[:12]} ~ {sha256[:12]} (distance {distance})")
+            # Next time this exact photo is a plain key lookup.
+            self.backend.set(self._key(kind, fp.sha256), value)
+            return value
+        self._count("miss")
+        return None
+
+    def set(self, kind, fp, value):
+        if value is None:
+            return  # failed calls (API errors, nothing found) are retried next time
+        self.backend.set(self._key(kind, fp.sha256), value)
+        self._index(kind, fp)
+
+    async def aget(self, kind, fp):
+        value = await self.backend.aget(self._key(kind, fp.sha256))
+        if value is not None:
+            self._count("exact")
+            print(f"Image Cache: {kind} exact hit {fp.sha256[:12]}")
+            return value
+        return await asyncio.to_thread(self._get_near, kind, fp)
+
+    async def aset(self, kind, fp, value):
+        if value is None:
+            return
+        await self.backend.aset(self._key(kind, fp.sha256), value)
+        self._index(kind, fp)
+
+    # Results derived from OCR text (extracted fields) are keyed on the
+    # text: a near-duplicate photo that reuses earlier text lands here too.
+
+    @staticmethod
+    def _text_key(kind, text):
+        return f"text:{kind}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get_for_text(self, kind, text):
+        value = self.backend.get(self._text_key(kind, text))
+        self._count("exact" if value is not None else "miss")
+        return value
+
+    def set_for_text(self, kind, text, value):
+        self.backend.set(self._text_key(kind, text), value)
+
+    async def aget_for_text(self, kind, text):
+        value = await self.backend.aget(self._text_key(kind, text))
+        self._count("exact" if value is not None else "miss")
+        return value
+
+    async def aset_for_text(self, kind, text, value):
+        await self.backend.aset(self._text_key(kind, text), value)
+
+    def _count(self, outcome):
+        with self._lock:
+            if outcome == "exact":
+                self.exact_hits += 1
+            elif outcome == "near":
+                self.near_hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.exact_hits + self.near_hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.exact_hits + self.near_hits) / total if total else 0.0,
+                "indexed": {kind: len(entries) for kind, entries in self._entries.items()},
+            }
+
+
+image_cache = ImageResultCache()
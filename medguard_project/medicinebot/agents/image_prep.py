@@ -0,0 +1,120 @@
+# medicinebot/agents/image_prep.py
+
+import io
+import math
+import time
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+# Vision reads package text fine at ~1600 px; zbar needs far less than 12 MP.
+OCR_MAX_SIDE = 1600
+OCR_JPEG_QUALITY = 85
+BARCODE_MAX_SIDE = 1280
+
+
+def _read(image_file):
+    if isinstance(image_file, bytes):
+        return image_file
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data
+
+
+def load_image(data, max_side, mode="RGB", timings=None):
+    """
+    Decode ``data`` upright, in ``mode``, with its longest side <= ``max_side``.
+
+    ``Image.draft`` lets the JPEG decoder produce a 1/2, 1/4 or 1/8 scale
+    image directly (and grayscale without a colour pass), so a 12 MP photo
+    is never expanded to full-size pixels; the final resize only has to
+    cover the remaining factor.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    scale = min(1.0, max_side / max(width, height))
+    # Smallest draft that is still at least the target size on both axes.
+    img.draft(mode, (math.ceil(width * scale), math.ceil(height * scale)))
+    img = ImageOps.exif_transpose(img)  # loads the (drafted) pixels
+    if img.mode != mode:
+        img = img.convert(mode)
+    timings["decode_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    timings["resize_ms"] = (time.perf_counter() - start) * 1000
+    return img, (width, height)
+
+
+def _report(agent, original_bytes, output_bytes, original_size, output_size, timings):
+    total = sum(timings.values())
+    stages = ", ".join(f"{name[:-3]} {ms:.0f}" for name, ms in timings.items())
+    print(
+        f"Image Prep ({agent}): {original_size[0]}x{original_size[1]} -> {output_size[0]}x{output_size[1]}, "
+        f"{original_bytes} -> {output_bytes} bytes (saved {original_bytes - output_bytes}) "
+        f"in {total:.0f} ms [{stages}]"
+    )
+
+
+def prepare_for_ocr(image_file):
+    """
+    Compact, upright JPEG for the Vision API.
+
+    Returns ``(payload bytes, stats)``; falls back to the original bytes if
+    the image can't be decoded or re-encoding would not make it smaller.
+    """
+    data = _read(image_file)
+    max_side = getattr(settings, "OCR_MAX_IMAGE_SIDE", OCR_MAX_SIDE)
+    quality = getattr(settings, "OCR_JPEG_QUALITY", OCR_JPEG_QUALITY)
+    timings = {}
+    try:
+        img, original_size = load_image(data, max_side, "RGB", timings)
+        start = time.perf_counter()
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+        payload = out.getvalue()
+        timings["encode_ms"] = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        print(f"Image Prep ERROR (ocr): {e}")
+        return data, {"original_bytes": len(data), "output_bytes": len(data), "timings": timings}
+
+    if len(payload) >= len(data):
+        payload = data  # already small: don't re-encode for nothing
+    _report("ocr", len(data), len(payload), original_size, img.size, timings)
+    return payload, {
+        "original_bytes": len(data),
+        "output_bytes": len(payload),
+        "original_size": original_size,
+        "output_size": img.size,
+        "timings": timings,
+    }
+
+
+def prepare_for_barcode(image_file, max_side=None):
+    """
+    Upright grayscale PIL image for zbar, downscaled to ``max_side``
+    (BARCODE_MAX_IMAGE_SIDE by default; ``max_side=0`` keeps full size).
+    ``image_file`` may also be the upload's bytes.
+
+    Returns ``(image, stats)``.
+    """
+    data = _read(image_file)
+    if max_side is None:
+        max_side = getattr(settings, "BARCODE_MAX_IMAGE_SIDE", BARCODE_MAX_SIDE)
+    timings = {}
+    img, original_size = load_image(data, max_side or 1 << 30, "L", timings)
+    # Pixel buffers: a full-size RGB decode vs the 8-bit image zbar scans.
+    original_bytes = original_size[0] * original_size[1] * 3
+    output_bytes = img.width * img.height
+    _report("barcode", original_bytes, output_bytes, original_size, img.size, timings)
+    return img, {
+        "original_bytes": original_bytes,
+        "output_bytes": output_bytes,
+        "original_size": original_size,
+        "output_size": img.size,
+        "timings": timings,
+    }
@@ -0,0 +1,417 @@
+# medicinebot/agents/llm_gateway.py
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import httpx
+import ollama
+from django.conf import settings
+
+from ..tracing import annotate, record, span
+from .async_clients import ollama_client
+
+# Concurrent requests per model (Ollama's OLLAMA_NUM_PARALLEL is the
+# server-side ceiling; more than that only queues inside Ollama).
+CONCURRENCY = {"default": 2}
+TIMEOUT = 60.0
+QUEUE_TIMEOUT = 30.0
+KEEP_ALIVE = "30m"
+WARM_UP_MODELS = ("phi3",)
+# Latency samples kept per model for the percentiles in ``stats``.
+LATENCY_WINDOW = 1000
+
+_RAISE = object()
+
+
+class LLMError(Exception):
+    """An LLM call failed, timed out or found no free slot in time."""
+
+
+def _request_key(model, messages, options):
+    payload = json.dumps([model, messages, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class _ModelStats:
+    __slots__ = ("calls", "coalesced", "errors", "timeouts", "in_flight", "prompt_tokens",
+                 "output_tokens", "eval_seconds", "latencies", "first_tokens")
+
+    def __init__(self):
+        self.calls = self.coalesced = self.errors = self.timeouts = self.in_flight = 0
+        self.prompt_tokens = self.output_tokens = 0
+        self.eval_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.first_tokens = deque(maxlen=LATENCY_WINDOW)
+
+
+class _LoopState:
+    """Semaphores and in-flight calls of one event loop (asyncio objects are loop-bound)."""
+
+    def __init__(self):
+        self.semaphores = {}
+        self.inflight = {}
+
+
+class LLMGateway:
+    """
+    The one way the agents talk to Ollama.
+
+    - one pooled HTTP client (per event loop for async callers), so calls
+      reuse keep-alive connections;
+    - at most LLM_CONCURRENCY requests per model in flight; the rest wait
+      up to LLM_QUEUE_TIMEOUT seconds for a slot instead of piling up on
+      the model server;
+    - single-flight: a prompt identical to one already running waits for
+      that call's answer instead of running the model again;
+    - LLM_TIMEOUT seconds per call, after which the caller's ``fallback``
+      is returned (or LLMError raised);
+    - ``keep_alive`` on every call and ``warm_up`` at start, so the model
+      stays loaded between requests;
+    - per-model latency / token metrics (``stats``);
+    - query embeddings (``embed``) share the slots, with their own timeout.
+
+    Sync (WSGI, worker threads) and async (ASGI) callers each get their own
+    slots: a process normally serves only one of the two.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._semaphores = {}
+        self._inflight = {}
+        self._loops = weakref.WeakKeyDictionary()
+        self._stats = {}
+
+    # --- settings -------------------------------------------------------
+
+    def _timeout(self):
+        return getattr(settings, "LLM_TIMEOUT", TIMEOUT)
+
+    def _queue_timeout(self):
+        return getattr(settings, "LLM_QUEUE_TIMEOUT", QUEUE_TIMEOUT)
+
+    def _keep_alive(self):
+        return getattr(settings, "LLM_KEEP_ALIVE", KEEP_ALIVE)
+
+    def concurrency(self, model):
+        """Requests ``model`` may have in flight at once (LLM_CONCURRENCY)."""
+        limits = getattr(settings, "LLM_CONCURRENCY", CONCURRENCY)
+        return max(1, limits.get(model, limits.get("default", CONCURRENCY["default"])))
+
+    # --- clients and slots ----------------------------------------------
+
+    @property
+    def client(self):
+        return self._client_for(self._timeout())
+
+    def _client_for(self, timeout):
+        # One pooled client per request timeout (the chat one, and the
+        # shorter one of query embeddings).
+        client = self._clients.get(timeout)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(timeout)
+                if client is None:
+                    limit = sum(getattr(settings, "LLM_CONCURRENCY", CONCURRENCY).values())
+                    client = self._clients[timeout] = ollama.Client(
+                        timeout=timeout,
+                        limits=httpx.Limits(max_connections=limit + 2, max_keepalive_connections=limit + 2),
+                    )
+        return client
+
+    def _semaphore(self, model):
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                semaphore = self._semaphores[model] = threading.BoundedSemaphore(self.concurrency(model))
+            return semaphore
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = _LoopState()
+        return state
+
+    def _asemaphore(self, state, model):
+        semaphore = state.semaphores.get(model)
+        if semaphore is None:
+            semaphore = state.semaphores[model] = asyncio.BoundedSemaphore(self.concurrency(model))
+        return semaphore
+
+    # --- sync -----------------------------------------------------------
+
+    def chat(self, model, messages, fallback=_RAISE, **options):
+        """``ollama.chat`` response, or ``fallback`` if the call fails (LLMError without one)."""
+        key = _request_key(model, messages, options)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if leader:
+            try:
+                future.set_result(self._call(model, messages, options))
+            except LLMError as e:
+                future.set_exception(e)
+            except BaseException as e:
+                # Not a call failure (a bug, KeyboardInterrupt, ...): the
+                # followers get it too instead of waiting out their timeout.
+                future.set_exception(e)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+        else:
+            self._count(model, "coalesced")
+
+        try:
+            return future.result(timeout=self._queue_timeout() + self._timeout())
+        except FutureTimeoutError:
+            error = LLMError(f"{model}: timed out waiting for an identical request")
+        except LLMError as e:
+            error = e
+        if fallback is _RAISE:
+            raise error
+        print(f"LLM Gateway: {error}, using fallback")
+        return fallback
+
+    def _call(self, model, messages, options):
+        with span("llm.chat", model=model):
+            semaphore = self._semaphore(model)
+            if not semaphore.acquire(timeout=self._queue_timeout()):
+                self._count(model, "timeouts")
+                raise LLMError(f"{model}: no free slot within {self._queue_timeout()}s")
+            try:
+                self._count(model, "in_flight")
+                start = time.perf_counter()
+                response = self.client.chat(
+                    model=model, messages=messages, options=options or None, keep_alive=self._keep_alive()
+                )
+            except httpx.TimeoutException:
+                self._count(model, "timeouts")
+                raise LLMError(f"{model}: no answer within {self._timeout()}s")
+            except Exception as e:
+                self._count(model, "errors")
+                raise LLMError(f"{model}: {e}") from e
+            finally:
+                self._count(model, "in_flight", -1)
+                semaphore.release()
+            self._record(model, time.perf_counter() - start, response)
+            return response
+
+    def embed(self, model, texts, timeout=None):
+        """
+        ``ollama.embed`` vectors for ``texts``, through the model's slots.
+        Raises LLMError if it fails or takes more than ``timeout`` seconds
+        (default LLM_TIMEOUT), waiting for a slot included.
+        """
+        timeout = timeout or self._timeout()
+        with span("llm.embed", model=model):
+            semaphore = self._semaphore(model)
+            if not semaphore.acquire(timeout=min(timeout, self._queue_timeout())):
+                self._count(model, "timeouts")
+                raise LLMError(f"{model}: no free slot within {min(timeout, self._queue_timeout())}s")
+            try:
+                self._count(model, "in_flight")
+                start = time.perf_counter()
+                response = self._client_for(timeout).embed(model=model, input=texts, keep_alive=self._keep_alive())
+            except httpx.TimeoutException:
+                self._count(model, "timeouts")
+                raise LLMError(f"{model}: no embeddings within {timeout}s")
+            except Exception as e:
+                self._count(model, "errors")
+                raise LLMError(f"{model}: {e}") from e
+            finally:
+                self._count(model, "in_flight", -1)
+                semaphore.release()
+            self._record(model, time.perf_counter() - start, response)
+            return response["embeddings"]
+
+    # --- async ----------------------------------------------------------
+
+    async def achat(self, model, messages, fallback=_RAISE, **options):
+        """Async ``chat``."""
+        state = self._loop_state()
+        key = _request_key(model, messages, options)
+        task = state.inflight.get(key)
+        if task is None:
+            task = state.inflight[key] = asyncio.ensure_future(self._acall(state, model, messages, options))
+            task.add_done_callback(lambda t: self._forget(state, key, t))
+        else:
+            self._count(model, "coalesced")
+
+        try:
+            # Shielded: a caller that goes away doesn't cancel the call the others wait on.
+            return await asyncio.shield(task)
+        except LLMError as error:
+            if fallback is _RAISE:
+                raise
+            print(f"LLM Gateway: {error}, using fallback")
+            return fallback
+
+    @staticmethod
+    def _forget(state, key, task):
+        state.inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved, even when every waiter is gone
+
+    async def _acquire(self, state, model):
+        semaphore = self._asemaphore(state, model)
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self._queue_timeout())
+        except TimeoutError:
+            self._count(model, "timeouts")
+            raise LLMError(f"{model}: no free slot within {self._queue_timeout()}s")
+        return semaphore
+
+    async def _acall(self, state, model, messages, options):
+        with span("llm.chat", model=model):
+            semaphore = await self._acquire(state, model)
+            try:
+                self._count(model, "in_flight")
+                start = time.perf_counter()
+                response = await asyncio.wait_for(
+                    ollama_client().chat(model=model, messages=messages, options=options or None, keep_alive=self._keep_alive()),
+                    self._timeout(),
+                )
+            except TimeoutError:
+                self._count(model, "timeouts")
+                raise LLMError(f"{model}: no answer within {self._timeout()}s")
+            except Exception as e:
+                self._count(model, "errors")
+                raise LLMError(f"{model}: {e}") from e
+            finally:
+                self._count(model, "in_flight", -1)
+                semaphore.release()
+            self._record(model, time.perf_counter() - start, response)
+            return response
+
+    async def astream_chat(self, model, messages, **options):
+        """
+        The answer's text as it is generated. Holds a slot for the whole
+        stream; LLM_TIMEOUT applies to the first token and to every gap
+        between tokens. Not coalesced. Raises LLMError.
+        """
+        semaphore = await self._acquire(self._loop_state(), model)
+        try:
+            self._count(model, "in_flight")
+            start = time.perf_counter()
+            first_token = None
+            last = None
+            stream = await asyncio.wait_for(
+                ollama_client().chat(
+                    model=model, messages=messages, options=options or None,
+                    keep_alive=self._keep_alive(), stream=True,
+                ),
+                self._timeout(),
+            )
+            parts = stream.__aiter__()
+            while True:
+                try:
+                    part = await asyncio.wait_for(parts.__anext__(), self._timeout())
+                except StopAsyncIteration:
+                    break
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                last = part
+                yield part["message"]["content"]
+        except TimeoutError:
+            self._count(model, "timeouts")
+            raise LLMError(f"{model}: no tokens for {self._timeout()}s")
+        except Exception as e:
+            self._count(model, "errors")
+            raise LLMError(f"{model}: {e}") from e
+        finally:
+            self._count(model, "in_flight", -1)
+            semaphore.release()
+        self._record(model, time.perf_counter() - start, last, first_token)
+
+    # --- warm-up --------------------------------------------------------
+
+    def warm_up(self, models=None):
+        """Load ``models`` (default LLM_WARM_UP_MODELS) into memory with an empty prompt."""
+        for model in models or getattr(settings, "LLM_WARM_UP_MODELS", WARM_UP_MODELS):
+            start = time.perf_counter()
+            try:
+                self.client.generate(model=model, prompt="", keep_alive=self._keep_alive())
+            except Exception as e:
+                print(f"LLM Gateway: warm-up of {model} failed ({e})")
+                continue
+            print(f"LLM Gateway: {model} loaded in {time.perf_counter() - start:.1f}s")
+
+    def warm_up_in_background(self):
+        if getattr(settings, "LLM_WARM_UP", True):
+            threading.Thread(target=self.warm_up, name="llm-warm-up", daemon=True).start()
+
+    # --- metrics --------------------------------------------------------
+
+    def _model_stats(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = _ModelStats()
+        return stats
+
+    def _count(self, model, counter, n=1):
+        with self._lock:
+            stats = self._model_stats(model)
+            setattr(stats, counter, getattr(stats, counter) + n)
+
+    def _record(self, model, seconds, response, first_token=None):
+        prompt_tokens = (response.get("prompt_eval_count") or 0) if response else 0
+        output_tokens = (response.get("eval_count") or 0) if response else 0
+        eval_seconds = ((response.get("eval_duration") or 0) if response else 0) / 1e9
+        with self._lock:
+            stats = self._model_stats(model)
+            stats.calls += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.output_tokens += output_tokens
+            stats.eval_seconds += eval_seconds
+            stats.latencies.append(seconds)
+            if first_token is not None:
+                stats.first_tokens.append(first_token)
+        if first_token is None:
+            annotate(prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+        else:
+            record(
+                "llm.stream", seconds, model=model, first_token_ms=round(first_token * 1000, 1),
+                prompt_tokens=prompt_tokens, output_tokens=output_tokens,
+            )
+        print(f"LLM Gateway: {model} {seconds:.2f}s, {prompt_tokens} prompt / {output_tokens} output tokens")
+
+    def stats(self):
+        """Per-model counters, token totals and latency percentiles (seconds) of this process."""
+        with self._lock:
+            return {
+                model: {
+                    "calls": s.calls,
+                    "coalesced": s.coalesced,
+                    "errors": s.errors,
+                    "timeouts": s.timeouts,
+                    "in_flight": s.in_flight,
+                    "prompt_tokens": s.prompt_tokens,
+                    "output_tokens": s.output_tokens,
+                    "tokens_per_second": s.output_tokens / s.eval_seconds if s.eval_seconds else None,
+                    "latency_p50": _percentile(s.latencies, 0.5),
+                    "latency_p95": _percentile(s.latencies, 0.95),
+                    "first_token_p50": _percentile(s.first_tokens, 0.5),
+                }
+                for model, s in self._stats.items()
+            }
+
+
+llm_gateway = LLMGateway()
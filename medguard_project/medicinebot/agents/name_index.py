@@ -0,0 +1,217 @@
+# medicinebot/agents/name_index.py
+
+import bisect
+import re
+from collections import defaultdict
+
+import numpy as np
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+# A shared token ("tablet", "mg") is a much stronger signal than one trigram.
+TOKEN_WEIGHT = 3
+
+# Grams present in more than this share of the catalogue carry almost no
+# ranking signal and only make the posting lists expensive to merge.
+MAX_DOC_FREQUENCY = 0.25
+
+
+def normalize_name(text):
+    """Lowercase and collapse everything except letters/digits to single spaces."""
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+def name_trigrams(normalized):
+    """Character trigrams of every token, padded so short tokens still count."""
+    grams = set()
+    for token in normalized.split():
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def _to_csr(postings):
+    """dict key -> ids  ==>  (keys, offsets, ids) flat arrays."""
+    keys = sorted(postings)
+    lengths = np.fromiter((len(postings[k]) for k in keys), dtype=np.int64, count=len(keys))
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.concatenate([postings[k] for k in keys]) if keys else np.zeros(0, dtype=np.int32)
+    return keys, offsets, ids.astype(np.int32, copy=False)
+
+
+class CSRPostings:
+    """
+    Read-only ``key -> ids`` mapping over flat CSR arrays.
+
+    The arrays may be memory-mapped: keys are binary-searched in their
+    sorted array and a posting list is only sliced out (as a view, no copy)
+    when it is looked up.
+    """
+
+    def __init__(self, keys, offsets, ids):
+        # Plain ndarray views: slicing a np.memmap is several times slower.
+        self._keys = np.asarray(keys)
+        self._offsets = np.asarray(offsets)
+        self._ids = np.asarray(ids)
+
+    def _slot(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        return i if i < len(self._keys) and self._keys[i] == key else None
+
+    def __contains__(self, key):
+        return self._slot(key) is not None
+
+    def __getitem__(self, key):
+        i = self._slot(key)
+        if i is None:
+            raise KeyError(key)
+        return self._ids[self._offsets[i]:self._offsets[i + 1]]
+
+    def __iter__(self):
+        return iter(self._keys.tolist())
+
+    def items(self):
+        """Every ``(key, ids)`` pair in key order, without a search per key."""
+        offsets = self._offsets.tolist()
+        for i, key in enumerate(self._keys.tolist()):
+            yield key, self._ids[offsets[i]:offsets[i + 1]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class OverlayPostings:
+    """
+    Copy-on-write view: ``overrides`` (key -> ids) shadow ``base``.
+
+    Lets a delta update touch only the posting lists of the grams it
+    changes while the previous snapshot keeps using ``base`` untouched.
+    """
+
+    def __init__(self, base, overrides):
+        if isinstance(base, OverlayPostings):
+            overrides = {**base.overrides, **overrides}
+            base = base.base
+        self.base = base
+        self.overrides = overrides
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.base
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.base[key]
+
+    def __iter__(self):
+        yield from self.overrides
+        yield from (k for k in self.base if k not in self.overrides)
+
+    def items(self):
+        yield from self.overrides.items()
+        yield from ((k, ids) for k, ids in self.base.items() if k not in self.overrides)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class NameIndex:
+    """
+    Inverted index (character trigrams + whole tokens) over the catalogue names.
+
+    It does not score anything itself: it only narrows tens of thousands of
+    names down to a shortlist that the fuzzy scorers can afford to look at.
+    """
+
+    def __init__(self, names=(), size=None, trigrams=None, tokens=None):
+        if trigrams is not None:
+            self.size, self.trigrams, self.tokens = size, trigrams, tokens
+            return
+
+        self.size = len(names)
+        trigram_postings = defaultdict(list)
+        token_postings = defaultdict(list)
+
+        for row_id, name in enumerate(names):
+            normalized = normalize_name(name)
+            for gram in name_trigrams(normalized):
+                trigram_postings[gram].append(row_id)
+            for token in set(normalized.split()):
+                token_postings[token].append(row_id)
+
+        self.trigrams = {k: np.asarray(v, dtype=np.int32) for k, v in trigram_postings.items()}
+        self.tokens = {k: np.asarray(v, dtype=np.int32) for k, v in token_postings.items()}
+
+    # ---------------------------------------------------------------------
+    def to_arrays(self):
+        """Flat CSR form ``{"trigrams": (keys, offsets, ids), "tokens": ...}`` for on-disk storage."""
+        return {"trigrams": _to_csr(self.trigrams), "tokens": _to_csr(self.tokens)}
+
+    @classmethod
+    def from_arrays(cls, size, trigrams, tokens):
+        """Rebuild an index from ``to_arrays`` output without re-tokenizing any name."""
+        return cls(size=size, trigrams=CSRPostings(*trigrams), tokens=CSRPostings(*tokens))
+
+    def updated(self, added, removed):
+        """
+        New index with ``added`` / ``removed`` (row_id -> name) applied.
+
+        Only the posting lists of the affected grams are rebuilt; ``self``
+        is left as it was so searches running on it are not disturbed.
+        """
+        size = max([self.size, *(row_id + 1 for row_id in added)])
+        tables = []
+        for table, keys_of in ((self.trigrams, name_trigrams), (self.tokens, lambda n: set(n.split()))):
+            plus, minus = defaultdict(list), defaultdict(list)
+            for row_id, name in added.items():
+                for key in keys_of(normalize_name(name)):
+                    plus[key].append(row_id)
+            for row_id, name in removed.items():
+                for key in keys_of(normalize_name(name)):
+                    minus[key].append(row_id)
+
+            overrides = {}
+            for key in plus.keys() | minus.keys():
+                ids = table[key] if key in table else np.zeros(0, dtype=np.int32)
+                if key in minus:
+                    ids = ids[~np.isin(ids, minus[key])]
+                if key in plus:
+                    ids = np.union1d(ids, np.asarray(plus[key], dtype=np.int32))
+                overrides[key] = ids.astype(np.int32, copy=False)
+            tables.append(OverlayPostings(table, overrides))
+        return NameIndex(size=size, trigrams=tables[0], tokens=tables[1])
+
+    # ---------------------------------------------------------------------
+    def _postings(self, table, keys):
+        lists = [table[k] for k in keys if k in table]
+        max_df = max(1, int(self.size * MAX_DOC_FREQUENCY))
+        selective = [p for p in lists if len(p) <= max_df]
+        # If every gram is common (e.g. the query is just "tablet") keep them all.
+        return selective or lists
+
+    def shortlist(self, query, limit=300):
+        """
+        Return up to ``limit`` row ids that share the most trigrams/tokens with
+        ``query``, sorted by row id so ties resolve in catalogue order exactly
+        like a full scan would.
+        """
+        if self.size <= limit:
+            return list(range(self.size))
+
+        normalized = normalize_name(query)
+        if not normalized:
+            return []
+
+        scores = np.zeros(self.size, dtype=np.int32)
+        for posting in self._postings(self.trigrams, name_trigrams(normalized)):
+            scores[posting] += 1
+        for posting in self._postings(self.tokens, set(normalized.split())):
+            scores[posting] += TOKEN_WEIGHT
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > limit:
+            top = np.argpartition(scores[hits], -limit)[-limit:]
+            hits = hits[top]
+        return sorted(hits.tolist())
@@ -0,0 +1,222 @@
+# medicinebot/agents/ocr_backends.py
+
+import asyncio
+import io
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Vision accepts at most 16 images per batch_annotate_images call.
+VISION_BATCH_SIZE = 16
+VISION_CHANNEL_POOL_SIZE = 4
+
+
+class OCRBackend:
+    """
+    Text detection on prepared image bytes (see image_prep.prepare_for_ocr).
+
+    Subclasses implement ``detect_text``; the batch and async versions
+    default to looping / running it in a thread.
+    """
+
+    def detect_text(self, content):
+        """Text read from one image, or None if there is none."""
+        raise NotImplementedError
+
+    def batch_detect_text(self, contents):
+        """One result per image, in order; a failed image gives None."""
+        return [self._detect_or_none(content) for content in contents]
+
+    def _detect_or_none(self, content):
+        try:
+            return self.detect_text(content)
+        except Exception as e:
+            print(f"OCR Backend ERROR: {e}")
+            return None
+
+    async def adetect_text(self, content):
+        return await asyncio.to_thread(self.detect_text, content)
+
+
+# ----------------------------------------------------------------------
+# Google Cloud Vision
+# ----------------------------------------------------------------------
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+
+def vision_credentials():
+    """Service-account credentials from gcloud_key.json, read from disk once per process."""
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                from google.oauth2 import service_account
+
+                key_path = getattr(settings, "GOOGLE_VISION_KEY_PATH", os.path.join(settings.BASE_DIR, "gcloud_key.json"))
+                _credentials = service_account.Credentials.from_service_account_file(key_path)
+    return _credentials
+
+
+class VisionClientPool:
+    """
+    A few long-lived ``ImageAnnotatorClient``s (one gRPC channel each),
+    handed out round-robin. Channels stay warm between requests, so only
+    the first call pays for the TLS handshake, and concurrent requests
+    are spread over several HTTP/2 connections instead of one.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._clients = None
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._clients is None:
+                from google.cloud import vision
+
+                credentials = vision_credentials()
+                self._clients = [vision.ImageAnnotatorClient(credentials=credentials) for _ in range(self.size)]
+                self._cycle = itertools.cycle(self._clients)
+                print(f"OCR Backend: Opened {self.size} Vision channels")
+            return next(self._cycle)
+
+
+class GoogleVisionBackend(OCRBackend):
+    def __init__(self):
+        from google.cloud import vision
+
+        self._vision = vision
+        self.pool = VisionClientPool(getattr(settings, "VISION_CHANNEL_POOL_SIZE", VISION_CHANNEL_POOL_SIZE))
+
+    def _request(self, content):
+        vision = self._vision
+        return vision.AnnotateImageRequest(
+            image=vision.Image(content=content),
+            features=[vision.Feature(type_=vision.Feature.Type.TEXT_DETECTION)],
+        )
+
+    def detect_text(self, content):
+        response = self.pool.get().text_detection(image=self._vision.Image(content=content))
+        return vision_response_text(response)
+
+    def batch_detect_text(self, contents):
+        """Up to VISION_BATCH_SIZE images per ``batch_annotate_images`` round trip."""
+        results = []
+        for start in range(0, len(contents), VISION_BATCH_SIZE):
+            chunk = contents[start:start + VISION_BATCH_SIZE]
+            batch = self.pool.get().batch_annotate_images(requests=[self._request(c) for c in chunk])
+            for response in batch.responses:
+                try:
+                    results.append(vision_response_text(response))
+                except Exception as e:
+                    print(f"OCR Backend ERROR: {e}")
+                    results.append(None)
+        return results
+
+    async def adetect_text(self, content):
+        # grpc.aio client owned by the running event loop
+        from .async_clients import vision_client
+
+        batch = await vision_client().batch_annotate_images(requests=[self._request(content)])
+        return vision_response_text(batch.responses[0])
+
+
+def vision_response_text(response):
+    if response.error.message:
+        raise Exception(f"Google Vision API Error: {response.error.message}")
+
+    if response.full_text_annotation:
+        return response.full_text_annotation.text.strip()
+    return None
+
+
+# ----------------------------------------------------------------------
+# Local engines
+# ----------------------------------------------------------------------
+
+class TesseractBackend(OCRBackend):
+    """
+    Local OCR with Tesseract (`pytesseract` + the `tesseract` binary): no
+    network, no API bill; weaker than Vision on curved or glossy packs.
+    """
+
+    def __init__(self):
+        try:
+            import pytesseract
+        except ImportError:
+            raise ImproperlyConfigured("The tesseract OCR backend needs `pip install pytesseract`.")
+        from PIL import Image
+
+        self._tesseract = pytesseract
+        self._image = Image
+        self.lang = getattr(settings, "TESSERACT_LANG", "eng")
+        self.workers = getattr(settings, "TESSERACT_WORKERS", os.cpu_count() or 1)
+
+    def detect_text(self, content):
+        with self._image.open(io.BytesIO(content)) as img:
+            text = self._tesseract.image_to_string(img, lang=self.lang).strip()
+        return text or None
+
+    def batch_detect_text(self, contents):
+        # Each call runs a tesseract process, so threads give real parallelism.
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(self._detect_or_none, contents))
+
+
+class StubBackend(OCRBackend):
+    """
+    Canned OCR_STUB_TEXT for every image, after OCR_STUB_LATENCY seconds
+    (to stand in for a real engine's latency): tests and offline benchmarks.
+    """
+
+    def __init__(self):
+        self.text = getattr(settings, "OCR_STUB_TEXT", "")
+        self.latency = getattr(settings, "OCR_STUB_LATENCY", 0.0)
+
+    def detect_text(self, content):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.text or None
+
+
+BACKENDS = {
+    "google": GoogleVisionBackend,
+    "tesseract": TesseractBackend,
+    "stub": StubBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_ocr_backend(name=None):
+    """
+    The backend called ``name`` (a BACKENDS key or a dotted class path;
+    ``settings.OCR_BACKEND`` by default), created once per process.
+    """
+    name = name or getattr(settings, "OCR_BACKEND", "google")
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                if name in BACKENDS:
+                    backend_class = BACKENDS[name]
+                else:
+                    try:
+                        backend_class = import_string(name)
+                    except ImportError:
+                        raise ImproperlyConfigured(f"Unknown OCR backend: {name!r}")
+                backend = _backends[name] = backend_class()
+                print(f"OCR Backend: Using {backend_class.__name__}")
+    return backend
@@ -1,57 +1,265 @@
-import pandas as pd
+import os
+import signal
+import threading
+import time
+
 from django.conf import settings
-from thefuzz import process, fuzz
+from django.db import DatabaseError
+from thefuzz import process, fuzz, utils
 import numpy as np
+from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+
+from ..tracing import annotate, traced
+from .autocomplete import AutocompleteIndex
+from .db_catalogue import load_database_catalogue
+from .embeddings import embedder_from_id
+from .field_parser import name_candidates
+from .vector_index import load_vector_index
+from .catalogue import (
+    MANIFEST_NAME,
+    Catalogue,
+    catalogue_from_frame,
+    compiled_is_current,
+    diff_catalogue,
+    load_catalogue,
+    read_catalogue_csv,
+)
+
+# Cells (queries x union of their shortlists) scored per cdist call in
+# batch search. Shortlists of unrelated queries barely overlap, so a bigger
+# block mostly adds masked-out cells; it pays off only with many cores.
+BATCH_CELL_BUDGET = 20_000
+
+# A CSV update touching more than this share of the rows is loaded from
+# scratch instead of being patched into the current snapshot.
+DELTA_MAX_FRACTION = 0.2
+
+# Fused ranking: weight of the fuzzy name score vs the embedding similarity,
+# and the fused score (0-1) a best candidate needs to be returned.
+FUSION_WEIGHTS = (0.6, 0.4)
+FUSED_MIN_SCORE = 0.6
+SEMANTIC_TOP_K = 20
+SEMANTIC_FLOOR = 0.15
+
+# `manage.py reload_catalogue --pid ...` sends this to the workers.
+RELOAD_SIGNAL = getattr(signal, "SIGUSR2", None)
 
 class SearchAgent:
     def __init__(self):
-        self.df = None
-        data_path = getattr(settings, "MEDICINE_DATA_PATH", None)
-        if not data_path:
+        # Nothing is read here: the catalogue is loaded on the first search,
+        # so importing this module (i.e. booting a worker) stays cheap.
+        # Searches read `self.catalogue` once and only ever see a finished
+        # snapshot; reloads build a new one and swap the reference.
+        self.catalogue = None
+        self.database_catalogue = None
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._signature = None
+        self._watcher = None
+        self._semantic = (None, None, None)
+        self._semantic_lock = threading.Lock()
+        self._autocomplete = (None, None)
+        self._autocomplete_lock = threading.Lock()
+        self.last_reload = None
+        self.shortlist_size = getattr(settings, "SEARCH_SHORTLIST_SIZE", 300)
+        self.batch_cell_budget = getattr(settings, "SEARCH_BATCH_CELL_BUDGET", BATCH_CELL_BUDGET)
+        # "memory": the CSV / compiled catalogue in this process; "database":
+        # the Medicine table and its FTS5 index (`manage.py sync_medicines`).
+        self.backend = getattr(settings, "SEARCH_BACKEND", "memory")
+        self.data_path = getattr(settings, "MEDICINE_DATA_PATH", None)
+        self.compiled_path = getattr(settings, "MEDICINE_CATALOGUE_PATH", None)
+        self.vector_path = getattr(settings, "VECTOR_INDEX_PATH", None)
+        self.fusion_weights = getattr(settings, "SEARCH_FUSION_WEIGHTS", FUSION_WEIGHTS)
+        self.fused_min_score = getattr(settings, "SEARCH_FUSED_MIN_SCORE", FUSED_MIN_SCORE)
+        self.semantic_top_k = getattr(settings, "SEARCH_SEMANTIC_TOP_K", SEMANTIC_TOP_K)
+        self.semantic_floor = getattr(settings, "SEARCH_SEMANTIC_FLOOR", SEMANTIC_FLOOR)
+        self.autocomplete_limit = getattr(settings, "AUTOCOMPLETE_LIMIT", 8)
+        self.autocomplete_max_edits = getattr(settings, "AUTOCOMPLETE_MAX_EDITS", 2)
+
+    def get_catalogue(self):
+        if self.catalogue is None:
+            with self._load_lock:
+                if self.catalogue is None:
+                    self.catalogue = self._load()
+                    self._start_watcher()
+        return self.catalogue
+
+    def search_catalogue(self):
+        """
+        What ``search`` and ``match_name`` read: ``get_catalogue()``, or the
+        database with SEARCH_BACKEND = "database" (nothing loaded in memory).
+        Batch search, ranking and the semantic stage always use the
+        in-memory catalogue.
+        """
+        if self.backend != "database":
+            return self.get_catalogue()
+        if self.database_catalogue is None:
+            with self._load_lock:
+                if self.database_catalogue is None:
+                    self.database_catalogue = load_database_catalogue()
+        return self.database_catalogue
+
+    def _load(self):
+        if not self.data_path and not self.compiled_path:
             print("SearchAgent ERROR: MEDICINE_DATA_PATH missing in settings.")
+            return None
+
+        try:
+            self._signature = self._source_signature()
+            catalogue = load_catalogue(self.data_path, self.compiled_path)
+            print(f" Search Agent: Loaded {catalogue.size} medicines from {catalogue.source}.")
+            self.autocomplete_index(catalogue)
+            return catalogue
+        except Exception as e:
+            print(f"SearchAgent ERROR loading catalogue: {e}")
+            return None
+
+    # ---------------------------------------------------------------------
+    # Hot reload
+    # ---------------------------------------------------------------------
+    def _source_signature(self):
+        signature = []
+        for path in (self.data_path, self.compiled_path and os.path.join(self.compiled_path, MANIFEST_NAME)):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except (OSError, TypeError):
+                signature.append(None)
+        return tuple(signature)
+
+    def _start_watcher(self):
+        interval = getattr(settings, "MEDICINE_CATALOGUE_WATCH_INTERVAL", 0)
+        if not interval or self._watcher is not None:
             return
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="catalogue-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            if self._source_signature() != self._signature:
+                self._reload()
+
+    def reload(self, wait=False):
+        """
+        Rebuild the catalogue in a background thread and swap it in
+        atomically (and recount the Medicine table in database mode).
+        """
+        thread = threading.Thread(target=self._reload, name="catalogue-reload", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return thread
 
+    def _reload(self):
+        # One reload at a time; a change that lands meanwhile is picked up
+        # by the watcher on its next tick because the signature still differs.
+        if not self._reload_lock.acquire(blocking=False):
+            return
         try:
-            self.df = pd.read_csv(data_path, dtype={"EAN": str})
-            self.df["EAN"] = self.df["EAN"].astype(str).str.strip()
-            self.df["Name"] = self.df["Name"].astype(str).str.strip()
-            self.name_list = self.df["Name"].tolist()
-            print(f" Search Agent: Loaded {len(self.df)} medicines from {data_path}.")
+            if self.database_catalogue is not None:
+                try:
+                    print(f" Search Agent: {self.database_catalogue.refresh()} medicines in the database.")
+                except DatabaseError as e:
+                    print(f"SearchAgent ERROR counting the database catalogue: {e}")
+            start = time.perf_counter()
+            signature = self._source_signature()
+            current = self.catalogue
+            added = removed = changed = ()
+
+            if current is None or compiled_is_current(self.compiled_path, self.data_path):
+                mode, catalogue = "full", load_catalogue(self.data_path, self.compiled_path)
+            else:
+                df = read_catalogue_csv(self.data_path)
+                delta = diff_catalogue(current, df)
+                if delta is not None:
+                    added, removed, changed = delta
+                touched = len(added) + len(removed) + len(changed)
+                if delta is not None and not touched:
+                    mode, catalogue = "unchanged", current
+                elif delta is not None and touched <= DELTA_MAX_FRACTION * max(1, current.size):
+                    mode, catalogue = "delta", current.apply_delta(added, removed, changed)
+                else:
+                    mode, catalogue = "full", catalogue_from_frame(df, self.data_path)
+
+            # Swapped in with its type-ahead index ready, not built on the next keystroke.
+            self.autocomplete_index(catalogue)
+            self.catalogue = catalogue  # the atomic swap
+            self._signature = signature
+            self.last_reload = {
+                "mode": mode,
+                "seconds": time.perf_counter() - start,
+                "added": len(added),
+                "removed": len(removed),
+                "changed": len(changed),
+                "rows": catalogue.size,
+                "finished_at": time.time(),
+            }
+            print(
+                f" Search Agent: {mode} reload in {self.last_reload['seconds']:.3f}s "
+                f"(+{len(added)} -{len(removed)} ~{len(changed)} rows)."
+            )
         except Exception as e:
-            print(f"SearchAgent ERROR loading CSV: {e}")
+            print(f"SearchAgent ERROR reloading catalogue: {e}")
+        finally:
+            self._reload_lock.release()
 
     # ---------------------------------------------------------------------
     def search(self, identifier, is_barcode=False):
         """Find medicine via barcode (exact) or name (fuzzy multi-stage)."""
-        if self.df is None or not identifier:
-            return None
+        record, phase = self._search(identifier, is_barcode)
+        if phase is not None:
+            annotate(phase=phase)
+        return record
+
+    def _search(self, identifier, is_barcode=False):
+        """``search``, and the phase that answered it (None if nothing was searched)."""
+        catalogue = self.search_catalogue()
+        if catalogue is None or not identifier:
+            return None, None
 
         # 🔹 1️⃣ BARCODE SEARCH – exact match only
         if is_barcode:
-            clean_id = str(identifier).strip()
-            result = self.df[self.df["EAN"] == clean_id]
-            return result.iloc[0].to_dict() if not result.empty else None
+            record = catalogue.find_ean(identifier)
+            return record, "barcode" if record is not None else "none"
 
         # 🔹 2️⃣ TEXT SEARCH – fuzzy & token-based
         query = str(identifier).lower().strip()
         print(f"Rapid fuzzy triggered for query: {query}")
 
+        # Only the shortlisted names go through the (expensive) scorers below.
+        candidates = catalogue.candidates(query, self.shortlist_size)
+        if not candidates:
+            print(" No reliable match found.")
+            return None, "none"
+
         # --- Phase 1: Direct QRatio match
-        best_q = process.extractOne(query, self.name_list, scorer=fuzz.QRatio)
+        best_q = process.extractOne(query, candidates, scorer=fuzz.QRatio)
         if best_q and best_q[1] >= 85:
             print(f" QRatio matched: {best_q}")
-            return self.df[self.df["Name"] == best_q[0]].iloc[0].to_dict()
+            return catalogue.find_name(best_q[0]), "qratio"
+
+        # --- Phase 2: fused fuzzy + semantic ranking, when a vector index is built.
+        # A weak fused score (or a failed query embedding) isn't a verdict:
+        # the fuzzy phases below still get their say.
+        if self.semantic_stage(catalogue) is not None:
+            ranked = self.rank(query, limit=1, catalogue=catalogue, candidates=candidates)
+            if ranked and ranked[0]["semantic"] is not None and ranked[0]["score"] >= self.fused_min_score:
+                print(f" Fused match: {ranked[0]}")
+                return catalogue.record(ranked[0]["row"]), "fused"
 
         # --- Phase 2: Token set (handles word order / missing parts)
-        best_t = process.extractOne(query, self.name_list, scorer=fuzz.token_set_ratio)
+        best_t = process.extractOne(query, candidates, scorer=fuzz.token_set_ratio)
         if best_t and best_t[1] >= 80:
             print(f" TokenSet matched: {best_t}")
-            return self.df[self.df["Name"] == best_t[0]].iloc[0].to_dict()
+            return catalogue.find_name(best_t[0]), "tokenset"
 
         # --- Phase 3: Weighted rescue matching (substring + loose ratio)
         print("Keyword Rescue triggered...")
         possible = []
-        for name in self.name_list:
+        for name in candidates:
             n = name.lower()
             ratio = (
                 fuzz.partial_ratio(query, n) * 0.6
@@ -63,16 +271,334 @@ class SearchAgent:
         if possible:
             best = max(possible, key=lambda x: x[1])
             print(f"Weighted Rescue match: {best}")
-            return self.df[self.df["Name"] == best[0]].iloc[0].to_dict()
+            return catalogue.find_name(best[0]), "rescue"
 
         print(" No reliable match found.")
+        return None, "none"
+
+    def match_name(self, text, min_score=90):
+        """
+        Strict name lookup used by the extraction fast path: the catalogue
+        name closest to ``text`` by QRatio, as ``(name, score)``, or None
+        below ``min_score``. No token-set / rescue phases — a false positive
+        here would skip the LLM entirely.
+        """
+        catalogue = self.search_catalogue()
+        if catalogue is None or not text:
+            return None
+        query = str(text).lower().strip()
+        candidates = catalogue.candidates(query, self.shortlist_size)
+        best = process.extractOne(query, candidates, scorer=fuzz.QRatio) if candidates else None
+        if best and best[1] >= min_score:
+            return best[0], best[1]
         return None
 
+    def speculate(self, raw_text, min_score=85):
+        """
+        Search the leading OCR lines of a package (while the extraction
+        agent is still working). Returns ``(record, name, score)`` for the
+        best hit whose catalogue name matches its line at ``min_score`` or
+        more (token sort ratio, so a bare brand doesn't claim one of its
+        variants), or None.
+        """
+        best = None
+        for candidate in name_candidates(raw_text):
+            # Not through ``search``: these guesses don't count as searches
+            # in medguard_search_phase_total.
+            record, _ = self._search(candidate)
+            if record is None:
+                continue
+            name = str(record.get("Name", ""))
+            score = fuzz.token_sort_ratio(candidate.lower(), name.lower())
+            if score >= min_score and (best is None or score > best[2]):
+                best = (record, name, score)
+        return best
+
+    # ---------------------------------------------------------------------
+    # Semantic retrieval
+    # ---------------------------------------------------------------------
+    def semantic_stage(self, catalogue):
+        """
+        ``(VectorIndex, embedder)`` for this catalogue snapshot, or None when
+        no current index was built (`manage.py build_index`). Loaded (and
+        memory-mapped) once per snapshot. The vector index is keyed by
+        in-memory rows, so the database backend has no semantic stage.
+        """
+        if not isinstance(catalogue, Catalogue):
+            return None
+        cached_for, index, embedder = self._semantic
+        if cached_for is catalogue:
+            return None if index is None else (index, embedder)
+        with self._semantic_lock:
+            cached_for, index, embedder = self._semantic
+            if cached_for is not catalogue:
+                index = embedder = None
+                try:
+                    if self.vector_path and not catalogue.row_overrides:
+                        index = load_vector_index(self.vector_path, self.data_path)
+                    if index is not None and len(index) != catalogue.size:
+                        print(" Search Agent: vector index doesn't match the catalogue, semantic stage off.")
+                        index = None
+                    if index is not None:
+                        embedder = embedder_from_id(index.manifest["embedder"])
+                        print(f" Search Agent: Semantic stage on ({len(index)} vectors, {index.manifest['embedder']}).")
+                except Exception as e:
+                    print(f"SearchAgent ERROR loading vector index: {e}")
+                    index = embedder = None
+                self._semantic = (catalogue, index, embedder)
+        return None if index is None else (index, embedder)
+
+    # ---------------------------------------------------------------------
+    # Autocomplete
+    # ---------------------------------------------------------------------
+    def autocomplete_index(self, catalogue):
+        """The ``AutocompleteIndex`` of this catalogue snapshot, built once (at load / reload)."""
+        cached_for, index = self._autocomplete
+        if cached_for is catalogue:
+            return index
+        with self._autocomplete_lock:
+            cached_for, index = self._autocomplete
+            if cached_for is not catalogue:
+                start = time.perf_counter()
+                try:
+                    index = AutocompleteIndex(catalogue, self.autocomplete_max_edits)
+                    print(f" Search Agent: Autocomplete index of {len(index)} words built in {time.perf_counter() - start:.3f}s.")
+                except Exception as e:
+                    print(f"SearchAgent ERROR building autocomplete index: {e}")
+                    index = None
+                self._autocomplete = (catalogue, index)
+        return index
+
+    @traced("search.autocomplete")
+    def autocomplete(self, query, limit=None):
+        """
+        Type-ahead suggestions for the search box: ``[{"name", "eans"}]``,
+        best first. With SEARCH_BACKEND = "database" they come from the
+        FTS5 index, so no worker loads the CSV for them.
+        """
+        if not query:
+            return []
+        if self.backend == "database":
+            catalogue = self.search_catalogue()
+            if catalogue is None:
+                return []
+            results = catalogue.complete(query, limit or self.autocomplete_limit, self.autocomplete_max_edits)
+            annotate(results=len(results), backend="database")
+            return results
+        catalogue = self.get_catalogue()
+        if catalogue is None:
+            return []
+        index = self.autocomplete_index(catalogue)
+        if index is None:
+            return []
+        results = index.complete(query, limit or self.autocomplete_limit)
+        annotate(results=len(results))
+        return results
+
+    def rank(self, query, limit=10, catalogue=None, candidates=None):
+        """
+        Fused candidate list for a free-text query, best first: dicts with
+        ``row``, ``name``, ``score`` (fused, 0-1), ``fuzzy`` and ``semantic``.
+
+        Candidates are the name-index shortlist plus the SEMANTIC_TOP_K
+        nearest rows by embedding, so a query by ingredient or use
+        ("paracetamol 500 syrup") or a garbled OCR name still surfaces the
+        right rows. Fuzzy = best of QRatio / TokenSet / weighted rescue.
+        If the query can't be embedded, the ranking is fuzzy only and
+        ``semantic`` is None.
+        """
+        catalogue = catalogue or self.get_catalogue()
+        if catalogue is None or not query:
+            return []
+        query = str(query).lower().strip()
+        if candidates is None:
+            candidates = catalogue.candidates(query, self.shortlist_size)
+
+        rows = {catalogue.name_lookup[name] for name in candidates if name in catalogue.name_lookup}
+        semantic = {}
+        stage = self.semantic_stage(catalogue)
+        vector = None
+        if stage is not None:
+            index, embedder = stage
+            vector = self._query_vector(embedder, query)
+        if vector is not None:
+            top_rows, top_scores = index.search(vector, self.semantic_top_k)
+            semantic = dict(zip(top_rows.tolist(), top_scores.tolist()))
+            rows.update(catalogue.name_lookup.get(catalogue.names[r], r) for r in semantic)
+            missing = [r for r in rows if r not in semantic]
+            if missing:
+                semantic.update(zip(missing, index.scores(vector, missing).tolist()))
+        if not rows:
+            return []
+
+        rows = sorted(rows)
+        names = [catalogue.names[r] for r in rows]
+        processed = [utils.full_process(n) for n in names]
+        q = utils.full_process(query)
+        fuzzy = np.maximum.reduce([
+            self._cdist([q], processed, rf_fuzz.QRatio)[0],
+            self._cdist([q], processed, rf_fuzz.token_set_ratio)[0],
+            self._cdist([query], [n.lower() for n in names], rf_fuzz.partial_ratio)[0] * 0.6
+            + self._cdist([q], processed, rf_fuzz.token_sort_ratio)[0] * 0.4,
+        ]) / 100.0
+        sem = np.array([max(semantic.get(r, 0.0), 0.0) for r in rows])
+        # Cosine scales differ a lot between embedders; relative to this
+        # query's best hit they are comparable. A best hit under the floor
+        # means nothing in the catalogue is about the query: fuzzy alone.
+        top = max(semantic.values(), default=0.0)
+        if top >= self.semantic_floor:
+            w_fuzzy, w_semantic = self.fusion_weights
+            fused = w_fuzzy * fuzzy + w_semantic * sem / top
+        else:
+            fused = fuzzy
+
+        order = np.argsort(-fused, kind="stable")[:limit]
+        return [
+            {
+                "row": rows[i],
+                "name": names[i],
+                "score": round(float(fused[i]), 4),
+                "fuzzy": round(float(fuzzy[i]), 4),
+                "semantic": round(float(sem[i]), 4) if semantic else None,
+            }
+            for i in order
+        ]
+
+    def _query_vector(self, embedder, query):
+        """The query's embedding, or None if the embedder failed or timed out."""
+        try:
+            return embedder.embed_query(query)
+        except Exception as e:
+            print(f"SearchAgent ERROR: query embedding failed ({e}), using fuzzy matching only")
+            return None
+
+    # ---------------------------------------------------------------------
+    def _cdist(self, queries, choices, scorer):
+        scores = rf_process.cdist(
+            queries, choices, scorer=scorer, dtype=np.float32, workers=-1
+        )
+        # thefuzz rounds every score to an int before comparing thresholds.
+        return np.rint(scores)
+
+    def _batch_blocks(self, order, shortlists):
+        """
+        Split ``order`` into runs of queries scored in one matrix: each run
+        grows until (queries x union of their shortlists) would pass
+        ``batch_cell_budget``.
+        """
+        block, union = [], set()
+        for i in order:
+            grown = union.union(shortlists[i])
+            if block and (len(block) + 1) * len(grown) > self.batch_cell_budget:
+                yield block, union
+                block, grown = [], set(shortlists[i])
+            block.append(i)
+            union = grown
+        if block:
+            yield block, union
+
+    def search_many(self, queries):
+        """
+        Batch version of the text search for invoices / shelf audits.
+
+        Each query is scored against its name-index shortlist (the names
+        ``search`` would score): the queries of a block go through one
+        multi-threaded ``cdist`` per phase over the union of their
+        shortlists, with every row masked to its own shortlist columns.
+        Same phases, thresholds and phase names as ``search`` (qratio >= 85,
+        tokenset >= 80, rescue > 70); the fused semantic phase is not run.
+        Returns a DataFrame in input order: ``query``, ``phase``, ``score``
+        and the matched catalogue columns (empty when nothing matched).
+        """
+        import pandas as pd
+
+        queries = list(queries)
+        catalogue = self.get_catalogue()
+        columns = ["query", "phase", "score"] + (
+            catalogue.column_names if catalogue is not None else []
+        )
+        if catalogue is None or not queries:
+            return pd.DataFrame(columns=columns)
+
+        lowered = [str(q).lower().strip() if q else "" for q in queries]
+        processed = [utils.full_process(q) for q in lowered]
+
+        phase = np.full(len(queries), None, dtype=object)
+        score = np.full(len(queries), np.nan)
+        match = np.full(len(queries), -1, dtype=np.int64)
+
+        # A name listed twice scores the same on both rows; the first one
+        # wins the argmax, as in extractOne.
+        shortlists = {
+            i: catalogue.candidate_rows(lowered[i], self.shortlist_size)
+            for i, query in enumerate(processed) if query
+        }
+        # Neighbours in sorted order mostly share a brand, and so most of
+        # their shortlists: the union stays small.
+        order = sorted((i for i in shortlists if shortlists[i]), key=lowered.__getitem__)
+
+        for block, union in self._batch_blocks(order, shortlists):
+            rows = np.array(block)
+            union = np.array(sorted(union))
+            allowed = np.zeros((len(rows), len(union)), dtype=bool)
+            for k, i in enumerate(block):
+                allowed[k, np.searchsorted(union, shortlists[i])] = True
+            # Same preprocessing thefuzz applies inside extractOne / QRatio.
+            union_lowered = [catalogue.names[r].lower() for r in union.tolist()]
+            union_processed = [utils.full_process(n) for n in union_lowered]
+
+            phases = (
+                # --- Phase 1: QRatio
+                ("qratio", np.greater_equal, 85,
+                 lambda pending: self._cdist([processed[i] for i in pending], union_processed, rf_fuzz.QRatio)),
+                # --- Phase 2: Token set
+                ("tokenset", np.greater_equal, 80,
+                 lambda pending: self._cdist([processed[i] for i in pending], union_processed, rf_fuzz.token_set_ratio)),
+                # --- Phase 3: Weighted rescue
+                ("rescue", np.greater, 70,
+                 lambda pending: self._cdist([lowered[i] for i in pending], union_lowered, rf_fuzz.partial_ratio) * 0.6
+                 + self._cdist([processed[i] for i in pending], union_processed, rf_fuzz.token_sort_ratio) * 0.4),
+            )
+            for label, passes, threshold, scores_of in phases:
+                scores = np.where(allowed, scores_of(rows), -1)
+                best = scores.argmax(axis=1)
+                best_score = scores[np.arange(len(rows)), best]
+                hit = passes(best_score, threshold)
+                phase[rows[hit]], score[rows[hit]], match[rows[hit]] = label, best_score[hit], union[best[hit]]
+                rows, allowed = rows[~hit], allowed[~hit]
+                if not len(rows):
+                    break
+
+        results = []
+        for i, query in enumerate(queries):
+            row = {"query": query, "phase": phase[i], "score": score[i]}
+            if match[i] >= 0:
+                row.update(catalogue.find_name(catalogue.names[match[i]]))
+            results.append(row)
+        return pd.DataFrame(results, columns=columns)
+
 # ---------------------------------------------------------------------
 # Wrapper for Django views
 # ---------------------------------------------------------------------
 search_agent_instance = SearchAgent()
 
+def _on_reload_signal(signum, frame):
+    search_agent_instance.reload()
+
+# Signal handlers can only be installed from the main thread.
+if (
+    RELOAD_SIGNAL is not None
+    and getattr(settings, "MEDICINE_CATALOGUE_RELOAD_SIGNAL", False)
+    and threading.current_thread() is threading.main_thread()
+):
+    signal.signal(RELOAD_SIGNAL, _on_reload_signal)
+
+@traced("search")
 def run_search_agent(query_text, is_barcode=False):
     """Exposes fuzzy search to Django views."""
     return search_agent_instance.search(query_text, is_barcode)
+
+@traced("search.batch")
+def run_batch_search_agent(queries):
+    """Batch fuzzy search (DataFrame in input order)."""
+    return search_agent_instance.search_many(queries)
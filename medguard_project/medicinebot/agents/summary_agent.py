@@ -1,15 +1,72 @@
-import ollama
+import hashlib
+import json
+import time
+
 import markdown
-import pandas as pd
 from django.conf import settings
 
+from ..models import MedicineSummary
+from ..tracing import annotate, record, traced
+from .llm_gateway import LLMError, llm_gateway
+from .summary_cache import summary_cache
+
+SUMMARY_MODEL = "phi3"
+# Bump whenever the layout/prompt changes so cached summaries are not reused.
+SUMMARY_PROMPT_VERSION = 2
+# Bump whenever the row prompt changes so stored row summaries are regenerated.
+ROW_PROMPT_VERSION = 1
+
+
+def row_summary_key(db_context):
+    """Identity of a pre-generated row summary (model + prompt + DB row)."""
+    payload = json.dumps([SUMMARY_MODEL, ROW_PROMPT_VERSION, db_context], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StreamCleaner:
+    """
+    ``SummaryAgent._clean_markdown`` applied to a token stream: text is
+    buffered until a newline, then the finished line is cleaned. The
+    replacements never span lines, so the result is the same as cleaning
+    the whole response at the end.
+    """
+
+    def __init__(self, clean_line):
+        self._clean_line = clean_line
+        self._buffer = ""
+        self.lines = []
+
+    def feed(self, text):
+        """Cleaned, non-empty lines completed by ``text``."""
+        self._buffer += text
+        *complete, self._buffer = self._buffer.split("\n")
+        return self._keep(complete)
+
+    def finish(self):
+        rest, self._buffer = self._buffer, ""
+        return self._keep([rest])
+
+    def _keep(self, raw_lines):
+        done = [line for line in map(self._clean_line, raw_lines) if line]
+        self.lines.extend(done)
+        return done
+
+    @property
+    def partial(self):
+        return self._clean_line(self._buffer)
+
+    @property
+    def text(self):
+        return "\n\n".join(self.lines)
+
 
 class SummaryAgent:
     def _get_context_from_df(self, search_results_dict_or_df):
         """Extract reliable data from DataFrame or dict."""
         if isinstance(search_results_dict_or_df, dict):
             row = search_results_dict_or_df
-        elif isinstance(search_results_dict_or_df, pd.DataFrame) and not search_results_dict_or_df.empty:
+        elif search_results_dict_or_df is not None and not search_results_dict_or_df.empty:
+            # Only a pandas DataFrame gets here; pandas isn't imported up front.
             row = search_results_dict_or_df.iloc[0].to_dict()
         else:
             return "No relevant data found in the database.", "Unknown Medicine"
@@ -28,8 +85,8 @@ class SummaryAgent:
         return context, db_data["Name"]
 
     # ----------------------------------------------------------
-    def _generate_summary(self, db_context, medicine_name, extracted_data=None, is_barcode=False):
-        """Unified summary generator for both OCR and barcode."""
+    def _prepare_summary(self, db_context, medicine_name, extracted_data):
+        """(finished html, None, None) for unknown medicines, else (None, cache key, header markdown)."""
         is_legal = not ("No relevant data found" in db_context or not db_context)
         legal_status = (
             "✅ Legal Status: Legal"
@@ -45,16 +102,145 @@ class SummaryAgent:
         if not is_legal:
             return markdown.markdown(
                 f"### {medicine_name}\n\n{legal_status}\n"
-            )
+            ), None, None
 
-        # 🧠 AI summary for known medicine
-        full_context = f"""
-        NAME: {medicine_name}
-        DATABASE DATA: {db_context}
-        IMAGE/BARCODE DATA: {extracted_data if extracted_data else 'N/A'}
+        # ⚡ Same row + same extracted fields => same summary
+        cache_key = summary_cache.make_key(
+            SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, db_context, extracted_data
+        )
+        header_md = (
+            f"### {medicine_name}\n\n{legal_status}\n\n{warning_md}"
+            f"{self._scan_lines(extracted_data)}"
+        )
+        return None, cache_key, header_md
+
+    def _generate_summary(self, db_context, medicine_name, extracted_data=None, is_barcode=False):
+        """Unified summary generator for both OCR and barcode."""
+        fallback, cache_key, header_md = self._prepare_summary(db_context, medicine_name, extracted_data)
+        if fallback is not None:
+            return fallback
+
+        cached = summary_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # 🧠 Row part (pre-generated offline, or generated once and stored)
+        try:
+            row_md = self.get_row_summary(db_context, medicine_name)
+        except LLMError as e:
+            print(f"Summary Agent: {e}, falling back to the database fields")
+            return markdown.markdown(f"{header_md}\n\n{self._fallback_row_summary(db_context)}")
+
+        summary_html = markdown.markdown(f"{header_md}\n\n{row_md}")
+        summary_cache.set(cache_key, summary_html)
+        return summary_html
+
+    async def _agenerate_summary(self, db_context, medicine_name, extracted_data=None, is_barcode=False):
+        """Async twin of ``_generate_summary`` (non-blocking cache, DB and LLM calls)."""
+        async for event, data in self.astream_summary(db_context, medicine_name, extracted_data):
+            if event == "done":
+                return data
+
+    async def aready_summary(self, db_context, medicine_name, extracted_data=None):
+        """The finished summary html if it needs no LLM call (unknown medicine, cached, stored row), else None."""
+        fallback, cache_key, header_md = self._prepare_summary(db_context, medicine_name, extracted_data)
+        if fallback is not None:
+            return fallback
+        cached = await summary_cache.aget(cache_key)
+        if cached is not None:
+            return cached
+        stored = await self._astored_row_summary(db_context)
+        if stored is None:
+            return None
+        summary_html = markdown.markdown(f"{header_md}\n\n{stored}")
+        await summary_cache.aset(cache_key, summary_html)
+        return summary_html
+
+    async def astream_summary(self, db_context, medicine_name, extracted_data=None):
+        """
+        The summary as it is written, as ``(event, data)`` pairs:
+
+        - ``("chunk", html)``: a finished paragraph (the header first, right
+          away, then each cleaned line of the LLM output as it completes);
+        - ``("partial", text)``: the cleaned line being written so far;
+        - ``("done", html)``: the complete summary, identical to the
+          non-streaming one (and cached / stored like it).
         """
+        start = time.perf_counter()
+        summary_html = None
+        async for event, data in self._astream_summary(db_context, medicine_name, extracted_data):
+            if event == "done":
+                summary_html = data
+            yield event, data
+        record(
+            "summary.stream", time.perf_counter() - start,
+            html_bytes=len(summary_html.encode("utf-8")) if summary_html else None,
+        )
+
+    async def _astream_summary(self, db_context, medicine_name, extracted_data):
+        fallback, cache_key, header_md = self._prepare_summary(db_context, medicine_name, extracted_data)
+        if fallback is not None:
+            yield "done", fallback
+            return
+
+        cached = await summary_cache.aget(cache_key)
+        if cached is not None:
+            yield "done", cached
+            return
+
+        yield "chunk", markdown.markdown(header_md)
+
+        row_md = await self._astored_row_summary(db_context)
+        if row_md is None:
+            cleaner = StreamCleaner(self._clean_line)
+            prompt = self._row_prompt(db_context, medicine_name)
+            try:
+                async for text in llm_gateway.astream_chat(SUMMARY_MODEL, [{"role": "user", "content": prompt}]):
+                    for line in cleaner.feed(text):
+                        yield "chunk", markdown.markdown(line)
+                    yield "partial", cleaner.partial
+            except LLMError as e:
+                # Not stored or cached: the next request tries the LLM again.
+                print(f"Summary Agent: {e}, falling back to the database fields")
+                yield "done", markdown.markdown(f"{header_md}\n\n{self._fallback_row_summary(db_context)}")
+                return
+            for line in cleaner.finish():
+                yield "chunk", markdown.markdown(line)
+            row_md = cleaner.text
+            await self._astore_row_summary(db_context, medicine_name, row_md)
+
+        summary_html = markdown.markdown(f"{header_md}\n\n{row_md}")
+        await summary_cache.aset(cache_key, summary_html)
+        yield "done", summary_html
 
-        prompt = f"""
+    # ----------------------------------------------------------
+    def _scan_lines(self, extracted_data):
+        """Per-scan fields (MFG/Expiry/MRP) — never needs the LLM."""
+        extracted_data = extracted_data or {}
+        return "\n\n".join(
+            f"{icon} {field}: {extracted_data.get(field) or 'Not Found'}"
+            for icon, field in (("📜", "MFG Date"), ("⏳", "Expiry Date"), ("💰", "MRP"))
+        )
+
+    def _clean_line(self, line):
+        """🧹 Clean markdown noise and formatting (one line of LLM output)."""
+        return (
+            line.replace("**", "")
+            .replace("✅", "")
+            .replace("⚠️⚠️", "⚠️")
+            .replace("##", "")
+            .replace("###", "")
+            .replace("*", "")
+            .strip()
+        )
+
+    def _clean_markdown(self, ai_md):
+        # One paragraph per line once rendered.
+        lines = (self._clean_line(line) for line in ai_md.splitlines())
+        return "\n\n".join(line for line in lines if line)
+
+    def _row_prompt(self, db_context, medicine_name):
+        return f"""
         You are MedGuard AI’s summarizer.
         Generate a structured and neat medical summary using the provided data.
         Each line should be compact (1–2 short sentences).
@@ -62,34 +248,84 @@ class SummaryAgent:
         Keep layout clean and factual.
 
         CONTEXT:
-        {full_context}
+        NAME: {medicine_name}
+        DATABASE DATA: {db_context}
 
         Format (exactly this order):
-        📜 MFG Date: <short factual line or 'Not Found'>
-        ⏳ Expiry Date: <short factual line or 'Not Found'>
-        💰 MRP: <short factual line or 'Not Found'>
         💊 Type: <concise 1–2 sentence description>
         🌿 Ingredients: <concise 1–2 sentence summary of components>
         💗 Uses: <concise 1–2 sentence summary of medical use>
         ⚠️ Side Effects: <concise 1–2 sentence summary of possible side effects>
         """
 
-        response = ollama.chat(model="phi3", messages=[{"role": "user", "content": prompt}])
-        ai_md = response["message"]["content"]
+    def _fallback_row_summary(self, db_context):
+        """The row part straight from the database fields, when the LLM is unavailable."""
+        fields = dict(line.split(": ", 1) for line in db_context.splitlines() if ": " in line)
+        return "\n\n".join(
+            f"{icon} {field}: {fields[field]}"
+            for icon, field in (("💊", "Type"), ("🌿", "Ingredients"), ("💗", "Uses"), ("⚠️", "Side Effects"))
+            if fields.get(field)
+        )
 
-        # 🧹 Clean markdown noise and formatting
-        cleaned_md = (
-            ai_md.replace("**", "")
-            .replace("✅", "")
-            .replace("⚠️⚠️", "⚠️")
-            .replace("##", "")
-            .replace("###", "")
-            .replace("*", "")
-            .strip()
+    def generate_row_summary(self, db_context, medicine_name):
+        """LLM summary of the parts that depend only on the database row (raises LLMError)."""
+        prompt = self._row_prompt(db_context, medicine_name)
+        response = llm_gateway.chat(SUMMARY_MODEL, [{"role": "user", "content": prompt}])
+        return self._clean_markdown(response["message"]["content"])
+
+    async def agenerate_row_summary(self, db_context, medicine_name):
+        prompt = self._row_prompt(db_context, medicine_name)
+        response = await llm_gateway.achat(SUMMARY_MODEL, [{"role": "user", "content": prompt}])
+        return self._clean_markdown(response["message"]["content"])
+
+    def get_row_summary(self, db_context, medicine_name):
+        """Stored row summary, generating (and storing) it on first use."""
+        key = row_summary_key(db_context)
+        stored = (
+            MedicineSummary.objects.filter(context_hash=key)
+            .values_list("body_md", flat=True)
+            .first()
         )
+        if stored is not None:
+            return stored
+
+        body_md = self.generate_row_summary(db_context, medicine_name)
+        MedicineSummary.objects.get_or_create(
+            context_hash=key,
+            defaults={
+                "name": str(medicine_name)[:255],
+                "model": SUMMARY_MODEL,
+                "prompt_version": ROW_PROMPT_VERSION,
+                "body_md": body_md,
+            },
+        )
+        return body_md
+
+    async def aget_row_summary(self, db_context, medicine_name):
+        stored = await self._astored_row_summary(db_context)
+        if stored is not None:
+            return stored
+
+        body_md = await self.agenerate_row_summary(db_context, medicine_name)
+        await self._astore_row_summary(db_context, medicine_name, body_md)
+        return body_md
 
-        return markdown.markdown(
-            f"### {medicine_name}\n\n{legal_status}\n\n{warning_md}{cleaned_md}"
+    async def _astored_row_summary(self, db_context):
+        return await (
+            MedicineSummary.objects.filter(context_hash=row_summary_key(db_context))
+            .values_list("body_md", flat=True)
+            .afirst()
+        )
+
+    async def _astore_row_summary(self, db_context, medicine_name, body_md):
+        await MedicineSummary.objects.aget_or_create(
+            context_hash=row_summary_key(db_context),
+            defaults={
+                "name": str(medicine_name)[:255],
+                "model": SUMMARY_MODEL,
+                "prompt_version": ROW_PROMPT_VERSION,
+                "body_md": body_md,
+            },
         )
 
     # ----------------------------------------------------------
@@ -110,9 +346,37 @@ class SummaryAgent:
 
 summary_agent_instance = SummaryAgent()
 
+@traced("summary")
 def run_summary_agent(search_results, extracted_data, is_barcode=False):
     """Unified public entry point."""
     if is_barcode:
-        return summary_agent_instance.generate_barcode_summary(search_results)
+        summary_html = summary_agent_instance.generate_barcode_summary(search_results)
     else:
-        return summary_agent_instance.generate_ocr_summary(search_results, extracted_data)
+        summary_html = summary_agent_instance.generate_ocr_summary(search_results, extracted_data)
+    annotate(html_bytes=len(summary_html.encode("utf-8")))
+    return summary_html
+
+
+@traced("summary")
+async def arun_summary_agent(search_results, extracted_data, is_barcode=False):
+    """Async entry point for the ASGI pipeline."""
+    db_context, medicine_name = summary_agent_instance._get_context_from_df(search_results)
+    if is_barcode:
+        extracted_data = None
+    summary_html = await summary_agent_instance._agenerate_summary(db_context, medicine_name, extracted_data, is_barcode)
+    annotate(html_bytes=len(summary_html.encode("utf-8")))
+    return summary_html
+
+
+async def astart_summary(search_results, extracted_data, is_barcode=False):
+    """
+    ``(html, None)`` when the summary is ready without the LLM, else
+    ``("", stream_args)`` to pass to ``summary_agent_instance.astream_summary``.
+    """
+    db_context, medicine_name = summary_agent_instance._get_context_from_df(search_results)
+    if is_barcode:
+        extracted_data = None
+    ready = await summary_agent_instance.aready_summary(db_context, medicine_name, extracted_data)
+    if ready is not None:
+        return ready, None
+    return "", {"db_context": db_context, "medicine_name": medicine_name, "extracted_data": extracted_data}
@@ -0,0 +1,76 @@
+# medicinebot/agents/summary_cache.py
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from ..tracing import cache_event
+
+
+class SummaryCache:
+    """
+    Content-addressed cache for generated summaries.
+
+    The key is a SHA-256 over everything the LLM output depends on (model,
+    prompt template version, database context, extracted fields), so an
+    entry never has to be invalidated: change any input and it is a
+    different key. Storage, LRU and TTL come from the Django cache alias
+    ``SUMMARY_CACHE_ALIAS``.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias or getattr(settings, "SUMMARY_CACHE_ALIAS", "default")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(model, prompt_version, db_context, extracted_data):
+        payload = json.dumps(
+            [model, prompt_version, db_context, extracted_data],
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return "summary:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self._count(value)
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def _count(self, value):
+        cache_event("summary", value is not None)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    async def aget(self, key):
+        value = await self.backend.aget(key)
+        self._count(value)
+        return value
+
+    async def aset(self, key, value):
+        await self.backend.aset(key, value)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+summary_cache = SummaryCache()
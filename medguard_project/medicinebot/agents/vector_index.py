@@ -0,0 +1,268 @@
+# medicinebot/agents/vector_index.py
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .catalogue import _source_stamp, read_catalogue_csv
+
+VECTOR_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_DIR = "checkpoint"
+
+# Below this many rows an exact scan (one mat-vec) beats any ANN structure.
+IVF_MIN_ROWS = 20000
+IVF_ITERATIONS = 8
+IVF_NPROBE = 8
+
+# Embedded columns and their labels in the document text.
+DOCUMENT_FIELDS = (
+    ("Name", "Name"),
+    ("Type", "Type"),
+    ("Uses", "Uses"),
+    ("Content", "Content"),
+    ("Side Effects", "Side Effects"),
+)
+
+
+def document_texts(df):
+    """
+    One text per catalogue row, built column-wise. Headers are matched with
+    surrounding spaces stripped (the CSV has ``"Type "``) and empty cells
+    are left out instead of being embedded as filler.
+    """
+    headers = {str(col).strip(): col for col in df.columns}
+    texts = None
+    for field, label in DOCUMENT_FIELDS:
+        if field not in headers:
+            continue
+        values = df[headers[field]].fillna("").astype(str).str.strip().str.replace(r"\s+", " ", regex=True)
+        part = (label + ": " + values).where(values != "", "")
+        texts = part if texts is None else texts + "\n" + part
+    if texts is None:
+        return [""] * len(df)
+    return texts.str.replace(r"\n+", "\n", regex=True).str.strip().tolist()
+
+
+def text_digests(texts):
+    """SHA-256 of each document text as an ``(n, 32)`` uint8 array."""
+    digests = np.zeros((len(texts), 32), dtype=np.uint8)
+    for i, text in enumerate(texts):
+        digests[i] = np.frombuffer(hashlib.sha256(text.encode("utf-8")).digest(), dtype=np.uint8)
+    return digests
+
+
+def _read_manifest(directory):
+    path = Path(directory) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _known_vectors(out_dir, embedder_id):
+    """
+    digest -> vector for everything already embedded with this embedder:
+    the last finished index plus the batches checkpointed by a run that
+    didn't finish.
+    """
+    known = {}
+    manifest = _read_manifest(out_dir)
+    if manifest and manifest.get("format") == VECTOR_FORMAT_VERSION and manifest.get("embedder") == embedder_id:
+        vectors = np.load(out_dir / "vectors.npy")
+        digests = np.load(out_dir / "digests.npy")
+        known.update(zip(map(bytes, digests), vectors))
+
+    checkpoint = out_dir / CHECKPOINT_DIR
+    if (checkpoint / "embedder").exists() and (checkpoint / "embedder").read_text() == embedder_id:
+        for part in sorted(checkpoint.glob("part-*.npz")):
+            with np.load(part) as data:
+                known.update(zip(map(bytes, data["digests"]), data["vectors"]))
+    return known
+
+
+def build_vector_index(csv_path, out_dir, embedder, batch_size=64, workers=4, full=False, progress=None):
+    """
+    Embed the catalogue in ``csv_path`` into ``out_dir`` and return the manifest.
+
+    Rows whose document text hasn't changed since the last build reuse their
+    vector, so only new or edited rows are sent to the embedder, in batches
+    on ``workers`` threads. Finished batches are checkpointed as they come
+    in: an interrupted build resumes where it stopped. ``vectors.npy`` rows
+    follow the CSV (= catalogue row ids) and are unit length.
+    """
+    start = time.perf_counter()
+    out_dir = Path(out_dir)
+    df = read_catalogue_csv(csv_path)
+    texts = document_texts(df)
+    digests = text_digests(texts)
+    keys = [bytes(d) for d in digests]
+
+    known = {} if full else _known_vectors(out_dir, embedder.id)
+    todo = sorted({key: i for i, key in reversed(list(enumerate(keys))) if key not in known}.values())
+
+    checkpoint = out_dir / CHECKPOINT_DIR
+    if full or not (checkpoint / "embedder").exists() or (checkpoint / "embedder").read_text() != embedder.id:
+        shutil.rmtree(checkpoint, ignore_errors=True)
+    checkpoint.mkdir(parents=True, exist_ok=True)
+    (checkpoint / "embedder").write_text(embedder.id)
+    first_part = len(list(checkpoint.glob("part-*.npz")))
+
+    embed_start = time.perf_counter()
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(embedder.embed_documents, [texts[i] for i in batch]): n for n, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            n = futures[future]
+            vectors = future.result()
+            batch_keys = digests[batches[n]]
+            np.savez(checkpoint / f"part-{first_part + n:06d}.npz", digests=batch_keys, vectors=vectors)
+            known.update(zip(map(bytes, batch_keys), vectors))
+            done += len(batches[n])
+            if progress:
+                progress(done, len(todo), time.perf_counter() - embed_start)
+    embed_seconds = time.perf_counter() - embed_start
+
+    dim = len(next(iter(known.values()))) if known else 0
+    vectors = np.zeros((len(keys), dim), dtype=np.float32)
+    for i, key in enumerate(keys):
+        vectors[i] = known[key]
+
+    tmp_dir = out_dir.with_name(f"{out_dir.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    np.save(tmp_dir / "vectors.npy", vectors)
+    np.save(tmp_dir / "digests.npy", digests)
+    ivf_lists = 0
+    if len(vectors) >= getattr(settings, "VECTOR_IVF_MIN_ROWS", IVF_MIN_ROWS):
+        centroids, offsets, ids = build_ivf(vectors)
+        np.save(tmp_dir / "ivf.centroids.npy", centroids)
+        np.save(tmp_dir / "ivf.offsets.npy", offsets)
+        np.save(tmp_dir / "ivf.ids.npy", ids)
+        ivf_lists = len(centroids)
+    manifest = {
+        "format": VECTOR_FORMAT_VERSION,
+        "embedder": embedder.id,
+        "dim": dim,
+        "rows": len(keys),
+        "embedded": len(todo),
+        "reused": len(keys) - len(todo),
+        "ivf_lists": ivf_lists,
+        "source": str(csv_path),
+        **_source_stamp(csv_path),
+        "embed_seconds": round(embed_seconds, 3),
+        "total_seconds": round(time.perf_counter() - start, 3),
+    }
+    (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    old_dir = out_dir.with_name(f"{out_dir.name}.old-{os.getpid()}")
+    if out_dir.exists():
+        out_dir.rename(old_dir)
+    tmp_dir.rename(out_dir)
+    # The checkpoint lived in the old directory and is no longer needed.
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return manifest
+
+
+def build_ivf(vectors, n_lists=None, iterations=IVF_ITERATIONS, seed=0):
+    """
+    Inverted-file partition of unit ``vectors``: spherical k-means
+    centroids plus, per centroid, the ids of its rows in CSR form
+    ``(centroids, offsets, ids)``. ~4*sqrt(n) lists keeps both the centroid
+    scan and the probed lists short.
+    """
+    n = len(vectors)
+    n_lists = n_lists or max(1, int(4 * np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    # Fit on a sample; assigning every row is a single pass afterwards.
+    sample = vectors[rng.choice(n, size=min(n, 64 * n_lists), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = (sample @ centroids.T).argmax(axis=1)
+        for c in range(n_lists):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    assign = np.concatenate([
+        (vectors[i:i + 65536] @ centroids.T).argmax(axis=1) for i in range(0, n, 65536)
+    ])
+    ids = np.argsort(assign, kind="stable").astype(np.int32)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+    return centroids.astype(np.float32), offsets, ids
+
+
+class VectorIndex:
+    """
+    A built index, memory-mapped read-only: every worker process maps the
+    same pages instead of holding its own copy.
+
+    ``search`` is an exact scan (one mat-vec over all rows) for small
+    catalogues, and an IVF probe of the ``nprobe`` closest lists when the
+    index was built with one.
+    """
+
+    def __init__(self, directory, nprobe=None):
+        directory = Path(directory)
+        self.manifest = _read_manifest(directory)
+        if not self.manifest or self.manifest.get("format") != VECTOR_FORMAT_VERSION:
+            raise ValueError(f"no usable vector index in {directory}")
+        # Plain ndarray views over the maps: indexing a np.memmap is slow.
+        self.vectors = np.asarray(np.load(directory / "vectors.npy", mmap_mode="r"))
+        self.nprobe = nprobe or getattr(settings, "VECTOR_IVF_NPROBE", IVF_NPROBE)
+        self.ivf = None
+        if self.manifest.get("ivf_lists"):
+            self.ivf = (
+                np.load(directory / "ivf.centroids.npy"),
+                np.asarray(np.load(directory / "ivf.offsets.npy", mmap_mode="r")),
+                np.asarray(np.load(directory / "ivf.ids.npy", mmap_mode="r")),
+            )
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def scores(self, query, rows):
+        """Cosine similarity of ``query`` with the given rows."""
+        return self.vectors[rows] @ query
+
+    def search(self, query, k=10):
+        """``(rows, scores)`` of the ``k`` nearest rows, best first."""
+        if self.ivf is None:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            centroids, offsets, ids = self.ivf
+            probe = np.argpartition(-(centroids @ query), min(self.nprobe, len(centroids)) - 1)[:self.nprobe]
+            rows = np.concatenate([ids[offsets[c]:offsets[c + 1]] for c in probe])
+            scores = self.vectors[rows] @ query
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+
+def load_vector_index(directory, csv_path=None):
+    """
+    The index in ``directory`` if it exists and matches ``csv_path`` as it
+    is on disk now (vector rows follow the CSV rows), else None.
+    """
+    manifest = _read_manifest(directory)
+    if manifest is None:
+        return None
+    if csv_path and os.path.exists(csv_path):
+        stamp = _source_stamp(csv_path)
+        if any(manifest.get(key) != value for key, value in stamp.items()):
+            print(f"Vector index at {directory} is stale, run `manage.py build_index`.")
+            return None
+    return VectorIndex(directory)
@@ -0,0 +1,246 @@
+# medicinebot/benchmarking.py
+"""
+Offline pieces for `manage.py benchmark_pipeline`: synthetic catalogues
+and a stub Ollama server with configurable latency (OCR is stubbed by the
+"stub" OCR backend), so the agents can be timed without the network or a GPU.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+SYLLABLES = (
+    "ab", "al", "am", "ar", "az", "bel", "bro", "ca", "cef", "cil", "co", "cor", "da", "dol", "dox", "en",
+    "fen", "flo", "ga", "gel", "la", "lev", "lin", "lo", "ma", "mox", "na", "neo", "nor", "pan", "pra", "ra",
+    "ren", "ro", "sa", "sol", "ta", "tel", "to", "tri", "va", "vel", "vi", "xa", "zen", "zi", "zo", "zy",
+)
+FORMS = ("Tablet", "Capsule", "Syrup", "Injection", "Cream", "Drops", "Suspension", "Gel")
+STRENGTHS = ("5 mg", "10 mg", "20 mg", "40 mg", "100 mg", "250 mg", "500 mg", "650 mg")
+TYPES = ("Allopathy", "Ayurveda", "Homeopathy")
+INGREDIENTS = (
+    "Paracetamol", "Ibuprofen", "Amoxicillin", "Azithromycin", "Cetirizine", "Pantoprazole", "Metformin",
+    "Atorvastatin", "Amlodipine", "Dextromethorphan", "Ambroxol", "Levocetirizine", "Clavulanic Acid",
+    "Diclofenac", "Ranitidine", "Montelukast",
+)
+USES = (
+    "Fever", "Headache", "Bacterial infections", "Allergies", "Acidity", "Type 2 diabetes", "High cholesterol",
+    "High blood pressure", "Dry cough", "Wet cough", "Muscle pain", "Joint pain",
+)
+SIDE_EFFECTS = ("Nausea", "Vomiting", "Headache", "Dizziness", "Diarrhea", "Drowsiness", "Stomach pain", "Rash")
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def _join_choices(rng, values, n, k):
+    """``n`` strings of ``k`` distinct-ish ``values`` joined with ", "."""
+    picks = rng.integers(0, len(values), size=(n, k))
+    table = np.asarray(values, dtype=object)
+    out = pd.Series(table[picks[:, 0]])
+    for j in range(1, k):
+        out = out + ", " + table[picks[:, j]]
+    return out
+
+
+def _ean13(rng, n):
+    """``n`` valid EAN-13s with the Indian 890 prefix."""
+    digits = np.concatenate([np.tile([8, 9, 0], (n, 1)), rng.integers(0, 10, size=(n, 9))], axis=1)
+    weights = np.tile([1, 3], 6)
+    check = (10 - (digits * weights).sum(axis=1) % 10) % 10
+    digits = np.concatenate([digits, check[:, None]], axis=1)
+    return pd.Series(["".join(map(str, row)) for row in digits])
+
+
+def synthetic_catalogue(rows, seed=0, ean_share=0.4):
+    """
+    A catalogue shaped like MajorProjectDataset.csv (same headers, including
+    the stray ``"Type "``) with ``rows`` made-up medicines. Deterministic for
+    a given seed.
+    """
+    rng = np.random.default_rng(seed)
+    syllables = np.asarray(SYLLABLES, dtype=object)
+    parts = rng.integers(0, len(syllables), size=(rows, 3))
+    brand = pd.Series(syllables[parts[:, 0]]) + syllables[parts[:, 1]]
+    long_brand = rng.random(rows) < 0.5
+    brand = brand.where(~long_brand, brand + syllables[parts[:, 2]]).str.capitalize()
+    strength = pd.Series(np.asarray(STRENGTHS, dtype=object)[rng.integers(0, len(STRENGTHS), rows)])
+    form = pd.Series(np.asarray(FORMS, dtype=object)[rng.integers(0, len(FORMS), rows)])
+    name = (brand + " " + strength + " " + form).where(rng.random(rows) < 0.8, brand + " " + form)
+
+    ean = _ean13(rng, rows).where(rng.random(rows) < ean_share, "")
+    df = pd.DataFrame({
+        "Name": name,
+        "Type ": np.asarray(TYPES, dtype=object)[rng.integers(0, len(TYPES), rows)],
+        "Uses": _join_choices(rng, USES, rows, 2),
+        "Content": _join_choices(rng, INGREDIENTS, rows, 2),
+        "Side Effects": _join_choices(rng, SIDE_EFFECTS, rows, 3),
+        "EAN": ean,
+    })
+    df.index = np.arange(1, rows + 1)
+    return df
+
+
+def write_synthetic_catalogue(path, rows, seed=0):
+    """Write the catalogue CSV to ``path`` unless it is already there; returns the frame."""
+    if path.exists():
+        return pd.read_csv(path, index_col=0, dtype={"EAN": str}, keep_default_na=False)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df = synthetic_catalogue(rows, seed)
+    df.to_csv(path)
+    return df
+
+
+# ----------------------------------------------------------------------
+# Queries
+# ----------------------------------------------------------------------
+
+def _typo(rng, text, edits):
+    chars = list(text)
+    for _ in range(edits):
+        i = int(rng.integers(1, max(2, len(chars) - 1)))
+        op = rng.integers(0, 3)
+        if op == 0 and len(chars) > 3:
+            del chars[i]
+        elif op == 1:
+            chars.insert(i, chars[i - 1])
+        elif i + 1 < len(chars):
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return "".join(chars)
+
+
+def search_queries(df, n, seed=0):
+    """
+    ``{kind: [(query, expected name), ...]}`` for the search benchmark:
+
+    - barcode: EANs of catalogue rows (exact lookup);
+    - exact: catalogue names, as typed (QRatio phase);
+    - typo: one or two character edits (QRatio / TokenSet phases);
+    - rescue: garbled brand, dropped form, OCR noise words (Rescue phase).
+    """
+    rng = np.random.default_rng(seed + 1)
+    with_ean = df.index[df["EAN"].astype(str) != ""]
+    rows = df.loc[rng.choice(df.index, size=n, replace=False)]
+    ean_rows = df.loc[rng.choice(with_ean, size=min(n, len(with_ean)), replace=False)]
+    noise = ("strip", "10 tabs", "mfd by", "rx only", "batch")
+    queries = {
+        "barcode": [(str(r.EAN), r.Name) for r in ean_rows.itertuples()],
+        "exact": [(r.Name, r.Name) for r in rows.itertuples()],
+        "typo": [(_typo(rng, r.Name.lower(), int(rng.integers(1, 3))), r.Name) for r in rows.itertuples()],
+        "rescue": [],
+    }
+    for r in rows.itertuples():
+        brand = r.Name.split()[0]
+        words = [_typo(rng, brand.lower(), 2)] + r.Name.lower().split()[1:-1] + [noise[int(rng.integers(0, len(noise)))]]
+        queries["rescue"].append((" ".join(words), r.Name))
+    return queries
+
+
+def ocr_text(record, with_price=True):
+    """What OCR would read off the box of a catalogue row."""
+    lines = [record["Name"], record["Content"], "MFG. 05/2024", "EXP. 04/2027"]
+    if with_price:
+        lines.append("M.R.P. Rs. 45.50 (incl. of all taxes)")
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------------
+# Stub services
+# ----------------------------------------------------------------------
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    server_version = "StubOllama/1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply_text(self, body):
+        """Answer in the shape the agents expect: JSON for extraction, summary lines otherwise."""
+        prompt = body.get("prompt") or "".join(m.get("content", "") for m in body.get("messages", []))
+        example = re.search(r"Example:\s*(\{.*?\})\s*JSON:", prompt, re.S)
+        if example:
+            fields = json.loads(example.group(1))
+            return json.dumps({field: "Not Found" for field in fields})
+        if not prompt:
+            return ""
+        return (
+            "💊 Type: Tablet used for symptomatic relief.\n"
+            "🌿 Ingredients: The active ingredients listed on the label.\n"
+            "💗 Uses: Relief of the conditions listed in the database.\n"
+            "⚠️ Side Effects: Usually mild; see the database entry."
+        )
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config = self.server.config
+
+        if self.path == "/api/embed":
+            texts = body.get("input") or []
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(config["first_token"])
+            self._send_json({"model": body.get("model"), "embeddings": [[0.0] * 8 for _ in texts]})
+            return
+
+        text = self._reply_text(body)
+        tokens = re.findall(r"\S+\s*|\s+", text)
+        key = "message" if self.path == "/api/chat" else "response"
+        piece = (lambda t: {"role": "assistant", "content": t}) if key == "message" else (lambda t: t)
+        final = {
+            "model": body.get("model"), "done": True, "done_reason": "stop",
+            "prompt_eval_count": len(json.dumps(body)) // 4, "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * config["per_token"] * 1e9) or 1,
+        }
+        time.sleep(config["first_token"])
+
+        if body.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            for token in tokens:
+                self.wfile.write((json.dumps({"model": body.get("model"), key: piece(token), "done": False}) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(config["per_token"])
+            self.wfile.write((json.dumps({**final, key: piece("")}) + "\n").encode())
+            return
+
+        time.sleep(config["per_token"] * len(tokens))
+        self._send_json({**final, key: piece(text)})
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubOllamaServer:
+    """
+    A local HTTP server speaking enough of the Ollama API (/api/chat,
+    /api/generate, /api/embed) for the agents: ``first_token`` seconds
+    before the answer starts, then ``per_token`` seconds per token.
+    """
+
+    def __init__(self, first_token=0.2, per_token=0.005):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _OllamaHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = {"first_token": first_token, "per_token": per_token}
+        self._thread = None
+
+    @property
+    def host(self):
+        return "http://%s:%d" % self.httpd.server_address
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
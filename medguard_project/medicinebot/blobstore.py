@@ -0,0 +1,198 @@
+# medicinebot/blobstore.py
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from PIL import Image
+
+from .agents.image_prep import load_image
+from .models import ImageBlob
+from .tracing import annotate, traced
+
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 75
+
+
+def image_key(sha256):
+    return f"images/{sha256}"
+
+
+def thumbnail_key(sha256):
+    return f"thumbs/{sha256}.webp"
+
+
+class FileSystemBlobStore:
+    """
+    Blobs as files under LOCATION, sharded by the first bytes of the key's
+    hash (``images/ab/cd/abcd...``) so no directory gets huge.
+    """
+
+    def __init__(self, location):
+        self.root = Path(location)
+
+    def _path(self, key):
+        folder, _, name = key.rpartition("/")
+        return self.root / folder / name[:2] / name[2:4] / name
+
+    def exists(self, key):
+        return self._path(key).exists()
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write + rename: readers never see a half-written blob.
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def get(self, key):
+        try:
+            return self._path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        self._path(key).unlink(missing_ok=True)
+
+
+class S3BlobStore:
+    """
+    Blobs in an S3 bucket, or any S3-compatible server (MinIO, LocalStack,
+    ...) through ENDPOINT_URL. Needs the optional `boto3` package.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, prefix="", **client_options):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured("The S3 blob store needs `pip install boto3`.")
+        from botocore.exceptions import ClientError
+
+        self._not_found = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, **client_options)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self._not_found:
+            return False
+
+    def put(self, key, data, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, **extra)
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+        except self._not_found:
+            return None
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """The store configured by ``settings.BLOB_STORE`` (created once)."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = getattr(settings, "BLOB_STORE", {})
+                backend = config.get("BACKEND", "filesystem")
+                if backend == "filesystem":
+                    _store = FileSystemBlobStore(config.get("LOCATION", settings.BASE_DIR / "storage" / "blobs"))
+                elif backend == "s3":
+                    _store = S3BlobStore(
+                        config["BUCKET"],
+                        endpoint_url=config.get("ENDPOINT_URL"),
+                        prefix=config.get("PREFIX", ""),
+                        **config.get("OPTIONS", {}),
+                    )
+                else:
+                    raise ImproperlyConfigured(f"Unknown BLOB_STORE backend: {backend!r}")
+    return _store
+
+
+def make_thumbnail(data, size=None):
+    """Small WebP preview of an image: ``(webp bytes, width, height)`` of the original."""
+    size = size or getattr(settings, "IMAGE_THUMBNAIL_SIZE", THUMBNAIL_SIZE)
+    with Image.open(io.BytesIO(data)) as probe:
+        mode = "RGBA" if "A" in probe.getbands() else "RGB"
+    thumb, (width, height) = load_image(data, size, mode)
+    out = io.BytesIO()
+    thumb.save(out, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    return out.getvalue(), width, height
+
+
+def put_image(data, content_type):
+    """
+    Store an uploaded image and its thumbnail (once per distinct content).
+
+    Returns ``(sha256, width, height, thumbnail_bytes_size)``.
+    """
+    store = get_blob_store()
+    sha256 = hashlib.sha256(data).hexdigest()
+    thumb, width, height = make_thumbnail(data)
+    if not store.exists(image_key(sha256)):
+        store.put(image_key(sha256), data, content_type)
+    if not store.exists(thumbnail_key(sha256)):
+        store.put(thumbnail_key(sha256), thumb, "image/webp")
+    return sha256, width, height, len(thumb)
+
+
+def read_upload(image_file):
+    """``(data, content_type)`` of an uploaded file, which is left rewound."""
+    image_file.seek(0)
+    data = image_file.read()
+    image_file.seek(0)
+    return data, getattr(image_file, "content_type", None) or "application/octet-stream"
+
+
+def store_image(image_file):
+    """Save an uploaded file in the blob store and return its ImageBlob row (deduplicated by SHA-256)."""
+    return store_image_data(*read_upload(image_file))
+
+
+@traced("blob.store")
+def store_image_data(data, content_type):
+    """``store_image`` for bytes already read (safe to run beside agents reading the same upload)."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    annotate(upload_bytes=len(data))
+
+    blob = ImageBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        print(f"Blob Store: Reusing image {sha256[:12]}")
+        return blob
+
+    sha256, width, height, thumb_size = put_image(data, content_type)
+    blob, _ = ImageBlob.objects.get_or_create(
+        sha256=sha256,
+        defaults={
+            "content_type": content_type,
+            "size": len(data),
+            "width": width,
+            "height": height,
+            "thumbnail_size": thumb_size,
+        },
+    )
+    print(f"Blob Store: Stored image {sha256[:12]} ({len(data)} bytes, thumbnail {thumb_size} bytes)")
+    return blob
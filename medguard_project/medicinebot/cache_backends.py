@@ -0,0 +1,109 @@
+# medicinebot/cache_backends.py
+
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """
+    Small on-disk cache backend: one SQLite file, LRU + TTL eviction.
+
+    LOCATION is the database file. Unlike Django's DatabaseCache it needs no
+    `createcachetable` and does not share the app database (and its locks).
+
+        "BACKEND": "medicinebot.cache_backends.SQLiteCache",
+        "LOCATION": BASE_DIR / "storage" / "summary_cache.sqlite3",
+        "OPTIONS": {"MAX_ENTRIES": 50000},
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = str(location)
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # sqlite3 connections can't be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " expires REAL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            self._local.conn = conn
+        return conn
+
+    def _expiry(self, timeout):
+        # BaseCache already turns the timeout into an absolute time (or None).
+        return self.get_backend_timeout(timeout)
+
+    def _cull(self):
+        count = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        now = time.time()
+        self._db.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (now,))
+        excess = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self._max_entries
+        if excess > 0:
+            # Least recently used first, plus 1/CULL_FREQUENCY head-room.
+            excess += self._max_entries // self._cull_frequency if self._cull_frequency else 0
+            self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+    # ---------------------------------------------------------------------
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        row = self._db.execute(
+            "SELECT value, expires FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        if row[1] is not None and row[1] < now:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return default
+        self._db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self._expiry(timeout), time.time()),
+        )
+        self._cull()
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.has_key(key, version=version):
+            return False
+        self.set(key, value, timeout, version=version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursor = self._db.execute(
+            "UPDATE cache SET expires = ? WHERE key = ?", (self._expiry(timeout), key)
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._db.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self):
+        self._db.execute("DELETE FROM cache")
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests on purpose.
+        pass
@@ -10,7 +10,10 @@ class ImageUploadForm(forms.Form):
         widget=forms.TextInput(attrs={
             'class': 'block w-full pl-10 pr-3 py-3 border border-gray-300 rounded-md leading-5 bg-white placeholder-gray-500 focus:outline-none focus:ring-blue-500 focus:border-blue-500 sm:text-sm',
             'placeholder': 'Search for medicine by name...', # Updated placeholder
-            'id': 'search_query' 
+            'id': 'search_query',
+            # Suggestions come from /api/autocomplete/ (see home.html)
+            'list': 'search_suggestions',
+            'autocomplete': 'off',
         })
     )
     
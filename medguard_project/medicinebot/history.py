@@ -0,0 +1,83 @@
+# medicinebot/history.py
+
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+
+from .models import History
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(item):
+    """Opaque position after ``item``: its (timestamp, id) sort key."""
+    raw = f"{item.timestamp.isoformat()}|{item.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.rsplit("|", 1)
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError(timestamp)
+        return timestamp, int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def page_size(value=None):
+    default = getattr(settings, "HISTORY_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+    try:
+        size = int(value) if value else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def history_page(user, cursor=None, limit=None):
+    """
+    One page of a user's history, newest first: ``(items, next_cursor)``.
+
+    Keyset pagination on the (user, -timestamp, -id) index: each page is an
+    index range scan starting after the cursor, so page 500 costs the same
+    as page 1 (no OFFSET). Only the list columns are loaded; the summary
+    HTML and legacy inline images stay in the table until a detail view
+    asks for them.
+    """
+    limit = page_size(limit)
+    items = (
+        History.objects.filter(user=user)
+        .select_related("image")
+        .only("id", "user_id", "timestamp", "search_query", "image__sha256", "image__content_type")
+        .order_by("-timestamp", "-id")
+    )
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        items = items.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+    items = list(items[:limit + 1])
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def history_item_json(item):
+    return {
+        "id": item.pk,
+        "timestamp": item.timestamp.isoformat(),
+        "search_query": item.search_query,
+        "image_url": item.image.url if item.image else None,
+        "thumbnail_url": item.image.thumbnail_url if item.image else None,
+        "detail_url": reverse("history_detail", args=[item.pk]),
+        "detail_json_url": reverse("history_detail_json", args=[item.pk]),
+    }
@@ -0,0 +1,178 @@
+# medicinebot/jobs.py
+
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AnalysisJob
+from .pipeline import AnalysisError, run_analysis_pipeline
+
+# Higher runs first: barcode lookups take milliseconds, OCR + LLM takes seconds.
+DEFAULT_PRIORITY = {
+    AnalysisJob.KIND_BARCODE: 20,
+    AnalysisJob.KIND_TEXT: 10,
+    AnalysisJob.KIND_OCR: 0,
+}
+# A job still "running" after this long lost its worker and is queued again.
+DEFAULT_STALE_AFTER = 600
+MAX_ATTEMPTS = 3
+# run_job's result for a job that was requeued (or given up) while it ran.
+LOST = 'lost'
+
+
+def job_priority(kind):
+    return getattr(settings, "ANALYSIS_JOB_PRIORITY", DEFAULT_PRIORITY).get(kind, 0)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _new_job(user, search_query=None, packaging_image=None, barcode_image=None):
+    if barcode_image:
+        kind, image = AnalysisJob.KIND_BARCODE, barcode_image
+    elif packaging_image:
+        kind, image = AnalysisJob.KIND_OCR, packaging_image
+    else:
+        kind, image = AnalysisJob.KIND_TEXT, None
+
+    job = AnalysisJob(user=user, kind=kind, priority=job_priority(kind), search_query=search_query or '')
+    if image is not None:
+        image.seek(0)
+        job.image_data = image.read()
+        job.image_name = image.name or ''
+        job.image_content_type = image.content_type or ''
+    return job
+
+
+def enqueue_analysis(user, search_query=None, packaging_image=None, barcode_image=None):
+    """Store the request as a queued AnalysisJob; a worker picks it up."""
+    job = _new_job(user, search_query, packaging_image, barcode_image)
+    job.save()
+    print(f"Job Queue: Enqueued {job.kind} job {job.pk} (priority {job.priority})")
+    return job
+
+
+async def aenqueue_analysis(user, search_query=None, packaging_image=None, barcode_image=None):
+    job = _new_job(user, search_query, packaging_image, barcode_image)
+    await job.asave()
+    print(f"Job Queue: Enqueued {job.kind} job {job.pk} (priority {job.priority})")
+    return job
+
+
+async def claim_job(kinds=None, worker=''):
+    """
+    Atomically take the next queued job (highest priority, oldest first).
+
+    The claim is a conditional UPDATE (``WHERE status = 'queued'``), so two
+    workers racing for the same row can't both win, on any database.
+    """
+    queued = AnalysisJob.objects.filter(status=AnalysisJob.STATUS_QUEUED)
+    if kinds:
+        queued = queued.filter(kind__in=kinds)
+    while True:
+        pk = await queued.order_by('-priority', 'created_at').values_list('pk', flat=True).afirst()
+        if pk is None:
+            return None
+        claimed = await AnalysisJob.objects.filter(pk=pk, status=AnalysisJob.STATUS_QUEUED).aupdate(
+            status=AnalysisJob.STATUS_RUNNING,
+            stage='',
+            worker=worker,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return await AnalysisJob.objects.select_related('user').aget(pk=pk)
+
+
+class JobLost(Exception):
+    """The job was taken back from this worker (stale sweep) while it ran."""
+
+
+async def run_job(job):
+    """
+    Run one claimed job through the async pipeline, recording each stage.
+
+    Every write is conditional on the job still being this claim (running,
+    same worker, same attempt). If the stale sweep took it back, the
+    pipeline stops at its next stage, before History is written, and the
+    result is left to whichever worker runs it now.
+    """
+    mine = AnalysisJob.objects.filter(
+        pk=job.pk, status=AnalysisJob.STATUS_RUNNING, worker=job.worker, attempts=job.attempts
+    )
+    image = None
+    if job.image_data is not None:
+        image = SimpleUploadedFile(
+            job.image_name or 'upload', bytes(job.image_data), content_type=job.image_content_type
+        )
+
+    async def on_stage(name):
+        if not await mine.aupdate(stage=name):
+            raise JobLost()
+
+    outcome = {}
+    try:
+        result = await run_analysis_pipeline(
+            job.user,
+            search_query=job.search_query,
+            packaging_image=image if job.kind == AnalysisJob.KIND_OCR else None,
+            barcode_image=image if job.kind == AnalysisJob.KIND_BARCODE else None,
+            on_stage=on_stage,
+        )
+        outcome.update(
+            status=AnalysisJob.STATUS_DONE,
+            analysis_summary=result['analysis_summary'],
+            history=result['history'],
+        )
+    except JobLost:
+        print(f"Job Queue: job {job.pk} was taken back from {job.worker}, dropping its result")
+        return LOST
+    except AnalysisError as e:
+        outcome.update(status=AnalysisJob.STATUS_FAILED, error=str(e))
+    except Exception as e:
+        print(f"Job Queue ERROR: job {job.pk}: {e}")
+        outcome.update(status=AnalysisJob.STATUS_FAILED, error=f"An unexpected error occurred during analysis: {e}")
+
+    # The upload is only needed while the job runs.
+    if not await mine.aupdate(stage='', image_data=None, finished_at=timezone.now(), **outcome):
+        # Taken back between the 'saving' stage and here: the next run saves its own row.
+        if outcome.get('history') is not None:
+            await outcome['history'].adelete()
+        print(f"Job Queue: job {job.pk} was taken back from {job.worker}, dropping its result")
+        return LOST
+    return outcome['status']
+
+
+def _stale_jobs(stale_after):
+    if stale_after is None:
+        stale_after = getattr(settings, "ANALYSIS_JOB_STALE_AFTER", DEFAULT_STALE_AFTER)
+    return AnalysisJob.objects.filter(
+        status=AnalysisJob.STATUS_RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=stale_after),
+    )
+
+
+_GIVE_UP = dict(status=AnalysisJob.STATUS_FAILED, error='The analysis did not finish. Please try again.', image_data=None)
+_REQUEUE = dict(status=AnalysisJob.STATUS_QUEUED, stage='', worker='')
+
+
+def requeue_stale_jobs(stale_after=None):
+    """Put jobs whose worker died back in the queue (or fail them after MAX_ATTEMPTS)."""
+    stale = _stale_jobs(stale_after)
+    failed = stale.filter(attempts__gte=MAX_ATTEMPTS).update(**_GIVE_UP, finished_at=timezone.now())
+    requeued = stale.update(**_REQUEUE)
+    return requeued, failed
+
+
+async def arequeue_stale_jobs(stale_after=None):
+    """Async requeue_stale_jobs, for the worker's periodic sweep."""
+    stale = _stale_jobs(stale_after)
+    failed = await stale.filter(attempts__gte=MAX_ATTEMPTS).aupdate(**_GIVE_UP, finished_at=timezone.now())
+    requeued = await stale.aupdate(**_REQUEUE)
+    return requeued, failed
@@ -0,0 +1,86 @@
+# medicinebot/management/commands/benchmark_barcodes.py
+
+import contextlib
+import io
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from pyzbar.pyzbar import decode
+
+from medicinebot.agents.barcode_agent import run_barcode_agent
+
+
+def legacy_decode(image_file):
+    """The original decoder: one zbar pass over the full-size image."""
+    barcodes = decode(Image.open(image_file))
+    return barcodes[0].data.decode('utf-8') if barcodes else None
+
+
+class Command(BaseCommand):
+    help = 'Compares the single-pass and the tiered barcode decoder on a folder of sample images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples', default=getattr(settings, 'BARCODE_SAMPLES_PATH', None),
+            help='Folder with the images and an expected.json {file: code} (default: BARCODE_SAMPLES_PATH).',
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per image; latencies are over all runs.')
+        parser.add_argument('--verbose', action='store_true', help="Show the decoders' own log lines.")
+
+    def _run(self, decoder, name, data, verbose):
+        upload = SimpleUploadedFile(name, data, content_type='image/jpeg')
+        log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        start = time.perf_counter()
+        with log:
+            try:
+                result = decoder(upload)
+            except Exception as e:
+                result = f'error: {e}'
+        return result, (time.perf_counter() - start) * 1000
+
+    def _summary(self, label, hits, total, latencies):
+        latencies = sorted(latencies)
+        p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+        self.stdout.write(
+            f'{label:8s} {hits}/{total} decoded ({hits / total:.0%}), '
+            f'median {statistics.median(latencies):.0f} ms, p90 {p90:.0f} ms'
+        )
+
+    def handle(self, *args, **options):
+        if not options['samples']:
+            raise CommandError('No sample folder: pass --samples or set BARCODE_SAMPLES_PATH.')
+        folder = Path(options['samples'])
+        try:
+            expected = json.loads((folder / 'expected.json').read_text())
+        except FileNotFoundError:
+            raise CommandError(f'Error: {folder / "expected.json"} was not found.')
+
+        decoders = [('legacy', legacy_decode), ('tiered', run_barcode_agent)]
+        results = {label: {'hits': 0, 'latencies': []} for label, _ in decoders}
+
+        self.stdout.write(f"{'image':28s} {'expected':15s} " + ' '.join(f'{label:>22s}' for label, _ in decoders))
+        for name, code in expected.items():
+            data = (folder / name).read_bytes()
+            cells = []
+            for label, decoder in decoders:
+                for _ in range(options['repeat']):
+                    result, ms = self._run(decoder, name, data, options['verbose'])
+                    results[label]['latencies'].append(ms)
+                # The decoders are deterministic: the last run stands for all.
+                ok = result == code
+                results[label]['hits'] += ok
+                cells.append(f"{'ok' if ok else (result or '-')[:14]:>14s} {ms:5.0f} ms")
+            self.stdout.write(f'{name:28s} {code:15s} ' + ' '.join(cells))
+
+        self.stdout.write('')
+        for label, _ in decoders:
+            self._summary(label, results[label]['hits'], len(expected), results[label]['latencies'])
+        tiered, legacy = results['tiered']['hits'], results['legacy']['hits']
+        style = self.style.SUCCESS if tiered >= legacy else self.style.WARNING
+        self.stdout.write(style(f'Tiered decoder: {tiered - legacy:+d} images vs legacy.'))
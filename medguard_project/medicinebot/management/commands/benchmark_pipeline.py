@@ -0,0 +1,351 @@
+# medicinebot/management/commands/benchmark_pipeline.py
+
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from PIL import Image
+
+from medicinebot import benchmarking
+from medicinebot.agents import extraction_agent, search_agent
+from medicinebot.agents.extraction_agent import run_extraction_agent
+from medicinebot.agents.llm_gateway import llm_gateway
+from medicinebot.agents.ocr_backends import get_ocr_backend
+from medicinebot.agents.summary_agent import summary_agent_instance
+from medicinebot.models import History
+
+# Which search phase answered, from the agent's own log line.
+SEARCH_PHASES = (
+    ("qratio", re.compile(r"QRatio matched")),
+    ("fused", re.compile(r"Fused match")),
+    ("tokenset", re.compile(r"TokenSet matched")),
+    ("rescue", re.compile(r"Weighted Rescue match")),
+)
+
+
+def _rss_mb():
+    """Resident set size now (Linux), else the peak so far."""
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short=12', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or 'unknown'
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+
+def _jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), 'white').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def _history_check(user):
+    """
+    ``check`` for the home page cases: a hit is a POST that saved a new
+    History row with a summary for ``user`` (the page answers 200 either way).
+    """
+    last = {'pk': History.objects.filter(user=user).order_by('-pk').values_list('pk', flat=True).first() or 0}
+
+    def check(item, response):
+        rows = list(History.objects.filter(user=user, pk__gt=last['pk']).values_list('pk', 'analysis_summary'))
+        if rows:
+            last['pk'] = max(pk for pk, _ in rows)
+        return response.status_code == 200 and any(summary for _, summary in rows)
+
+    return check
+
+
+class Command(BaseCommand):
+    help = (
+        'Times the search, extraction and summary agents and the home page POST offline, on synthetic '
+        'catalogues, with stub Ollama / OCR services. Results (p50/p99 latency, memory) go to JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10k,100k,1m', help=f'Catalogue sizes ({", ".join(benchmarking.SCALES)} or a row count).')
+        parser.add_argument('--iterations', type=int, default=50, help='Calls per search / extraction case.')
+        parser.add_argument('--llm-iterations', type=int, default=10, help='Calls per case that waits on the stub LLM.')
+        parser.add_argument('--llm-latency', type=float, default=200, help='Stub Ollama: ms before the first token.')
+        parser.add_argument('--llm-token-latency', type=float, default=5, help='Stub Ollama: ms per output token.')
+        parser.add_argument('--ocr-latency', type=float, default=300, help='Stub OCR: ms per image.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--with-caches', action='store_true', help='Keep the image result cache on (off = every call does the work).')
+        parser.add_argument(
+            '--data-dir', default=str(settings.INDEX_STORAGE_PATH / 'benchmarks'),
+            help='Where the synthetic catalogues (generated once) and the results are kept.',
+        )
+        parser.add_argument('--output', help='Results file (default: <data-dir>/results-<commit>.json).')
+        parser.add_argument('--compare', help='Earlier results file to compare p50/p99/memory against.')
+        parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown reported as a regression (default: 10%%).')
+
+    # ------------------------------------------------------------------
+    def _measure(self, label, scale, fn, inputs, classify=None, check=None):
+        """
+        Time ``fn`` over ``inputs``, then trace its peak allocations over a
+        second pass on the first few (tracing slows every call down, so it
+        is kept out of the timed pass; caches are warm by then).
+        """
+        latencies, phases, hits = [], Counter(), 0
+        for item in inputs:
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                start = time.perf_counter()
+                result = fn(item)
+                latencies.append((time.perf_counter() - start) * 1000)
+            if classify:
+                phases[classify(log.getvalue(), result)] += 1
+            if check:
+                hits += bool(check(item, result))
+
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for item in inputs[:5]:
+                fn(item)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        row = {
+            'scale': scale,
+            'case': label,
+            'n': len(latencies),
+            'p50_ms': round(statistics.median(latencies), 3),
+            'p99_ms': round(_percentile(latencies, 0.99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'max_ms': round(max(latencies), 3),
+            'peak_alloc_kb': round(peak / 1024, 1),
+        }
+        if phases:
+            row['phases'] = dict(phases)
+        if check:
+            row['accuracy'] = round(hits / len(latencies), 3)
+        extra = ''.join(f' {k}={v}' for k, v in (('acc', row.get('accuracy')), ('phases', row.get('phases'))) if v is not None)
+        self.stdout.write(
+            f"{scale:>9,} {label:20s} p50 {row['p50_ms']:9.2f} ms  p99 {row['p99_ms']:9.2f} ms  "
+            f"peak {row['peak_alloc_kb']:9.1f} KB{extra}"
+        )
+        return row
+
+    @staticmethod
+    def _search_phase(log, result):
+        for phase, pattern in SEARCH_PHASES:
+            if pattern.search(log):
+                return phase
+        return 'found' if result is not None else 'none'
+
+    # ------------------------------------------------------------------
+    def _run_scale(self, label, rows, options, user, blob_dir):
+        data_dir = Path(options['data_dir'])
+        csv_path = data_dir / f"catalogue-{label}-seed{options['seed']}.csv"
+        start = time.perf_counter()
+        df = benchmarking.write_synthetic_catalogue(csv_path, rows, options['seed'])
+        generated = time.perf_counter() - start
+
+        overrides = override_settings(
+            MEDICINE_DATA_PATH=csv_path,
+            MEDICINE_CATALOGUE_PATH=None,
+            VECTOR_INDEX_PATH=None,
+            MEDICINE_CATALOGUE_WATCH_INTERVAL=0,
+            IMAGE_CACHE_ENABLED=options['with_caches'],
+            OCR_BACKEND='stub',
+            OCR_STUB_LATENCY=options['ocr_latency'] / 1000,
+            ANALYSIS_JOB_QUEUE=False,
+            BLOB_STORE={'BACKEND': 'filesystem', 'LOCATION': blob_dir},
+        )
+        with overrides:
+            agent = search_agent.SearchAgent()
+            rss_before = _rss_mb()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                catalogue = agent.get_catalogue()
+            if catalogue is None:
+                raise CommandError(f'Could not load the synthetic catalogue {csv_path}.')
+            scale = {
+                'rows': rows,
+                'generate_s': round(generated, 3),
+                'load_s': round(time.perf_counter() - start, 3),
+                'catalogue_rss_mb': round(_rss_mb() - rss_before, 1),
+            }
+            self.stdout.write(
+                f"{rows:>9,} catalogue: loaded in {scale['load_s']:.2f}s, +{scale['catalogue_rss_mb']:.0f} MB RSS"
+            )
+
+            # Every agent (and the views, through run_search_agent) uses this catalogue.
+            with mock.patch.object(search_agent, 'search_agent_instance', agent), \
+                    mock.patch.object(extraction_agent, 'search_agent_instance', agent):
+                results = self._run_cases(df, catalogue, rows, options, user)
+        return scale, results
+
+    def _run_cases(self, df, catalogue, rows, options, user):
+        n, llm_n, seed = options['iterations'], options['llm_iterations'], options['seed']
+        agent = search_agent.search_agent_instance
+        results = []
+
+        queries = benchmarking.search_queries(df, n, seed)
+        found = lambda item, result: result is not None and result['Name'] == item[1]  # noqa: E731
+        results.append(self._measure(
+            'search/barcode', rows, lambda q: agent.search(q[0], is_barcode=True), queries['barcode'], check=found
+        ))
+        for kind in ('exact', 'typo', 'rescue'):
+            results.append(self._measure(
+                f'search/{kind}', rows, lambda q: agent.search(q[0]), queries[kind],
+                classify=self._search_phase, check=found,
+            ))
+
+        records = [catalogue.record(catalogue.name_lookup[name]) for _, name in queries['exact']]
+        results.append(self._measure(
+            'extraction/parsed', rows, run_extraction_agent, [benchmarking.ocr_text(r) for r in records],
+            check=lambda text, result: result['Name'] == text.splitlines()[0],
+        ))
+        results.append(self._measure(
+            'extraction/llm', rows, run_extraction_agent,
+            [benchmarking.ocr_text(r, with_price=False) for r in records[:llm_n]],
+        ))
+
+        # Rows no earlier case has summarized, so the first pass runs the LLM.
+        fresh = benchmarking.search_queries(df, 3 * llm_n, seed + 7)['exact']
+        contexts = [
+            summary_agent_instance._get_context_from_df(catalogue.find_name(name)) for _, name in fresh[:llm_n]
+        ]
+        extracted = {'MFG Date': '05/2024', 'Expiry Date': '04/2027', 'MRP': 'Rs. 45.50', 'Is Expired': False}
+        summarize = lambda ctx: summary_agent_instance._generate_summary(ctx[0], ctx[1], extracted)  # noqa: E731
+        results.append(self._measure('summary/llm', rows, summarize, contexts))
+        results.append(self._measure('summary/cached', rows, summarize, contexts))
+
+        client = Client()
+        client.force_login(user)
+        text_posts = [name.lower() for _, name in fresh[llm_n:2 * llm_n]]
+        results.append(self._measure(
+            'home/text', rows, lambda q: client.post('/', {'search_query': q}), text_posts,
+            check=_history_check(user),
+        ))
+
+        jpeg = _jpeg()
+        ocr = get_ocr_backend()
+
+        def post_image(name):
+            ocr.text = benchmarking.ocr_text(catalogue.find_name(name))
+            upload = SimpleUploadedFile('box.jpg', jpeg, content_type='image/jpeg')
+            return client.post('/', {'packaging_image': upload})
+
+        results.append(self._measure(
+            'home/image', rows, post_image, [name for _, name in fresh[2 * llm_n:]],
+            check=_history_check(user),
+        ))
+        return results
+
+    # ------------------------------------------------------------------
+    def _compare(self, results, baseline, path, threshold):
+        old = {(r['scale'], r['case']): r for r in baseline['results']}
+        self.stdout.write('')
+        self.stdout.write(f"Compared with {baseline['meta'].get('commit', '?')} ({path}):")
+        regressions = 0
+        for row in results:
+            before = old.get((row['scale'], row['case']))
+            if before is None:
+                continue
+            cells, slower = [], False
+            for metric in ('p50_ms', 'p99_ms', 'peak_alloc_kb'):
+                change = (row[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+                slower |= change > threshold
+                cells.append(f'{metric} {before[metric]:.2f} -> {row[metric]:.2f} ({change:+.0%})')
+            line = f"{row['scale']:>9,} {row['case']:20s} " + '  '.join(cells)
+            if slower:
+                regressions += 1
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        style = self.style.WARNING if regressions else self.style.SUCCESS
+        self.stdout.write(style(f'{regressions} cases regressed by more than {threshold:.0%}.'))
+
+    def handle(self, *args, **options):
+        scales = []
+        for label in options['scales'].split(','):
+            label = label.strip().lower()
+            if label in benchmarking.SCALES:
+                scales.append((label, benchmarking.SCALES[label]))
+            elif label.isdigit():
+                scales.append((label, int(label)))
+            else:
+                raise CommandError(f"Error: unknown scale {label!r}.")
+
+        baseline = None
+        if options['compare']:
+            # Read up front: the new results may be written to the same file.
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except FileNotFoundError:
+                raise CommandError(f"Error: {options['compare']} was not found.")
+
+        commit = _git_commit()
+        output = Path(options['output'] or Path(options['data_dir']) / f'results-{commit}.json')
+        server = benchmarking.StubOllamaServer(options['llm_latency'] / 1000, options['llm_token_latency'] / 1000)
+
+        results, catalogues = [], {}
+        with server, tempfile.TemporaryDirectory() as blob_dir:
+            # Read by the Ollama clients when the gateway first creates them.
+            os.environ['OLLAMA_HOST'] = server.host
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                user = User.objects.create_user('benchmark', password=None)
+                for label, rows in scales:
+                    catalogues[rows], scale_results = self._run_scale(label, rows, options, user, blob_dir)
+                    results.extend(scale_results)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        report = {
+            'meta': {
+                'commit': commit,
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'options': {k: options[k] for k in (
+                    'iterations', 'llm_iterations', 'llm_latency', 'llm_token_latency', 'ocr_latency', 'seed', 'with_caches'
+                )},
+                'llm': llm_gateway.stats(),
+            },
+            'catalogues': catalogues,
+            'results': results,
+        }
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f'Results saved to {output}'))
+
+        if baseline is not None:
+            self._compare(results, baseline, options['compare'], options['threshold'])
@@ -1,45 +1,47 @@
 # medicinebot/management/commands/build_index.py
 
-import pandas as pd
-from django.core.management.base import BaseCommand
 from django.conf import settings
-from llama_index.core import Document, VectorStoreIndex
+from django.core.management.base import BaseCommand
+
+from medicinebot.agents.embeddings import EMBEDDERS, get_embedder
+from medicinebot.agents.vector_index import build_vector_index
+
 
 class Command(BaseCommand):
-    help = 'Builds the vector store index from the medicine CSV data.'
+    help = 'Embeds the medicine CSV into the vector index, re-embedding only new or changed rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.MEDICINE_DATA_PATH), help='CSV to embed (default: MEDICINE_DATA_PATH).')
+        parser.add_argument('--output', default=str(settings.VECTOR_INDEX_PATH), help='Target directory (default: VECTOR_INDEX_PATH).')
+        parser.add_argument(
+            '--embedder', choices=list(EMBEDDERS), default=getattr(settings, 'EMBEDDING_BACKEND', 'hashing'),
+            help='Embedding backend (default: EMBEDDING_BACKEND).',
+        )
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'EMBEDDING_BATCH_SIZE', 64), help='Rows per embedding call.')
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'EMBEDDING_WORKERS', 4), help='Embedding calls in flight at once.')
+        parser.add_argument('--full', action='store_true', help='Ignore previous vectors and checkpoints; re-embed every row.')
+
+    def _progress(self, done, total, elapsed):
+        rate = done / elapsed if elapsed else 0.0
+        self.stdout.write(f'  embedded {done}/{total} rows ({rate:.1f} rows/s)')
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting to build the index...'))
-
-        # Load the dataset using the path from settings
+        embedder = get_embedder(options['embedder'])
         try:
-            df = pd.read_csv(settings.MEDICINE_DATA_PATH)
+            manifest = build_vector_index(
+                options['source'], options['output'], embedder,
+                batch_size=options['batch_size'], workers=options['workers'],
+                full=options['full'], progress=self._progress,
+            )
         except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f"Error: The file at {settings.MEDICINE_DATA_PATH} was not found."))
+            self.stdout.write(self.style.ERROR(f"Error: The file at {options['source']} was not found."))
             return
 
-        # Prepare documents for LlamaIndex
-        documents = []
-        for _, row in df.iterrows():
-            # Combine all relevant columns into a single text block for each medicine
-            content = f"""
-            Name: {row.get('Name', 'N/A')}
-            Type: {row.get('Type', 'N/A')}
-            Uses: {row.get('Uses', 'N/A')}
-            Content: {row.get('Content', 'N/A')}
-            SideEffects: {row.get('SideEffects', 'N/A')}
-            Dosage: {row.get('Dosage', 'N/A')}
-            Manufacturer: {row.get('Manufacturer', 'N/A')}
-            Description: {row.get('Description', 'N/A')}
-            """
-            documents.append(Document(text=content))
-
-        self.stdout.write(self.style.SUCCESS(f'Loaded {len(documents)} documents from CSV.'))
-
-        # Create the index from the documents
-        index = VectorStoreIndex.from_documents(documents)
-
-        # Save the index to the disk for later use
-        index.storage_context.persist(persist_dir=settings.INDEX_STORAGE_PATH)
-
-        self.stdout.write(self.style.SUCCESS(f'Index built and saved successfully to {settings.INDEX_STORAGE_PATH}'))
\ No newline at end of file
+        embed_rate = manifest['embedded'] / manifest['embed_seconds'] if manifest['embed_seconds'] else 0.0
+        total_rate = manifest['rows'] / manifest['total_seconds'] if manifest['total_seconds'] else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Index saved to {options['output']} ({manifest['embedder']}, {manifest['dim']} dims): "
+            f"{manifest['rows']} rows, {manifest['embedded']} embedded, {manifest['reused']} reused. "
+            f"{embed_rate:.1f} rows/s embedding, {total_rate:.1f} rows/s overall ({manifest['total_seconds']:.2f}s)."
+        ))
@@ -0,0 +1,30 @@
+# medicinebot/management/commands/compile_catalogue.py
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medicinebot.agents.catalogue import compile_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Compiles the medicine CSV into the memory-mapped catalogue format the search agent loads at runtime.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.MEDICINE_DATA_PATH), help='CSV to compile (default: MEDICINE_DATA_PATH).')
+        parser.add_argument('--output', default=str(settings.MEDICINE_CATALOGUE_PATH), help='Target directory (default: MEDICINE_CATALOGUE_PATH).')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Compiling the catalogue...'))
+        start = time.perf_counter()
+        try:
+            manifest = compile_catalogue(options['source'], options['output'])
+        except FileNotFoundError:
+            self.stdout.write(self.style.ERROR(f"Error: The file at {options['source']} was not found."))
+            return
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled {manifest['rows']} medicines to {options['output']} in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,58 @@
+# medicinebot/management/commands/ocr_batch.py
+
+import json
+import time
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from medicinebot.agents.ocr_agent import run_batch_ocr_agent
+from medicinebot.agents.ocr_backends import BACKENDS
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+
+
+class Command(BaseCommand):
+    help = 'Reads the text on a batch of package photos (bulk imports) and writes one JSON line per image.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Image files and/or folders of images.')
+        parser.add_argument(
+            '--backend',
+            help=f"OCR backend: {', '.join(BACKENDS)} or a dotted class path (default: OCR_BACKEND).",
+        )
+        parser.add_argument('--output', help='Write results to this file instead of stdout.')
+
+    def _collect(self, paths):
+        files = []
+        for raw in paths:
+            path = Path(raw)
+            if path.is_dir():
+                files += sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+            elif path.is_file():
+                files.append(path)
+            else:
+                raise CommandError(f"Error: The file at {raw} was not found.")
+        return files
+
+    def handle(self, *args, **options):
+        files = self._collect(options['paths'])
+        uploads = [SimpleUploadedFile(f.name, f.read_bytes()) for f in files]
+
+        start = time.perf_counter()
+        texts = run_batch_ocr_agent(uploads, backend=options['backend'])
+        elapsed = time.perf_counter() - start
+
+        payload = ''.join(
+            json.dumps({'file': str(f), 'text': text}, ensure_ascii=False) + '\n'
+            for f, text in zip(files, texts)
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(payload)
+        else:
+            self.stdout.write(payload, ending='')
+        self.stderr.write(self.style.SUCCESS(
+            f'Read text from {sum(1 for t in texts if t)}/{len(files)} images in {elapsed:.2f}s.'
+        ))
@@ -0,0 +1,88 @@
+# medicinebot/management/commands/pregenerate_summaries.py
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from medicinebot.agents.llm_gateway import llm_gateway
+from medicinebot.agents.search_agent import search_agent_instance
+from medicinebot.agents.summary_agent import (
+    ROW_PROMPT_VERSION,
+    SUMMARY_MODEL,
+    row_summary_key,
+    summary_agent_instance,
+)
+from medicinebot.models import MedicineSummary
+
+
+class Command(BaseCommand):
+    help = 'Pre-generates the row-dependent part of every medicine summary with the local Ollama model (resumable).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            help='Concurrent Ollama requests (default and maximum: the LLM_CONCURRENCY of the summary model).',
+        )
+        parser.add_argument('--batch-size', type=int, default=32, help='Rows generated and saved per batch (default: 32).')
+        parser.add_argument('--limit', type=int, help='Stop after this many new summaries.')
+
+    def _pending(self, catalogue):
+        """(key, context, name) for every catalogue row without a stored summary."""
+        done = set(MedicineSummary.objects.values_list('context_hash', flat=True))
+        for row_id in catalogue.live_rows():
+            db_context, name = summary_agent_instance._get_context_from_df(catalogue.record(row_id))
+            key = row_summary_key(db_context)
+            if key not in done:
+                done.add(key)  # duplicate rows share one summary
+                yield key, db_context, name
+
+    def _generate(self, job):
+        key, db_context, name = job
+        try:
+            return key, name, summary_agent_instance.generate_row_summary(db_context, name), None
+        except Exception as e:
+            return key, name, None, e
+
+    def handle(self, *args, **options):
+        catalogue = search_agent_instance.get_catalogue()
+        if catalogue is None:
+            raise CommandError('The medicine catalogue could not be loaded.')
+
+        pending = list(self._pending(catalogue))
+        if options['limit']:
+            pending = pending[:options['limit']]
+        self.stdout.write(self.style.SUCCESS(f'{len(pending)} summaries to generate.'))
+
+        # More workers than the gateway has slots would only queue inside it,
+        # and a call that waits longer than LLM_QUEUE_TIMEOUT fails.
+        slots = llm_gateway.concurrency(SUMMARY_MODEL)
+        workers = max(1, min(options['workers'] or slots, slots))
+        if options['workers'] and options['workers'] > slots:
+            self.stdout.write(self.style.WARNING(
+                f'--workers {options["workers"]} capped at {slots}, the gateway limit for {SUMMARY_MODEL}.'
+            ))
+
+        saved = failed = 0
+        start = time.perf_counter()
+        batch_size = max(1, options['batch_size'])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for offset in range(0, len(pending), batch_size):
+                results = list(pool.map(self._generate, pending[offset:offset + batch_size]))
+                rows = []
+                for key, name, body_md, error in results:
+                    if error is not None:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f'Error: {name}: {error}'))
+                        continue
+                    rows.append(MedicineSummary(
+                        context_hash=key, name=str(name)[:255], model=SUMMARY_MODEL,
+                        prompt_version=ROW_PROMPT_VERSION, body_md=body_md,
+                    ))
+                # Saved per batch: an interrupted run resumes from here.
+                MedicineSummary.objects.bulk_create(rows, ignore_conflicts=True)
+                saved += len(rows)
+                rate = saved / max(time.perf_counter() - start, 1e-9)
+                self.stdout.write(f'{saved + failed}/{len(pending)} done ({rate:.2f} summaries/s)')
+
+        self.stdout.write(self.style.SUCCESS(f'Saved {saved} summaries, {failed} failed.'))
@@ -0,0 +1,44 @@
+# medicinebot/management/commands/reload_catalogue.py
+
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from medicinebot.agents.catalogue import compile_catalogue
+from medicinebot.agents.search_agent import RELOAD_SIGNAL
+
+
+class Command(BaseCommand):
+    help = 'Makes running workers pick up an updated medicine catalogue without a restart.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compile', action='store_true', help='Recompile the catalogue from MEDICINE_DATA_PATH first.')
+        parser.add_argument('--pid', type=int, action='append', default=[], help='Worker PID to signal (repeatable).')
+
+    def handle(self, *args, **options):
+        if options['compile']:
+            start = time.perf_counter()
+            manifest = compile_catalogue(settings.MEDICINE_DATA_PATH, settings.MEDICINE_CATALOGUE_PATH)
+            self.stdout.write(self.style.SUCCESS(
+                f"Compiled {manifest['rows']} medicines in {time.perf_counter() - start:.2f}s"
+            ))
+
+        if not options['pid']:
+            interval = getattr(settings, 'MEDICINE_CATALOGUE_WATCH_INTERVAL', 0)
+            if interval:
+                self.stdout.write(f'No --pid given: workers will notice the change within {interval}s.')
+            else:
+                self.stdout.write(self.style.WARNING('No --pid given and MEDICINE_CATALOGUE_WATCH_INTERVAL is off: nothing was reloaded.'))
+            return
+
+        if RELOAD_SIGNAL is None:
+            raise CommandError('Signal-based reload is not supported on this platform.')
+
+        for pid in options['pid']:
+            try:
+                os.kill(pid, RELOAD_SIGNAL)
+                self.stdout.write(self.style.SUCCESS(f'Sent reload signal to worker {pid}.'))
+            except ProcessLookupError:
+                self.stdout.write(self.style.ERROR(f'Error: No process with PID {pid}.'))
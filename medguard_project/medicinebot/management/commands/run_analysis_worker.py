@@ -0,0 +1,87 @@
+# medicinebot/management/commands/run_analysis_worker.py
+
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from medicinebot.agents.llm_gateway import llm_gateway
+from medicinebot.jobs import arequeue_stale_jobs, claim_job, requeue_stale_jobs, run_job, worker_name
+from medicinebot.models import AnalysisJob
+
+
+class Command(BaseCommand):
+    help = 'Runs queued home-page analyses (AnalysisJob) with a pool of async workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'ANALYSIS_WORKER_CONCURRENCY', 4),
+            help='Jobs of any kind run at once, highest priority first (default: ANALYSIS_WORKER_CONCURRENCY).',
+        )
+        parser.add_argument(
+            '--barcode-concurrency', type=int, default=getattr(settings, 'ANALYSIS_WORKER_BARCODE_CONCURRENCY', 1),
+            help='Extra workers that only take barcode jobs, so they never wait behind OCR jobs.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue checks when idle.')
+        parser.add_argument(
+            '--requeue-interval', type=float, default=getattr(settings, 'ANALYSIS_WORKER_REQUEUE_INTERVAL', 60),
+            help='Seconds between sweeps for stale jobs whose worker died (default: ANALYSIS_WORKER_REQUEUE_INTERVAL).',
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    async def _lane(self, name, kinds, options, counts):
+        worker = f"{worker_name()}/{name}"
+        while True:
+            job = await claim_job(kinds, worker)
+            if job is None:
+                if options['burst']:
+                    return
+                await asyncio.sleep(options['poll_interval'])
+                continue
+            status = await run_job(job)
+            counts[status] = counts.get(status, 0) + 1
+            self.stdout.write(f'[{name}] {job.kind} job {job.pk}: {status}')
+
+    def _report_requeued(self, requeued, failed):
+        if requeued or failed:
+            self.stdout.write(self.style.WARNING(f'Re-queued {requeued} stale jobs, gave up on {failed}.'))
+
+    async def _sweep(self, options):
+        # Another worker can die while this one keeps running; its jobs go
+        # back in the queue once they are older than ANALYSIS_JOB_STALE_AFTER.
+        while True:
+            await asyncio.sleep(options['requeue_interval'])
+            try:
+                self._report_requeued(*await arequeue_stale_jobs())
+            except Exception as e:
+                self.stderr.write(f'Stale job sweep failed: {e}')
+
+    async def _serve(self, options, counts):
+        lanes = [self._lane(f'any-{i}', None, options, counts) for i in range(options['concurrency'])]
+        lanes += [
+            self._lane(f'barcode-{i}', [AnalysisJob.KIND_BARCODE], options, counts)
+            for i in range(options['barcode_concurrency'])
+        ]
+        sweep = asyncio.create_task(self._sweep(options))
+        try:
+            await asyncio.gather(*lanes)
+        finally:
+            sweep.cancel()
+
+    def handle(self, *args, **options):
+        self._report_requeued(*requeue_stale_jobs())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Analysis worker {worker_name()}: {options['concurrency']} general + "
+            f"{options['barcode_concurrency']} barcode lanes."
+        ))
+        llm_gateway.warm_up_in_background()
+        counts = {}
+        try:
+            asyncio.run(self._serve(options, counts))
+        except KeyboardInterrupt:
+            # Jobs interrupted mid-run are picked up again by requeue_stale_jobs.
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished {counts.get(AnalysisJob.STATUS_DONE, 0)} jobs, {counts.get(AnalysisJob.STATUS_FAILED, 0)} failed."
+        ))
@@ -0,0 +1,51 @@
+# medicinebot/management/commands/search_batch.py
+
+import sys
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from medicinebot.agents.search_agent import run_batch_search_agent
+
+
+class Command(BaseCommand):
+    help = 'Fuzzy-matches a whole list of medicine names (invoice, shelf audit) against the catalogue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help="Text file with one name per line, a CSV file (see --column), or '-' for stdin.")
+        parser.add_argument('--column', help='Column holding the names when the input is a CSV file.')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help='Output format (default: jsonl).')
+        parser.add_argument('--output', help='Write results to this file instead of stdout.')
+
+    def _read_queries(self, path, column):
+        source = sys.stdin if path == '-' else path
+        try:
+            if column:
+                return pd.read_csv(source)[column].fillna('').astype(str).tolist()
+            if path == '-':
+                return [line.strip() for line in sys.stdin]
+            with open(path, encoding='utf-8') as fh:
+                return [line.strip() for line in fh]
+        except FileNotFoundError:
+            raise CommandError(f"Error: The file at {path} was not found.")
+        except KeyError:
+            raise CommandError(f"Error: Column '{column}' not found in {path}.")
+
+    def handle(self, *args, **options):
+        queries = self._read_queries(options['input'], options['column'])
+        results = run_batch_search_agent(queries)
+
+        if options['format'] == 'csv':
+            payload = results.to_csv(index=False)
+        else:
+            payload = results.to_json(orient='records', lines=True, force_ascii=False)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(payload)
+            matched = int(results['phase'].notna().sum())
+            self.stderr.write(self.style.SUCCESS(
+                f'Matched {matched}/{len(results)} names. Results saved to {options["output"]}'
+            ))
+        else:
+            self.stdout.write(payload, ending='')
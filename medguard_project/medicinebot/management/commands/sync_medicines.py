@@ -0,0 +1,99 @@
+# medicinebot/management/commands/sync_medicines.py
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from medicinebot.agents.catalogue import read_catalogue_csv
+from medicinebot.agents.db_catalogue import COLUMN_FIELDS, FTS_TABLE, fts_available
+from medicinebot.agents.ean import ean_lookup_keys, split_eans
+from medicinebot.models import Medicine, MedicineBarcode
+
+FIELDS = list(COLUMN_FIELDS.values())
+
+
+def _cell(value):
+    # pandas gives NaN for empty cells, and "nan" in the EAN column (read as str).
+    if value is None or value != value or str(value).strip() in ("", "nan"):
+        return ""
+    return str(value)
+
+
+def _barcodes(medicine):
+    return [
+        MedicineBarcode(medicine=medicine, code=key)
+        for code in split_eans(medicine.ean)
+        for key in ean_lookup_keys(code)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Syncs the medicine CSV into the Medicine table (and its FTS5 name index) for SEARCH_BACKEND = "database".'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.MEDICINE_DATA_PATH), help='CSV to load (default: MEDICINE_DATA_PATH).')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows compared and written per batch.')
+        parser.add_argument('--rebuild-index', action='store_true', help='Rebuild the FTS5 index from the table afterwards.')
+
+    def handle(self, *args, **options):
+        try:
+            df = read_catalogue_csv(options['source'])
+        except FileNotFoundError:
+            raise CommandError(f"Error: The file at {options['source']} was not found.")
+
+        start = time.perf_counter()
+        columns = list(COLUMN_FIELDS)
+        values = [df[col].tolist() if col in df else [""] * len(df) for col in columns]
+        rows = [[_cell(v) for v in row] for row in zip(*values)]
+        batch_size = max(1, options['batch_size'])
+        added = updated = 0
+
+        with transaction.atomic():
+            for offset in range(0, len(rows), batch_size):
+                existing = {m.row: m for m in Medicine.objects.filter(row__gte=offset, row__lt=offset + batch_size)}
+                new, changed, recoded = [], [], []
+                for row_id in range(offset, min(offset + batch_size, len(rows))):
+                    fields = dict(zip(FIELDS, rows[row_id]))
+                    medicine = existing.get(row_id)
+                    if medicine is None:
+                        new.append(Medicine(row=row_id, **fields))
+                    elif any(getattr(medicine, f) != v for f, v in fields.items()):
+                        if medicine.ean != fields['ean']:
+                            recoded.append(medicine.pk)
+                        for f, v in fields.items():
+                            setattr(medicine, f, v)
+                        changed.append(medicine)
+
+                # Triggers keep the FTS5 index in step with these writes.
+                created = Medicine.objects.bulk_create(new)
+                Medicine.objects.bulk_update(changed, FIELDS)
+                MedicineBarcode.objects.filter(medicine_id__in=recoded).delete()
+                recoded = set(recoded)
+                MedicineBarcode.objects.bulk_create([
+                    barcode
+                    for medicine in created + [m for m in changed if m.pk in recoded]
+                    for barcode in _barcodes(medicine)
+                ])
+                added += len(created)
+                updated += len(changed)
+
+            _, deleted = Medicine.objects.filter(row__gte=len(rows)).delete()
+            removed = deleted.get('medicinebot.Medicine', 0)
+
+        if options['rebuild_index']:
+            if not fts_available():
+                raise CommandError('No FTS5 name index in this database (SQLite only; run `manage.py migrate`).')
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Synced {len(rows)} medicines in {elapsed:.2f}s: {added} added, {updated} updated, {removed} removed."
+        ))
+        if added or removed:
+            self.stdout.write(
+                'Running workers recount the table on their next catalogue reload '
+                '(`manage.py reload_catalogue --pid ...`).'
+            )
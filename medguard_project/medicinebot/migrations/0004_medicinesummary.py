@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicinebot', '0003_rename_original_query_text_history_search_query_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('context_hash', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('model', models.CharField(max_length=64)),
+                ('prompt_version', models.PositiveIntegerField()),
+                ('body_md', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,135 @@
+# Moves the inline base64 History.image_data_url images into the blob store.
+
+import base64
+import binascii
+import hashlib
+import io
+
+from django.db import migrations
+from PIL import Image, ImageOps
+
+BATCH_SIZE = 50
+# Frozen copies of the medicinebot.blobstore helpers as of this migration:
+# later changes to the key layout or the thumbnails mustn't change what it
+# writes. Only the store itself (settings.BLOB_STORE) is the live one.
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 75
+
+
+def image_key(sha256):
+    return f"images/{sha256}"
+
+
+def thumbnail_key(sha256):
+    return f"thumbs/{sha256}.webp"
+
+
+def make_thumbnail(data):
+    """Small WebP preview of an image: ``(webp bytes, width, height)`` of the original."""
+    img = Image.open(io.BytesIO(data))
+    width, height = img.size
+    mode = "RGBA" if "A" in img.getbands() else "RGB"
+    img = ImageOps.exif_transpose(img)
+    if img.mode != mode:
+        img = img.convert(mode)
+    img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    out = io.BytesIO()
+    img.save(out, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    return out.getvalue(), width, height
+
+
+def put_image(store, data, content_type):
+    """Store an image and its thumbnail: ``(sha256, width, height, thumbnail_bytes_size)``."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    thumb, width, height = make_thumbnail(data)
+    if not store.exists(image_key(sha256)):
+        store.put(image_key(sha256), data, content_type)
+    if not store.exists(thumbnail_key(sha256)):
+        store.put(thumbnail_key(sha256), thumb, "image/webp")
+    return sha256, width, height, len(thumb)
+
+
+def parse_data_url(data_url):
+    """'data:image/png;base64,....' -> (content type, bytes), or None."""
+    header, sep, payload = data_url.partition(",")
+    if not sep or not header.startswith("data:") or not header.endswith(";base64"):
+        return None
+    try:
+        return header[5:-7] or "application/octet-stream", base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def move_images_to_blobs(apps, schema_editor):
+    from medicinebot.blobstore import get_blob_store
+
+    History = apps.get_model("medicinebot", "History")
+    ImageBlob = apps.get_model("medicinebot", "ImageBlob")
+    store = get_blob_store()
+
+    pending = (
+        History.objects.filter(image_data_url__startswith="data:")
+        .only("pk", "image_data_url")
+        .order_by("pk")
+    )
+    moved = skipped = cleared = last_pk = 0
+    while True:
+        # Batches by primary key: only a few decoded images in memory at once.
+        batch = list(pending.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        for item in batch:
+            parsed = parse_data_url(item.image_data_url)
+            if parsed is None:
+                History.objects.filter(pk=item.pk).update(image_data_url=None)
+                cleared += 1
+                continue
+            content_type, data = parsed
+            sha256 = hashlib.sha256(data).hexdigest()
+            blob = ImageBlob.objects.filter(sha256=sha256).first()
+            if blob is None:
+                try:
+                    _, width, height, thumb_size = put_image(store, data, content_type)
+                except Exception as e:
+                    # Not a decodable image: leave this row inline and go on.
+                    print(f"\n  History {item.pk}: no thumbnail ({e})")
+                    skipped += 1
+                    continue
+                blob = ImageBlob.objects.create(
+                    sha256=sha256, content_type=content_type, size=len(data),
+                    width=width, height=height, thumbnail_size=thumb_size,
+                )
+            History.objects.filter(pk=item.pk).update(image=blob, image_data_url=None)
+            moved += 1
+    if skipped:
+        print(f"\n  Skipped {skipped} History images that could not be decoded; they stay inline in image_data_url.")
+    if cleared:
+        print(f"\n  Cleared {cleared} History rows whose image_data_url was not a base64 data URL.")
+    if moved:
+        print(f"\n  Moved {moved} History images into the blob store.")
+        if schema_editor.connection.vendor == "sqlite":
+            print("  Run `VACUUM` on the database to give the freed space back to the filesystem.")
+
+
+def inline_images_again(apps, schema_editor):
+    from medicinebot.blobstore import get_blob_store
+
+    History = apps.get_model("medicinebot", "History")
+    store = get_blob_store()
+    for item in History.objects.filter(image__isnull=False).select_related("image").iterator(chunk_size=BATCH_SIZE):
+        data = store.get(image_key(item.image.sha256))
+        if data is not None:
+            item.image_data_url = f"data:{item.image.content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+            item.save(update_fields=["image_data_url"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("medicinebot", "0006_imageblob"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_images_to_blobs, inline_images_again),
+    ]
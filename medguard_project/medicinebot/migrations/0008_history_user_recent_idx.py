@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicinebot', '0007_move_history_images_to_blobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='history_user_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,116 @@
+# Gives Medicine the full catalogue columns, adds MedicineBarcode and an
+# FTS5 trigram index over the names (SQLite only; kept current by triggers).
+# A later migration that makes SQLite rebuild medicinebot_medicine (most
+# AlterFields do) drops the triggers with it: run create_fts again there.
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_SQL = [
+    """CREATE VIRTUAL TABLE medicinebot_medicine_fts USING fts5(
+        name, content='medicinebot_medicine', content_rowid='id', tokenize='trigram'
+    )""",
+    # Document frequency of each trigram, to leave out the very common ones.
+    "CREATE VIRTUAL TABLE medicinebot_medicine_fts_vocab USING fts5vocab(medicinebot_medicine_fts, 'row')",
+    """CREATE TRIGGER medicinebot_medicine_fts_ai AFTER INSERT ON medicinebot_medicine BEGIN
+        INSERT INTO medicinebot_medicine_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER medicinebot_medicine_fts_ad AFTER DELETE ON medicinebot_medicine BEGIN
+        INSERT INTO medicinebot_medicine_fts(medicinebot_medicine_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER medicinebot_medicine_fts_au AFTER UPDATE OF name ON medicinebot_medicine BEGIN
+        INSERT INTO medicinebot_medicine_fts(medicinebot_medicine_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO medicinebot_medicine_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO medicinebot_medicine_fts(medicinebot_medicine_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    "DROP TRIGGER IF EXISTS medicinebot_medicine_fts_au",
+    "DROP TRIGGER IF EXISTS medicinebot_medicine_fts_ad",
+    "DROP TRIGGER IF EXISTS medicinebot_medicine_fts_ai",
+    "DROP TABLE IF EXISTS medicinebot_medicine_fts_vocab",
+    "DROP TABLE IF EXISTS medicinebot_medicine_fts",
+]
+
+
+def clear_medicines(apps, schema_editor):
+    # The table was never filled by the app; `sync_medicines` rebuilds it
+    # from the CSV, with the row numbers the new column needs.
+    apps.get_model("medicinebot", "Medicine").objects.all().delete()
+
+
+def create_fts(apps, schema_editor):
+    # Not SQLite: no FTS5 index; load_database_catalogue says so if
+    # SEARCH_BACKEND = "database" is tried.
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in FTS_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    for sql in DROP_FTS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('medicinebot', '0008_history_user_recent_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_medicines, migrations.RunPython.noop),
+        migrations.AlterModelOptions(
+            name='medicine',
+            options={'ordering': ['row']},
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='row',
+            field=models.PositiveIntegerField(default=0, unique=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='medicine_type',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='side_effects',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='medicine',
+            name='ean',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='medicine',
+            name='name',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='medicine',
+            name='content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='medicine',
+            name='used_for',
+            field=models.TextField(blank=True),
+        ),
+        migrations.CreateModel(
+            name='MedicineBarcode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(db_index=True, max_length=14)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='barcodes', to='medicinebot.medicine')),
+            ],
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
@@ -1,15 +1,75 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.urls import reverse
 
-# Model for your medicine dataset (if you are populating it from the CSV)
+# The medicine catalogue in the database, kept in step with the CSV by
+# `manage.py sync_medicines`. With SEARCH_BACKEND = "database" the search
+# agent shortlists names through an FTS5 trigram index over `name`
+# (medicinebot_medicine_fts, maintained by triggers) instead of loading
+# the catalogue into every worker.
 class Medicine(models.Model):
-    name = models.CharField(max_length=200, unique=True)
-    content = models.TextField()
-    used_for = models.TextField()
+    # Position in the CSV (0-based): ties between equal scores resolve in
+    # catalogue order, like the in-memory search.
+    row = models.PositiveIntegerField(unique=True)
+    name = models.CharField(max_length=255, db_index=True)
+    medicine_type = models.CharField(max_length=100, blank=True)
+    used_for = models.TextField(blank=True)
+    content = models.TextField(blank=True)
+    side_effects = models.TextField(blank=True)
+    # The CSV cell as is (may hold several codes); lookups go through MedicineBarcode.
+    ean = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['row']
 
     def __str__(self):
         return self.name
 
+# Every normalized lookup key (14-digit GTIN) of a medicine's barcodes, see agents/ean.py.
+class MedicineBarcode(models.Model):
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='barcodes')
+    code = models.CharField(max_length=14, db_index=True)
+
+    def __str__(self):
+        return f"{self.code} -> {self.medicine}"
+
+# Pre-generated, row-dependent part of a medicine summary (Type, Ingredients,
+# Uses, Side Effects). Filled by `manage.py pregenerate_summaries`, or lazily
+# the first time a medicine is summarized.
+class MedicineSummary(models.Model):
+    # SHA-256 of (model, row prompt version, database context)
+    context_hash = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    model = models.CharField(max_length=64)
+    prompt_version = models.PositiveIntegerField()
+    body_md = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Summary for {self.name} ({self.model} v{self.prompt_version})"
+
+# An uploaded image, stored once in the blob store (see medicinebot/blobstore.py)
+# no matter how many History rows point at it.
+class ImageBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveIntegerField()
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail_size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def url(self):
+        return reverse('image_blob', args=[self.sha256])
+
+    @property
+    def thumbnail_url(self):
+        return reverse('image_thumbnail', args=[self.sha256])
+
+    def __str__(self):
+        return f"Image {self.sha256[:12]} ({self.size} bytes)"
+
 # Model for storing user search history
 class History(models.Model):
     # Link each history item to a specific user
@@ -21,12 +81,77 @@ class History(models.Model):
     # Store the final summary from the bot
     analysis_summary = models.TextField(blank=True, null=True)
     
-    # Store the base64-encoded image URL (can be blank if it was a text search)
+    # The analysed image (blank for text searches)
+    image = models.ForeignKey(ImageBlob, null=True, blank=True, on_delete=models.SET_NULL, related_name='history')
+
+    # Legacy inline base64 image; moved into the blob store by migration 0007
     image_data_url = models.TextField(blank=True, null=True)
     
     # Automatically add the date and time when the item is created
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's history, newest first (medicinebot/history.py)
+            models.Index(fields=['user', '-timestamp', '-id'], name='history_user_recent_idx'),
+        ]
+
     def __str__(self):
         # This is what you'll see in the Django admin area
-        return f"History for {self.user.username} at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
\ No newline at end of file
+        return f"History for {self.user.username} at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+# Queued home-page analysis, run by `manage.py run_analysis_worker`.
+class AnalysisJob(models.Model):
+    KIND_BARCODE = 'barcode'
+    KIND_OCR = 'ocr'
+    KIND_TEXT = 'text'
+    KIND_CHOICES = [
+        (KIND_BARCODE, 'Barcode image'),
+        (KIND_OCR, 'Packaging image'),
+        (KIND_TEXT, 'Text search'),
+    ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    # Higher runs first (see ANALYSIS_JOB_PRIORITY)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    # Pipeline stage currently running ('barcode', 'ocr', 'extraction', 'search', 'summary', 'saving')
+    stage = models.CharField(max_length=32, blank=True, default='')
+
+    # Inputs: the text query, or the uploaded image (dropped once the job is finished)
+    search_query = models.TextField(blank=True, default='')
+    image_data = models.BinaryField(null=True, blank=True)
+    image_name = models.CharField(max_length=255, blank=True, default='')
+    image_content_type = models.CharField(max_length=100, blank=True, default='')
+
+    # Outputs
+    analysis_summary = models.TextField(blank=True, null=True)
+    history = models.ForeignKey(History, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True, default='')
+
+    worker = models.CharField(max_length=64, blank=True, default='')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Claim order: queued jobs of a kind, highest priority, oldest first
+            models.Index(fields=['status', 'kind', '-priority', 'created_at'], name='analysisjob_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.pk} for {self.user.username} ({self.status})"
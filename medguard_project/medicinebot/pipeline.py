@@ -0,0 +1,126 @@
+# medicinebot/pipeline.py
+
+import asyncio
+
+from .agents.barcode_agent import run_barcode_agent
+from .agents.ocr_agent import arun_ocr_agent
+from .agents.search_agent import run_search_agent
+from .agents.summary_agent import arun_summary_agent, astart_summary
+from .models import History
+from .scheduler import aextract_and_search, astart_image_store
+from .tracing import span
+
+
+class AnalysisError(Exception):
+    """A stage failed in a way the user should be told about (bad picture, ...)."""
+
+
+async def run_analysis_pipeline(user, search_query=None, packaging_image=None, barcode_image=None, on_stage=None,
+                              stream_summary=False):
+    """
+    Async version of the home_view analysis: barcode/OCR -> extraction ->
+    search -> summary -> History.
+
+    Network stages (Vision, Ollama, the database) are awaited, CPU-bound
+    ones (barcode decoding, catalogue search) run in worker threads, so a
+    single ASGI process can keep many analyses in flight. The image is
+    stored while the later stages run, and an OCR'd package is searched
+    along with its extraction (see scheduler.py).
+
+    ``on_stage(name)`` is awaited as each stage starts (job progress).
+
+    With ``stream_summary``, a summary that needs the LLM is not waited
+    for: the History row is saved with an empty summary and
+    ``summary_stream`` holds the arguments for
+    ``summary_agent_instance.astream_summary`` (plus the History id). The
+    caller starts it right away (``views.start_summary``), which fills in
+    the row, and sends the page with the summary streamed into it.
+
+    Returns ``{'analysis_summary', 'image_url', 'saved', 'history', 'summary_stream'}``.
+    """
+    image_store = None
+    search_results = None
+    searched = False
+    is_barcode_search = False
+
+    async def stage(name):
+        if on_stage is not None:
+            await on_stage(name)
+
+    if barcode_image:
+        # --- PATH A: BARCODE IMAGE UPLOADED (Exact Match) ---
+        is_barcode_search = True
+
+        await stage('barcode')
+        barcode_data = await asyncio.to_thread(run_barcode_agent, barcode_image)
+        if not barcode_data:
+            raise AnalysisError('Barcode not recognized. Please use a clearer picture.')
+        image_store = astart_image_store(barcode_image)
+
+        search_query_for_agents = barcode_data
+        final_search_query_for_history = f"Barcode Scan: {barcode_data}"
+        extracted_data = {
+            'Name': f"Barcode: {barcode_data}",
+            'MFG Date': 'Not Found', 'Expiry Date': 'Not Found',
+            'MRP': 'Not Found', 'Is Expired': False
+        }
+
+    elif packaging_image:
+        # --- PATH B: PACKAGING IMAGE UPLOADED (OCR/Fuzzy Match) ---
+        await stage('ocr')
+        raw_text = await arun_ocr_agent(packaging_image)
+        if not raw_text:
+            raise AnalysisError('OCR failed. Could not read text from image. Please use a clearer picture.')
+        image_store = astart_image_store(packaging_image)
+
+        await stage('extraction')
+        extracted_data, search_results = await aextract_and_search(raw_text)
+        searched = True
+        search_query_for_agents = extracted_data.get('Name', raw_text)
+        final_search_query_for_history = extracted_data.get('Name', raw_text).strip()
+
+    elif search_query:
+        # --- PATH C: TEXT SEARCH (Fuzzy Match) ---
+        search_query_for_agents = search_query
+        final_search_query_for_history = search_query
+        extracted_data = {
+            'Name': search_query,
+            'MFG Date': 'Not Applicable', 'Expiry Date': 'Not Applicable',
+            'MRP': 'Not Applicable', 'Is Expired': False
+        }
+
+    else:
+        raise AnalysisError('Please submit a query or an image.')
+
+    if not searched:
+        await stage('search')
+        search_results = await asyncio.to_thread(run_search_agent, search_query_for_agents, is_barcode_search)
+    await stage('summary')
+    summary_stream = None
+    if stream_summary:
+        analysis_summary, summary_stream = await astart_summary(search_results, extracted_data, is_barcode=is_barcode_search)
+    else:
+        analysis_summary = await arun_summary_agent(search_results, extracted_data, is_barcode=is_barcode_search)
+
+    image = await image_store if image_store else None
+
+    history = None
+    if final_search_query_for_history or analysis_summary or summary_stream:
+        await stage('saving')
+        with span('history.insert'):
+            history = await History.objects.acreate(
+                user=user,
+                search_query=final_search_query_for_history,
+                analysis_summary=analysis_summary,
+                image=image
+            )
+        if summary_stream is not None:
+            summary_stream['history'] = history.pk
+
+    return {
+        'analysis_summary': analysis_summary,
+        'image_url': image.url if image else None,
+        'saved': history is not None,
+        'history': history,
+        'summary_stream': summary_stream,
+    }
@@ -0,0 +1,135 @@
+# medicinebot/scheduler.py
+"""
+Runs the stages of an analysis that don't depend on each other side by
+side, for ``home_view`` (threads) and the async pipeline (tasks):
+
+- the uploaded image is stored (hash, thumbnail, blob write) while the
+  agents wait on Vision / Ollama;
+- the leading OCR lines are searched while the extraction agent works. A
+  confident hit is the search result, and when the parser has the dates
+  and MRP the LLM extraction is not waited for.
+"""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .agents.extraction_agent import arun_extraction_agent, extract_with_name, run_extraction_agent
+from .agents import search_agent
+from .agents.search_agent import run_search_agent
+from .blobstore import read_upload, store_image_data
+from .tracing import annotate, span
+
+STAGE_WORKERS = 8
+# Token sort ratio a speculative hit needs against its OCR line.
+SPECULATIVE_SEARCH_MIN_SCORE = 85
+
+_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, "STAGE_WORKERS", STAGE_WORKERS),
+    thread_name_prefix="stage",
+)
+
+
+def submit(fn, *args):
+    """Run ``fn(*args)`` on the stage pool, in the caller's context (so its spans join the request's trace)."""
+    return _pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def speculation_enabled():
+    return getattr(settings, "SPECULATIVE_SEARCH", True)
+
+
+# ----------------------------------------------------------------------
+# Image store
+# ----------------------------------------------------------------------
+
+def start_image_store(image_file):
+    """
+    Store the upload in the background; returns a Future of its ImageBlob.
+    The bytes are read here, before the call returns, so the agents can go
+    on reading the same file.
+    """
+    return submit(store_image_data, *read_upload(image_file))
+
+
+def astart_image_store(image_file):
+    """Async ``start_image_store``: a task resolving to the ImageBlob."""
+    return asyncio.create_task(asyncio.to_thread(store_image_data, *read_upload(image_file)))
+
+
+# ----------------------------------------------------------------------
+# Extraction + search
+# ----------------------------------------------------------------------
+
+def _speculate(raw_text):
+    with span("search.speculative"):
+        # Through the module, so a patched ``search_agent_instance`` (benchmarks) is used.
+        guess = search_agent.search_agent_instance.speculate(
+            raw_text, getattr(settings, "SPECULATIVE_SEARCH_MIN_SCORE", SPECULATIVE_SEARCH_MIN_SCORE)
+        )
+        annotate(hit=guess is not None)
+        return guess
+
+
+def _use_guess(guess, raw_text, extraction_done):
+    """``(extracted_data or None, record)`` for a speculative hit; None: wait for the extraction agent."""
+    record, name, score = guess
+    extracted_data = None if extraction_done else extract_with_name(raw_text, name)
+    if extracted_data is not None:
+        print(f"Stage Scheduler: Speculative match {name!r} ({score}), not waiting for the extraction LLM")
+    else:
+        print(f"Stage Scheduler: Speculative match {name!r} ({score}), search skipped")
+    return extracted_data, record
+
+
+def extract_and_search(raw_text):
+    """
+    Extraction and search for OCR text: ``(extracted_data, search_results)``.
+
+    The extraction agent runs on the stage pool while the leading OCR
+    lines are searched here. Without a confident hit this is
+    ``run_extraction_agent`` followed by ``run_search_agent`` on the name
+    it found. A skipped extraction still finishes in the background (a
+    blocking Ollama call can't be interrupted) and fills the extraction
+    cache for the next upload of the package.
+    """
+    if not speculation_enabled():
+        extracted_data = run_extraction_agent(raw_text)
+        return extracted_data, run_search_agent(extracted_data.get('Name', raw_text))
+
+    extraction = submit(run_extraction_agent, raw_text)
+    guess = _speculate(raw_text)
+    if guess is not None:
+        extracted_data, record = _use_guess(guess, raw_text, extraction.done())
+        if extracted_data is None:
+            extracted_data = dict(extraction.result(), Name=guess[1])
+        return extracted_data, record
+
+    extracted_data = extraction.result()
+    return extracted_data, run_search_agent(extracted_data.get('Name', raw_text))
+
+
+async def aextract_and_search(raw_text):
+    """Async ``extract_and_search``; a skipped extraction task is cancelled."""
+    if not speculation_enabled():
+        extracted_data = await arun_extraction_agent(raw_text)
+        return extracted_data, await asyncio.to_thread(run_search_agent, extracted_data.get('Name', raw_text))
+
+    extraction = asyncio.create_task(arun_extraction_agent(raw_text))
+    try:
+        guess = await asyncio.to_thread(_speculate, raw_text)
+    except BaseException:
+        extraction.cancel()
+        raise
+    if guess is not None:
+        extracted_data, record = _use_guess(guess, raw_text, extraction.done())
+        if extracted_data is not None:
+            extraction.cancel()
+        else:
+            extracted_data = dict(await extraction, Name=guess[1])
+        return extracted_data, record
+
+    extracted_data = await extraction
+    return extracted_data, await asyncio.to_thread(run_search_agent, extracted_data.get('Name', raw_text))
@@ -1,3 +1,1310 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import io
+import json
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import benchmarking, scheduler
+from .agents import barcode_agent, search_agent
+from .agents.autocomplete import display_ean
+from .agents.catalogue import (
+    StringColumn,
+    catalogue_from_frame,
+    compile_catalogue,
+    diff_catalogue,
+    load_compiled_catalogue,
+    load_csv_catalogue,
+    read_catalogue_csv,
+)
+from .agents.db_catalogue import FTS_TABLE, DatabaseCatalogue, fts_available, load_database_catalogue
+from .agents.ean import is_valid_gtin, normalize_ean, split_eans
+from .agents.extraction_agent import extract_with_name
+from .agents.embeddings import HashingEmbedder
+from .agents.field_parser import extract_fields, parse_date
+from .agents.llm_gateway import LLMError, LLMGateway
+from .agents.image_cache import Fingerprint, ImageResultCache
+from .agents.image_prep import load_image, prepare_for_barcode, prepare_for_ocr
+from .agents.name_index import NameIndex
+from .agents.search_agent import SearchAgent
+from .agents.summary_agent import StreamCleaner, summary_agent_instance
+from .agents.summary_cache import summary_cache
+from .agents.vector_index import VectorIndex, build_vector_index, build_ivf, document_texts
+from .blobstore import FileSystemBlobStore, image_key, store_image_data, thumbnail_key
+from .cache_backends import SQLiteCache
+from .history import InvalidCursor, decode_cursor, history_page
+from .jobs import LOST, aenqueue_analysis, claim_job, enqueue_analysis, requeue_stale_jobs, run_job
+from .management.commands.benchmark_pipeline import Command as BenchmarkCommand
+from .models import AnalysisJob, History, ImageBlob, Medicine, MedicineSummary
+from .pipeline import AnalysisError, run_analysis_pipeline
+from .views import SUMMARY_STREAM_SALT, start_summary
+
+
+class ParseDateTests(SimpleTestCase):
+
+    def test_month_year_is_first_of_month(self):
+        self.assertEqual(parse_date("05/2024"), date(2024, 5, 1))
+        self.assertEqual(parse_date("MAY 2024"), date(2024, 5, 1))
+
+    def test_end_of_month(self):
+        self.assertEqual(parse_date("04/27", end_of_month=True), date(2027, 4, 30))
+        self.assertEqual(parse_date("DEC-2025", end_of_month=True), date(2025, 12, 31))
+        self.assertEqual(parse_date("SEPT.26", end_of_month=True), date(2026, 9, 30))
+
+    def test_end_of_february(self):
+        self.assertEqual(parse_date("02/2028", end_of_month=True), date(2028, 2, 29))
+        self.assertEqual(parse_date("02/2027", end_of_month=True), date(2027, 2, 28))
+
+    def test_full_date_keeps_its_day(self):
+        self.assertEqual(parse_date("12/05/2025", end_of_month=True), date(2025, 5, 12))
+
+    def test_invalid(self):
+        for value in (None, "", "13/2025", "31/02/2025", "05/1999", "Not Found", "B.No 1234"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_date(value))
+
+
+class ExtractFieldsTests(SimpleTestCase):
+
+    def test_package_text(self):
+        fields = extract_fields(
+            "Crocin Advance\nParacetamol Tablets IP 500 mg\n"
+            "MFG. DATE: 05/2024\nEXP. DATE: 04/2027\n"
+            "M.R.P. per strip of 10 tablets Rs. 30.00 (incl. of all taxes)"
+        )
+        self.assertEqual(fields, {
+            "MFG Date": date(2024, 5, 1),
+            "Expiry Date": date(2027, 4, 30),
+            "MRP": Decimal("30.00"),
+        })
+
+    def test_label_on_its_own_line(self):
+        fields = extract_fields("Use before\n11/26\nMRP ₹1,250.50")
+        self.assertEqual(fields["Expiry Date"], date(2026, 11, 30))
+        self.assertEqual(fields["MRP"], Decimal("1250.50"))
+
+    def test_missing_fields_are_none(self):
+        self.assertEqual(
+            extract_fields("Store below 25C"), {"MFG Date": None, "Expiry Date": None, "MRP": None}
+        )
+
+    def test_mfg_after_expiry_is_dropped(self):
+        fields = extract_fields("MFG 05/2027 EXP 04/2024")
+        self.assertIsNone(fields["MFG Date"])
+        self.assertIsNone(fields["Expiry Date"])
+
+
+class IsExpiredTests(SimpleTestCase):
+    text = "MFG 05/2024\nEXP 04/2027\nMRP Rs. 45.50"
+
+    def _extract(self, today):
+        with mock.patch("medicinebot.agents.extraction_agent.timezone.localdate", return_value=today):
+            return extract_with_name(self.text, "Crocin Advance")
+
+    def test_usable_until_end_of_expiry_month(self):
+        result = self._extract(date(2027, 4, 30))
+        self.assertEqual(result["Expiry Date"], "04/2027")
+        self.assertFalse(result["Is Expired"])
+
+    def test_expired_after_expiry_month(self):
+        self.assertTrue(self._extract(date(2027, 5, 1))["Is Expired"])
+
+    def test_missing_field_needs_the_llm(self):
+        self.assertIsNone(extract_with_name("EXP 04/2027", "Crocin Advance"))
+
+
+class NormalizeEanTests(SimpleTestCase):
+
+    def test_padded_to_gtin14(self):
+        self.assertEqual(normalize_ean("8901571007356"), "08901571007356")
+        self.assertEqual(normalize_ean("96385074"), "00000096385074")
+
+    def test_upc_a_and_ean13_share_a_key(self):
+        self.assertEqual(normalize_ean("036000291452"), normalize_ean("0036000291452"))
+
+    def test_separators_and_numbers(self):
+        self.assertEqual(normalize_ean(" 890-1571 007356 "), "08901571007356")
+        self.assertEqual(normalize_ean(8901571007356), "08901571007356")
+
+    def test_not_a_barcode(self):
+        for value in (None, "", "N/A", "123456789012345"):
+            with self.subTest(value=value):
+                self.assertIsNone(normalize_ean(value))
+
+    def test_split_eans(self):
+        self.assertEqual(
+            split_eans("8901571007356, 8901571007363;0"), ["08901571007356", "08901571007363"]
+        )
+        self.assertEqual(split_eans(float("nan")), [])
+
+    def test_check_digit(self):
+        self.assertTrue(is_valid_gtin("8901571007356"))
+        self.assertFalse(is_valid_gtin("8901571007357"))
+
+
+class NameIndexTests(SimpleTestCase):
+    names = [
+        "Crocin Advance 500mg Tablet",
+        "Dolo 650 Tablet",
+        "Crocin Pain Relief",
+        "Calpol 500mg Tablet",
+        "Azithral 500 Tablet",
+        "Pan 40 Tablet",
+    ]
+
+    def setUp(self):
+        self.index = NameIndex(self.names)
+
+    def test_small_catalogue_is_scored_in_full(self):
+        self.assertEqual(self.index.shortlist("anything", limit=10), list(range(6)))
+
+    def test_shortlist_keeps_best_matches_in_row_order(self):
+        self.assertEqual(self.index.shortlist("crocin", limit=2), [0, 2])
+        self.assertEqual(self.index.shortlist("DOLO-650", limit=1), [1])
+
+    def test_misspelt_query_shares_trigrams(self):
+        self.assertIn(0, self.index.shortlist("crocn advance", limit=2))
+
+    def test_common_words_alone_still_shortlist(self):
+        # "tablet" is in most names, so it is the only signal left.
+        rows = self.index.shortlist("tablet", limit=3)
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(set(rows) <= {0, 1, 3, 4, 5})
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.shortlist(" - ", limit=3), [])
+
+
+def make_search_agent(names, **overrides):
+    """A SearchAgent over an in-memory catalogue of ``names`` (no files, no vector index)."""
+    import pandas as pd
+
+    df = pd.DataFrame({"Name": names, "EAN": [f"{8901000000000 + i}" for i in range(len(names))]})
+    with override_settings(SEARCH_BACKEND="memory", VECTOR_INDEX_PATH=None, **overrides):
+        agent = SearchAgent()
+    agent.catalogue = catalogue_from_frame(df, "test")
+    return agent
+
+
+class SearchManyTests(SimpleTestCase):
+    names = NameIndexTests.names + ["Crocin Cold and Flu Tablet", "Pantocid 40 Tablet", "Dolonex DT Tablet"]
+    queries = ["crocin advance 500mg tablet", "dolo 650 tablt", "tablet 500mg calpol", "azithral", "xyzzy", ""]
+
+    def test_same_matches_and_phases_as_search(self):
+        agent = make_search_agent(self.names, SEARCH_SHORTLIST_SIZE=3, SEARCH_BATCH_CELL_BUDGET=10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = agent.search_many(self.queries)
+            expected = [agent._search(q) for q in self.queries]
+        rows = results.astype(object).where(results.notna(), None).to_dict("records")
+        self.assertEqual([row["query"] for row in rows], self.queries)
+        for row, (record, phase) in zip(rows, expected):
+            with self.subTest(query=row["query"]):
+                self.assertEqual(row["Name"], record and record["Name"])
+                self.assertEqual(row["phase"], phase if record else None)
+        self.assertEqual([row["phase"] for row in rows[:3]], ["qratio", "qratio", "tokenset"])
+
+
+class CompiledCatalogueTests(SimpleTestCase):
+    csv = (
+        "Name,EAN,Uses\n"
+        "Crocin Advance 500mg Tablet,8901571007356,Fever\n"
+        "Dolo 650 Tablet,\"8901234567890, 890400012345\",Fever\n"
+        "Crocin Advance 500mg Tablet,8907654321012,Duplicate name\n"
+        "Pan 40 Tablet,,Acidity\n"
+    )
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name, "medicines.csv")
+        path.write_text(self.csv, encoding="utf-8")
+        compile_catalogue(path, Path(tmp.name, "compiled"))
+        self.compiled, _ = load_compiled_catalogue(Path(tmp.name, "compiled"))
+        self.plain = load_csv_catalogue(path)
+
+    def test_names_stay_in_the_mapped_files(self):
+        self.assertIsInstance(self.compiled.names, StringColumn)
+        self.assertNotIsInstance(self.compiled.name_lookup, dict)
+        self.assertNotIsInstance(self.compiled.ean_lookup, dict)
+
+    def test_lookups_match_the_csv_catalogue(self):
+        for name in ("Crocin Advance 500mg Tablet", "Dolo 650 Tablet", "Pan 40 Tablet", "Dolo", ""):
+            with self.subTest(name=name):
+                self.assertEqual(self.compiled.name_lookup.get(name), self.plain.name_lookup.get(name))
+        for code in ("8901571007356", "0008901234567890", "8904000123450", "8907654321012", "123", None):
+            with self.subTest(code=code):
+                self.assertEqual(
+                    (self.compiled.find_ean(code) or {}).get("Name"), (self.plain.find_ean(code) or {}).get("Name")
+                )
+
+    def test_duplicate_name_returns_first_row(self):
+        self.assertEqual(self.compiled.find_name("Crocin Advance 500mg Tablet")["Uses"], "Fever")
+
+    def test_delta_leaves_the_mapped_snapshot_alone(self):
+        new = self.compiled.apply_delta(
+            added=[{"Name": "Calpol 500mg Tablet", "EAN": "8901111222232", "Uses": "Fever"}],
+            removed=[0],
+            changed={3: {"Name": "Pan 40 Tablet", "EAN": "8909998887773", "Uses": "Acidity"}},
+        )
+        self.assertEqual(new.find_name("Crocin Advance 500mg Tablet")["Uses"], "Duplicate name")
+        self.assertIsNone(new.find_ean("8901571007356"))
+        self.assertEqual(new.find_ean("8909998887773")["Name"], "Pan 40 Tablet")
+        self.assertEqual(new.find_ean("8901111222232")["Name"], "Calpol 500mg Tablet")
+        self.assertIn("Calpol 500mg Tablet", new.candidates("calpol"))
+        # The old snapshot still answers as before.
+        self.assertEqual(self.compiled.find_name("Crocin Advance 500mg Tablet")["Uses"], "Fever")
+        self.assertIsNone(self.compiled.find_name("Calpol 500mg Tablet"))
+
+
+class CatalogueDeltaTests(SimpleTestCase):
+    names = [
+        "Crocin Advance 500mg Tablet", "Dolo 650 Tablet", "Crocin Advance 500mg Tablet",
+        "Calpol 500mg Tablet", "Azithral 500 Tablet", "Pan 40 Tablet",
+        "Pantocid 40 Tablet", "Dolonex DT Tablet", "Allegra 120mg Tablet", "Montair LC Tablet",
+    ]
+
+    def write_csv(self, path, names, uses="Fever"):
+        rows = [f"{name},{8901000000000 + i},{uses if i == 5 else 'Fever'}" for i, name in enumerate(names)]
+        path.write_text("Name,EAN,Uses\n" + "\n".join(rows) + "\n", encoding="utf-8")
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name, "medicines.csv")
+        self.write_csv(self.path, self.names)
+        self.catalogue = load_csv_catalogue(self.path)
+
+    def test_name_index_update_leaves_the_old_index_alone(self):
+        index = self.catalogue.name_index
+        updated = index.updated({10: "Brufen 400 Tablet"}, {1: "Dolo 650 Tablet"})
+        self.assertEqual(updated.size, 11)
+        self.assertIn(10, updated.tokens["brufen"])
+        self.assertNotIn(1, updated.tokens["dolo"])
+        self.assertIn(1, index.tokens["dolo"])
+        self.assertNotIn("brufen", index.tokens)
+
+    def test_diff_catalogue(self):
+        self.write_csv(self.path, self.names[:2] + self.names[3:] + ["Brufen 400 Tablet"], uses="Acidity")
+        added, removed, changed = diff_catalogue(self.catalogue, read_catalogue_csv(self.path))
+        self.assertEqual([r["Name"] for r in added], ["Brufen 400 Tablet"])
+        # Rows are matched on (name, occurrence): the second Crocin row is the one that went.
+        self.assertEqual(removed, [2])
+        # Every later row moved up one EAN; Pantocid (now row 5) also changed its Uses.
+        self.assertEqual(sorted(changed), [3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(changed[6]["Uses"], "Acidity")
+
+    def test_removed_duplicate_hands_its_name_to_the_next_row(self):
+        new = self.catalogue.apply_delta(removed=[0])
+        self.assertEqual(new.name_lookup["Crocin Advance 500mg Tablet"], 2)
+        self.assertIsNone(new.find_ean("8901000000000"))
+        self.assertEqual(self.catalogue.name_lookup["Crocin Advance 500mg Tablet"], 0)
+
+    def test_reload_applies_a_delta(self):
+        with override_settings(MEDICINE_DATA_PATH=self.path, MEDICINE_CATALOGUE_PATH=None):
+            agent = make_search_agent([])
+        agent.catalogue = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            old = agent.get_catalogue()
+            self.write_csv(self.path, self.names[:9] + ["Montair LC Kid Tablet"])
+            agent._reload()
+            self.assertEqual(agent.last_reload["mode"], "delta")
+            self.assertEqual(agent.search("montair lc kid tablet")["Name"], "Montair LC Kid Tablet")
+        self.assertIsNot(agent.catalogue, old)
+        self.assertIsNone(old.find_name("Montair LC Kid Tablet"))
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    def make_cache(self, **options):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return SQLiteCache(Path(tmp.name, "cache.sqlite3"), {"TIMEOUT": 60, "OPTIONS": options})
+
+    def test_round_trip_and_expiry(self):
+        cache = self.make_cache()
+        cache.set("summary", {"text": "Paracetamol"})
+        self.assertEqual(cache.get("summary"), {"text": "Paracetamol"})
+        self.assertFalse(cache.add("summary", "other"))
+        cache.set("old", "value", timeout=-1)
+        self.assertIsNone(cache.get("old"))
+        self.assertTrue(cache.delete("summary"))
+        self.assertEqual(cache.get("summary", "missing"), "missing")
+
+    def test_cull_drops_expired_rows_first(self):
+        cache = self.make_cache(MAX_ENTRIES=3, CULL_FREQUENCY=3)
+        cache.set("stale", 1, timeout=-1)
+        for key in ("a", "b", "c"):
+            cache.set(key, key)
+        self.assertEqual([cache.get(k) for k in ("stale", "a", "b", "c")], [None, "a", "b", "c"])
+
+    def test_cull_evicts_least_recently_used(self):
+        cache = self.make_cache(MAX_ENTRIES=4, CULL_FREQUENCY=4)
+        clock = iter(range(1_000_000, 1_000_100))
+        with mock.patch("medicinebot.cache_backends.time.time", lambda: next(clock)):
+            for key in ("a", "b", "c", "d"):
+                cache.set(key, key)
+            cache.get("a")
+            cache.set("e", "e")
+            # Five rows over a limit of four: "b" goes, plus one more for head-room.
+            self.assertEqual([cache.has_key(k) for k in "abcde"], [True, False, False, True, True])
+
+
+class AnalysisPipelineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pharmacist")
+        self.stages = []
+
+    async def on_stage(self, name):
+        self.stages.append(name)
+
+    @mock.patch("medicinebot.pipeline.arun_summary_agent", new_callable=mock.AsyncMock, return_value="<p>Fever</p>")
+    @mock.patch("medicinebot.pipeline.run_search_agent", return_value={"Name": "Dolo 650 Tablet"})
+    async def test_text_search_saves_history(self, search, summary):
+        result = await run_analysis_pipeline(self.user, search_query="dolo 650", on_stage=self.on_stage)
+        self.assertEqual(self.stages, ["search", "summary", "saving"])
+        search.assert_called_once_with("dolo 650", False)
+        self.assertEqual(summary.await_args.args[0], {"Name": "Dolo 650 Tablet"})
+        self.assertTrue(result["saved"])
+        self.assertIsNone(result["image_url"])
+        history = await History.objects.aget(pk=result["history"].pk)
+        self.assertEqual((history.search_query, history.analysis_summary), ("dolo 650", "<p>Fever</p>"))
+
+    @mock.patch("medicinebot.pipeline.run_barcode_agent", return_value=None)
+    async def test_unreadable_barcode_is_reported(self, barcode):
+        with self.assertRaisesMessage(AnalysisError, "Barcode not recognized"):
+            await run_analysis_pipeline(self.user, barcode_image=object(), on_stage=self.on_stage)
+        self.assertEqual(self.stages, ["barcode"])
+        self.assertFalse(await History.objects.aexists())
+
+    async def test_nothing_submitted(self):
+        with self.assertRaises(AnalysisError):
+            await run_analysis_pipeline(self.user)
+
+
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pharmacist")
+
+    def enqueue(self, query="dolo 650"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return enqueue_analysis(self.user, search_query=query)
+
+    async def aenqueue(self, query="dolo 650"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return await aenqueue_analysis(self.user, search_query=query)
+
+    async def requeue(self, job):
+        await AnalysisJob.objects.filter(pk=job.pk).aupdate(status=AnalysisJob.STATUS_QUEUED, worker="")
+
+    async def test_claims_highest_priority_then_oldest(self):
+        first, second = await self.aenqueue(), await self.aenqueue()
+        await AnalysisJob.objects.filter(pk=second.pk).aupdate(priority=50)
+        claimed = [await claim_job(worker="w1"), await claim_job(worker="w2"), await claim_job(worker="w3")]
+        self.assertEqual([job.pk if job else None for job in claimed], [second.pk, first.pk, None])
+        self.assertEqual((claimed[0].status, claimed[0].worker, claimed[0].attempts), ("running", "w1", 1))
+
+    async def test_claim_filters_on_kind(self):
+        await self.aenqueue()
+        self.assertIsNone(await claim_job([AnalysisJob.KIND_BARCODE], "w1"))
+        self.assertIsNotNone(await claim_job([AnalysisJob.KIND_TEXT], "w1"))
+
+    def test_stale_jobs_are_requeued_then_given_up(self):
+        job = self.enqueue()
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.STATUS_RUNNING, worker="gone", attempts=1, started_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(requeue_stale_jobs(stale_after=0), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ("queued", ""))
+
+        AnalysisJob.objects.filter(pk=job.pk).update(status=AnalysisJob.STATUS_RUNNING, attempts=3)
+        self.assertEqual(requeue_stale_jobs(stale_after=0), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+
+    def test_fresh_running_jobs_are_left_alone(self):
+        job = self.enqueue()
+        AnalysisJob.objects.filter(pk=job.pk).update(status=AnalysisJob.STATUS_RUNNING, started_at=timezone.now())
+        self.assertEqual(requeue_stale_jobs(stale_after=600), (0, 0))
+
+    async def run_quietly(self, job):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return await run_job(job)
+
+    async def test_run_job_records_the_result(self):
+        async def pipeline(user, on_stage, **kwargs):
+            await on_stage("search")
+            history = await History.objects.acreate(user=user, search_query="dolo 650", analysis_summary="ok")
+            return {"analysis_summary": "ok", "history": history}
+
+        await self.aenqueue()
+        job = await claim_job(worker="w1")
+        with mock.patch("medicinebot.jobs.run_analysis_pipeline", pipeline):
+            self.assertEqual(await self.run_quietly(job), "done")
+        job = await AnalysisJob.objects.aget(pk=job.pk)
+        self.assertEqual((job.status, job.analysis_summary, job.stage), ("done", "ok", ""))
+        self.assertIsNotNone(job.history_id)
+
+    async def test_job_taken_back_mid_run_saves_nothing(self):
+        async def pipeline(user, on_stage, **kwargs):
+            await self.requeue(job)
+            await on_stage("saving")
+            await History.objects.acreate(user=user, search_query="dolo 650")
+
+        await self.aenqueue()
+        job = await claim_job(worker="w1")
+        with mock.patch("medicinebot.jobs.run_analysis_pipeline", pipeline):
+            self.assertEqual(await self.run_quietly(job), LOST)
+        self.assertFalse(await History.objects.aexists())
+        self.assertEqual((await AnalysisJob.objects.aget(pk=job.pk)).status, "queued")
+
+    async def test_job_taken_back_after_saving_drops_its_history(self):
+        async def pipeline(user, on_stage, **kwargs):
+            await on_stage("saving")
+            history = await History.objects.acreate(user=user, search_query="dolo 650")
+            await self.requeue(job)
+            return {"analysis_summary": "", "history": history}
+
+        await self.aenqueue()
+        job = await claim_job(worker="w1")
+        # Claimed again by another worker before this one finished.
+        with mock.patch("medicinebot.jobs.run_analysis_pipeline", pipeline):
+            self.assertEqual(await self.run_quietly(job), LOST)
+        self.assertFalse(await History.objects.aexists())
+        job = await AnalysisJob.objects.aget(pk=job.pk)
+        self.assertEqual((job.status, job.finished_at), ("queued", None))
+
+
+def png_bytes(size=(640, 480), color=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, "PNG")
+    return out.getvalue()
+
+
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.store = FileSystemBlobStore(tmp.name)
+        patcher = mock.patch("medicinebot.blobstore._store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.owner = User.objects.create_user("owner")
+        self.other = User.objects.create_user("other")
+
+    def store_quietly(self, data, content_type="image/png"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return store_image_data(data, content_type)
+
+    def test_uploads_are_deduplicated_with_a_thumbnail(self):
+        data = png_bytes()
+        blob = self.store_quietly(data)
+        self.assertEqual(self.store_quietly(data).pk, blob.pk)
+        self.assertEqual(ImageBlob.objects.count(), 1)
+        self.assertEqual((blob.width, blob.height, blob.size), (640, 480, len(data)))
+        self.assertEqual(self.store.get(image_key(blob.sha256)), data)
+        with Image.open(io.BytesIO(self.store.get(thumbnail_key(blob.sha256)))) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (320, 240)))
+
+    def test_only_the_owner_can_fetch_the_image(self):
+        blob = self.store_quietly(png_bytes())
+        History.objects.create(user=self.owner, search_query="dolo", image=blob)
+        url = reverse("image_thumbnail", args=[blob.sha256])
+
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse("image_blob", args=[blob.sha256])).status_code, 404)
+
+        self.client.force_login(self.owner)
+        response = self.client.get(url)
+        self.assertEqual((response.status_code, response["Content-Type"]), (200, "image/webp"))
+        self.assertIn("immutable", response["Cache-Control"])
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("pharmacist")
+        self.other = User.objects.create_user("other")
+        start = timezone.now()
+        for i in range(7):
+            item = History.objects.create(user=self.user, search_query=f"query {i}", analysis_summary="<p>long</p>")
+            # Two entries share each timestamp: the id breaks the tie.
+            History.objects.filter(pk=item.pk).update(timestamp=start + timedelta(minutes=i // 2))
+        History.objects.create(user=self.other, search_query="not yours")
+        self.newest_first = list(
+            History.objects.filter(user=self.user).order_by("-timestamp", "-id").values_list("pk", flat=True)
+        )
+
+    def test_cursor_walks_every_entry_once(self):
+        seen, cursor = [], None
+        while True:
+            items, cursor = history_page(self.user, cursor, limit=3)
+            seen.extend(item.pk for item in items)
+            if cursor is None:
+                break
+        self.assertEqual(seen, self.newest_first)
+
+    def test_heavy_columns_are_deferred(self):
+        items, _ = history_page(self.user, limit=2)
+        self.assertEqual([item.search_query for item in items], ["query 6", "query 5"])
+        self.assertLessEqual({"analysis_summary", "image_data_url"}, items[0].get_deferred_fields())
+
+    def test_bad_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not-a-cursor")
+
+    def test_api_pages_and_detail(self):
+        self.client.force_login(self.user)
+        first = self.client.get(reverse("history_api"), {"limit": 4}).json()
+        second = self.client.get(reverse("history_api"), {"cursor": first["next_cursor"], "limit": 4}).json()
+        self.assertEqual([r["id"] for r in first["results"] + second["results"]], self.newest_first)
+        self.assertIsNone(second["next_cursor"])
+        self.assertNotIn("analysis_summary", first["results"][0])
+
+        detail = self.client.get(first["results"][0]["detail_json_url"]).json()
+        self.assertEqual(detail["analysis_summary"], "<p>long</p>")
+        self.assertEqual(self.client.get(reverse("history_api"), {"cursor": "%%%"}).status_code, 400)
+
+    def test_other_users_entries_are_hidden(self):
+        self.client.force_login(self.other)
+        results = self.client.get(reverse("history_api")).json()["results"]
+        self.assertEqual([r["search_query"] for r in results], ["not yours"])
+        response = self.client.get(reverse("history_detail_json", args=[self.newest_first[0]]))
+        self.assertEqual(response.status_code, 404)
+
+
+def jpeg_upload(size, orientation=None):
+    img = Image.effect_noise(size, 64).convert("RGB")
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=95, exif=exif)
+    return SimpleUploadedFile("photo.jpg", out.getvalue(), content_type="image/jpeg")
+
+
+class ImagePrepTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def test_load_image_applies_exif_orientation_and_downscales(self):
+        # Orientation 6: stored landscape, displayed rotated to portrait.
+        upload = jpeg_upload((1200, 800), orientation=6)
+        img, original = load_image(upload.read(), 300, "L")
+        self.assertEqual(original, (1200, 800))
+        self.assertEqual((img.mode, img.size), ("L", (200, 300)))
+
+    @override_settings(OCR_MAX_IMAGE_SIDE=800)
+    def test_ocr_payload_is_a_smaller_jpeg(self):
+        upload = jpeg_upload((2400, 1800))
+        payload, stats = prepare_for_ocr(upload)
+        self.assertEqual(upload.tell(), 0)
+        self.assertLess(len(payload), len(upload.read()))
+        self.assertEqual(stats["output_size"], (800, 600))
+        with Image.open(io.BytesIO(payload)) as img:
+            self.assertEqual((img.format, img.size), ("JPEG", (800, 600)))
+
+    def test_ocr_keeps_small_or_undecodable_uploads(self):
+        small = SimpleUploadedFile("tiny.png", png_bytes((40, 30)), content_type="image/png")
+        self.assertEqual(prepare_for_ocr(small)[0], small.read())
+        broken = SimpleUploadedFile("broken.jpg", b"not an image", content_type="image/jpeg")
+        payload, stats = prepare_for_ocr(broken)
+        self.assertEqual((payload, stats["output_bytes"]), (b"not an image", 12))
+
+    @override_settings(BARCODE_MAX_IMAGE_SIDE=640)
+    def test_barcode_image_is_grayscale_and_downscaled(self):
+        img, stats = prepare_for_barcode(jpeg_upload((1920, 1440)))
+        self.assertEqual((img.mode, img.size), ("L", (640, 480)))
+        self.assertEqual(stats["output_bytes"], 640 * 480)
+        self.assertEqual(prepare_for_barcode(jpeg_upload((1920, 1440)), max_side=0)[0].size, (1920, 1440))
+
+
+SAMPLES = Path(__file__).resolve().parent.parent / "samples" / "barcodes"
+
+
+class BarcodeDecoderTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def upload(self, name):
+        return SimpleUploadedFile(name, (SAMPLES / name).read_bytes(), content_type="image/jpeg")
+
+    def test_fast_pass(self):
+        self.assertEqual(barcode_agent._decode(self.upload("clean.jpg")), "8901571007356")
+
+    def test_fallbacks_read_the_full_size_copy(self):
+        # The code is too small for the downscaled fast pass.
+        upload = self.upload("tiny_code.jpg")
+        with override_settings(BARCODE_TIME_BUDGET=30):
+            self.assertEqual(barcode_agent._decode(upload), "8907070707070")
+        self.assertEqual(upload.tell(), 0)
+
+    def test_agreeing_ean8_reads_win_early(self):
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        with mock.patch.object(barcode_agent, "_pool", pool), \
+                mock.patch.object(barcode_agent, "_payloads", return_value=["96385074"]) as payloads:
+            self.assertEqual(barcode_agent._decode(self.upload("clean.jpg")), "96385074")
+        # The fast pass and the first fallback (plus at most the one that had started), not every attempt.
+        self.assertLessEqual(payloads.call_count, 3)
+
+    def test_lone_ean8_read_is_kept_as_a_fallback(self):
+        reads = iter([["96385074"]])
+        with mock.patch.object(barcode_agent, "_payloads", side_effect=lambda image: next(reads, [])):
+            self.assertEqual(barcode_agent._decode(self.upload("clean.jpg")), "96385074")
+
+
+class ImageResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.enterContext(override_settings(CACHES={
+            "image_results": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "image-cache-tests"},
+        }))
+        self.cache = ImageResultCache()
+        self.cache.backend.clear()
+        photo = (SAMPLES / "clean.jpg").read_bytes()
+        with Image.open(io.BytesIO(photo)) as img:
+            # The same pack shot again: slightly brighter, re-encoded.
+            out = io.BytesIO()
+            img.point(lambda v: min(255, v + 6)).save(out, "JPEG", quality=70)
+        self.photo, self.again = Fingerprint(photo), Fingerprint(out.getvalue())
+
+    def test_barcodes_are_reused_on_exact_bytes_only(self):
+        self.cache.set("barcode", self.photo, "8901571007356")
+        self.assertEqual(self.cache.get("barcode", Fingerprint((SAMPLES / "clean.jpg").read_bytes())), "8901571007356")
+        self.assertIsNone(self.cache.get("barcode", self.again))
+
+    def test_near_duplicates_when_enabled(self):
+        with override_settings(IMAGE_CACHE_NEAR_DISTANCE={"barcode": 4}):
+            self.cache.set("barcode", self.photo, "8901571007356")
+            self.assertEqual(self.cache.get("barcode", self.again), "8901571007356")
+        self.assertEqual(self.cache.stats()["near_hits"], 1)
+
+
+class CountingEmbedder(HashingEmbedder):
+    """Hashing embeddings that remember which texts were embedded (and can fail on one)."""
+
+    def __init__(self, fail_on=None):
+        super().__init__(dim=64)
+        self.embedded = []
+        self.fail_on = fail_on
+
+    def embed_documents(self, texts):
+        if self.fail_on and any(self.fail_on in t for t in texts):
+            raise RuntimeError("embedding server went away")
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+class VectorIndexBuildTests(SimpleTestCase):
+    header = 'Name,EAN,"Type ",Uses,Side Effects\n'
+    rows = [
+        "Dolo 650 Tablet,8901000000001,Tablet,Fever,Nausea",
+        "Crocin Advance 500mg Tablet,8901000000002,Tablet,Pain relief,",
+        "Azithral 500 Tablet,8901000000003,Tablet,Bacterial infections,Diarrhoea",
+        "Pan 40 Tablet,8901000000004,Tablet,Acidity,Headache",
+    ]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.csv = Path(tmp.name, "medicines.csv")
+        self.out = Path(tmp.name, "vectors")
+        self.write(self.rows)
+
+    def write(self, rows):
+        self.csv.write_text(self.header + "\n".join(rows) + "\n", encoding="utf-8")
+
+    def build(self, embedder, workers=2, **options):
+        return build_vector_index(self.csv, self.out, embedder, batch_size=1, workers=workers, **options)
+
+    def test_document_texts_match_the_csv_headers(self):
+        texts = document_texts(read_catalogue_csv(self.csv))
+        self.assertEqual(texts[0], "Name: Dolo 650 Tablet\nType: Tablet\nUses: Fever\nSide Effects: Nausea")
+        # Empty cells are left out, not embedded as filler.
+        self.assertNotIn("Side Effects", texts[1])
+
+    def test_only_new_or_changed_rows_are_embedded_again(self):
+        manifest = self.build(CountingEmbedder())
+        self.assertEqual((manifest["rows"], manifest["embedded"], manifest["reused"]), (4, 4, 0))
+        first = np.load(self.out / "vectors.npy")
+
+        self.write([self.rows[0], self.rows[1].replace("Pain relief", "Headache"), *self.rows[2:],
+                    "Allegra 120mg Tablet,8901000000005,Tablet,Allergy,Drowsiness"])
+        embedder = CountingEmbedder()
+        manifest = self.build(embedder)
+        self.assertEqual((manifest["embedded"], manifest["reused"]), (2, 3))
+        self.assertEqual([t.splitlines()[0] for t in embedder.embedded],
+                         ["Name: Crocin Advance 500mg Tablet", "Name: Allegra 120mg Tablet"])
+        vectors = np.load(self.out / "vectors.npy")
+        np.testing.assert_array_equal(vectors[[0, 2, 3]], first[[0, 2, 3]])
+        self.assertEqual(self.build(CountingEmbedder(), full=True)["embedded"], 5)
+
+    def test_interrupted_build_resumes_from_its_checkpoint(self):
+        # One worker: the batches before the failing last row are checkpointed.
+        with self.assertRaises(RuntimeError):
+            self.build(CountingEmbedder(fail_on="Pan 40"), workers=1)
+        embedder = CountingEmbedder()
+        manifest = self.build(embedder)
+        self.assertEqual((manifest["rows"], manifest["embedded"]), (4, 1))
+        self.assertEqual([t.splitlines()[0] for t in embedder.embedded], ["Name: Pan 40 Tablet"])
+        self.assertFalse((self.out / "checkpoint").exists())
+
+    def test_ivf_search_finds_the_exact_neighbours(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(2000, 16)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        centroids, offsets, ids = build_ivf(vectors)
+        self.assertEqual(sorted(ids.tolist()), list(range(2000)))
+        index = VectorIndex.__new__(VectorIndex)
+        index.vectors, index.nprobe, index.ivf = vectors, len(centroids), (centroids, offsets, ids)
+        # Probing every list is an exact search.
+        rows, scores = index.search(vectors[7], k=3)
+        self.assertEqual(rows[0], 7)
+        np.testing.assert_allclose(scores, np.sort(vectors @ vectors[7])[::-1][:3], rtol=1e-5)
+
+
+class SemanticSearchTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        csv, vectors = Path(tmp.name, "medicines.csv"), Path(tmp.name, "vectors")
+        csv.write_text(VectorIndexBuildTests.header + "\n".join([
+            *VectorIndexBuildTests.rows[:3],
+            "Pan 40 Tablet,8901000000004,Tablet,Acidity and heartburn,Headache",
+            "Allegra 120mg Tablet,8901000000005,Tablet,Allergy,Drowsiness",
+        ]) + "\n", encoding="utf-8")
+        build_vector_index(csv, vectors, HashingEmbedder(dim=256))
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        with override_settings(MEDICINE_DATA_PATH=csv, MEDICINE_CATALOGUE_PATH=None, VECTOR_INDEX_PATH=vectors,
+                               SEARCH_BACKEND="memory", MEDICINE_CATALOGUE_WATCH_INTERVAL=0):
+            self.agent = SearchAgent()
+            self.catalogue = self.agent.get_catalogue()
+
+    def test_rank_finds_a_medicine_by_its_use(self):
+        ranked = self.agent.rank("acidity heartburn", limit=2)
+        self.assertEqual(ranked[0]["name"], "Pan 40 Tablet")
+        self.assertGreater(ranked[0]["semantic"], ranked[1]["semantic"])
+
+    def test_fused_phase(self):
+        record, phase = self.agent._search("tablet dolo 650 strong")
+        self.assertEqual((record["Name"], phase), ("Dolo 650 Tablet", "fused"))
+
+    def test_weak_fused_score_falls_through_to_the_fuzzy_phases(self):
+        self.agent.fused_min_score = 1.01
+        record, phase = self.agent._search("tablet dolo 650 strong")
+        self.assertEqual((record["Name"], phase), ("Dolo 650 Tablet", "tokenset"))
+
+    def test_failed_query_embedding_falls_through(self):
+        with mock.patch.object(HashingEmbedder, "embed_query", side_effect=RuntimeError("down")):
+            record, phase = self.agent._search("tablet dolo 650 strong")
+        self.assertEqual((record["Name"], phase), ("Dolo 650 Tablet", "tokenset"))
+
+
+LLM_OUTPUT = "**💊 Type:** Tablet for fever.\n\n🌿 Ingredients: *Paracetamol*\n## 💗 Uses: Fever and pain."
+
+
+class StreamCleanerTests(SimpleTestCase):
+    def test_any_split_cleans_like_the_whole_response(self):
+        expected = summary_agent_instance._clean_markdown(LLM_OUTPUT)
+        for size in (1, 3, 7, len(LLM_OUTPUT)):
+            cleaner = StreamCleaner(summary_agent_instance._clean_line)
+            for i in range(0, len(LLM_OUTPUT), size):
+                cleaner.feed(LLM_OUTPUT[i:i + size])
+            cleaner.finish()
+            self.assertEqual(cleaner.text, expected)
+
+    def test_partial_line(self):
+        cleaner = StreamCleaner(summary_agent_instance._clean_line)
+        self.assertEqual(cleaner.feed("**💊 Type:** Tab"), [])
+        self.assertEqual(cleaner.partial, "💊 Type: Tab")
+
+
+class StreamedSummaryTests(TestCase):
+    context = "Name: Dolo 650 Tablet\nUses: Fever"
+
+    def setUp(self):
+        summary_cache.backend.clear()
+        self.user = User.objects.create_user("pharmacist")
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def fake_stream(self, *parts, error=None, gate=None):
+        async def astream_chat(model, messages, **options):
+            if gate is not None:
+                await gate.wait()
+            for part in parts:
+                yield part
+            if error:
+                raise error
+        return mock.patch("medicinebot.agents.summary_agent.llm_gateway.astream_chat", astream_chat)
+
+    async def collect(self):
+        return [event async for event in summary_agent_instance.astream_summary(self.context, "Dolo 650 Tablet")]
+
+    async def test_header_first_then_lines_then_the_stored_summary(self):
+        with self.fake_stream(LLM_OUTPUT[:20], LLM_OUTPUT[20:]):
+            events = await self.collect()
+        self.assertEqual(events[0][0], "chunk")
+        self.assertIn("Dolo 650 Tablet", events[0][1])
+        self.assertEqual(events[-1][0], "done")
+        self.assertIn("<p>💗 Uses: Fever and pain.</p>", events[-1][1])
+        stored = await MedicineSummary.objects.aget()
+        self.assertEqual(stored.body_md, summary_agent_instance._clean_markdown(LLM_OUTPUT))
+        # The next request is answered from the cache, without the LLM.
+        with self.fake_stream(error=AssertionError("LLM called again")):
+            self.assertEqual(await self.collect(), [events[-1]])
+
+    async def test_llm_failure_falls_back_to_the_database_fields(self):
+        with self.fake_stream("💊 Type: Tab", error=LLMError("phi3: no tokens for 60s")):
+            events = await self.collect()
+        self.assertEqual(events[-1][0], "done")
+        self.assertIn("💗 Uses: Fever", events[-1][1])
+        self.assertFalse(await MedicineSummary.objects.aexists())
+
+    async def test_stream_view_follows_the_generation_and_saves_history(self):
+        history = await History.objects.acreate(user=self.user, search_query="dolo", analysis_summary="")
+        # The model only starts once the browser is listening.
+        gate = asyncio.Event()
+        with self.fake_stream(LLM_OUTPUT, gate=gate):
+            task = start_summary({
+                "history": history.pk, "db_context": self.context,
+                "medicine_name": "Dolo 650 Tablet", "extracted_data": None,
+            })
+            await self.async_client.aforce_login(self.user)
+            token = signing.dumps(history.pk, salt=SUMMARY_STREAM_SALT)
+            response = await self.async_client.get(reverse("summary_stream", args=[token]))
+            gate.set()
+            body = "".join([chunk.decode() async for chunk in response.streaming_content])
+            await task
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = [block.split("\n", 1)[0] for block in body.split("\n\n") if block]
+        self.assertEqual(events[0], "event: chunk")
+        self.assertIn("event: partial", events)
+        self.assertEqual(events[-1], "event: done")
+        self.assertIn("Fever and pain", (await History.objects.aget(pk=history.pk)).analysis_summary)
+
+    async def test_stream_view_checks_the_owner(self):
+        history = await History.objects.acreate(user=self.user, search_query="dolo", analysis_summary="<p>done</p>")
+        other = await User.objects.acreate(username="other")
+        await self.async_client.aforce_login(other)
+        token = signing.dumps(history.pk, salt=SUMMARY_STREAM_SALT)
+        self.assertEqual((await self.async_client.get(reverse("summary_stream", args=[token]))).status_code, 404)
+        self.assertEqual((await self.async_client.get(reverse("summary_stream", args=["forged"]))).status_code, 404)
+
+
+class _Abort(BaseException):
+    pass
+
+
+@override_settings(LLM_CONCURRENCY={"default": 1}, LLM_QUEUE_TIMEOUT=0.05, LLM_TIMEOUT=5)
+class LLMGatewayTests(SimpleTestCase):
+    messages = [{"role": "user", "content": "Summarize Dolo 650"}]
+
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.gateway = LLMGateway()
+        self.client = mock.Mock()
+        self.client.chat.return_value = {"message": {"content": "ok"}, "eval_count": 3}
+        self.gateway._clients[5] = self.client
+
+    def test_identical_requests_share_one_call(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow_chat(**kwargs):
+            started.set()
+            release.wait(5)
+            return {"message": {"content": "ok"}}
+
+        self.client.chat.side_effect = slow_chat
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            first = pool.submit(self.gateway.chat, "phi3", self.messages)
+            started.wait(5)
+            second = pool.submit(self.gateway.chat, "phi3", self.messages)
+            while self.gateway.stats().get("phi3", {}).get("coalesced") != 1:
+                pass
+            release.set()
+            self.assertEqual(first.result(), second.result())
+        self.assertEqual(self.client.chat.call_count, 1)
+        self.assertEqual(self.gateway._inflight, {})
+
+    def test_leader_crash_reaches_followers_and_clears_the_key(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def crash(*args):
+            entered.set()
+            release.wait(5)
+            raise _Abort()
+
+        with mock.patch.object(self.gateway, "_call", side_effect=crash), ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(self.gateway.chat, "phi3", self.messages)
+            entered.wait(5)
+            follower = pool.submit(self.gateway.chat, "phi3", self.messages, fallback="fallback")
+            while self.gateway.stats().get("phi3", {}).get("coalesced") != 1:
+                pass
+            release.set()
+            with self.assertRaises(_Abort):
+                leader.result(5)
+            with self.assertRaises(_Abort):
+                follower.result(5)
+        self.assertEqual(self.gateway._inflight, {})
+
+    def test_no_free_slot_within_the_queue_timeout(self):
+        semaphore = self.gateway._semaphore("phi3")
+        semaphore.acquire()
+        try:
+            self.assertEqual(self.gateway.chat("phi3", self.messages, fallback="fallback"), "fallback")
+            with self.assertRaisesMessage(LLMError, "no free slot"):
+                self.gateway.chat("phi3", self.messages)
+        finally:
+            semaphore.release()
+        self.assertEqual(self.gateway.stats()["phi3"]["timeouts"], 2)
+        self.client.chat.assert_not_called()
+
+    def test_call_timeout(self):
+        self.client.chat.side_effect = httpx.ReadTimeout("slow")
+        with self.assertRaisesMessage(LLMError, "no answer within 5"):
+            self.gateway.chat("phi3", self.messages)
+        stats = self.gateway.stats()["phi3"]
+        self.assertEqual((stats["timeouts"], stats["in_flight"]), (1, 0))
+        # The slot was given back.
+        self.client.chat.side_effect = None
+        self.assertEqual(self.gateway.chat("phi3", self.messages)["message"]["content"], "ok")
+
+    async def test_async_identical_requests_share_one_call(self):
+        client = mock.Mock()
+        client.chat = mock.AsyncMock(return_value={"message": {"content": "ok"}})
+        with mock.patch("medicinebot.agents.llm_gateway.ollama_client", return_value=client):
+            results = await asyncio.gather(*(self.gateway.achat("phi3", self.messages) for _ in range(3)))
+        self.assertEqual([r["message"]["content"] for r in results], ["ok"] * 3)
+        self.assertEqual(client.chat.await_count, 1)
+        self.assertEqual(self.gateway.stats()["phi3"]["coalesced"], 2)
+
+    async def test_async_queue_timeout_uses_the_fallback(self):
+        client = mock.Mock()
+
+        async def never(**kwargs):
+            await asyncio.sleep(5)
+
+        client.chat = never
+        with mock.patch("medicinebot.agents.llm_gateway.ollama_client", return_value=client):
+            hold = asyncio.ensure_future(self.gateway.achat("phi3", self.messages, fallback=None))
+            await asyncio.sleep(0)
+            other = [{"role": "user", "content": "Summarize Crocin"}]
+            self.assertEqual(await self.gateway.achat("phi3", other, fallback="fallback"), "fallback")
+            hold.cancel()
+
+
+class BenchmarkingTests(SimpleTestCase):
+    def test_synthetic_catalogue_is_deterministic_and_shaped_like_the_csv(self):
+        df = benchmarking.synthetic_catalogue(500, seed=3)
+        self.assertTrue(df.equals(benchmarking.synthetic_catalogue(500, seed=3)))
+        self.assertFalse(df.equals(benchmarking.synthetic_catalogue(500, seed=4)))
+        self.assertEqual(list(df.columns), ["Name", "Type ", "Uses", "Content", "Side Effects", "EAN"])
+        self.assertEqual((df.index[0], df.index[-1]), (1, 500))
+        eans = [e for e in df["EAN"] if e]
+        self.assertTrue(eans)
+        self.assertTrue(all(e.startswith("890") and is_valid_gtin(e) for e in eans))
+
+    def test_write_synthetic_catalogue_reuses_the_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "bench" / "catalogue.csv"
+            df = benchmarking.write_synthetic_catalogue(path, 200, seed=1)
+            with mock.patch.object(benchmarking, "synthetic_catalogue") as generate:
+                again = benchmarking.write_synthetic_catalogue(path, 200, seed=1)
+            generate.assert_not_called()
+            self.assertEqual(list(again["Name"]), list(df["Name"]))
+            self.assertEqual(list(again["EAN"]), list(df["EAN"]))
+
+    def test_search_queries(self):
+        df = benchmarking.synthetic_catalogue(300)
+        queries = benchmarking.search_queries(df, 20)
+        self.assertEqual({kind: len(q) for kind, q in queries.items()}, {"barcode": 20, "exact": 20, "typo": 20, "rescue": 20})
+        by_ean = dict(zip(df["EAN"], df["Name"]))
+        self.assertTrue(all(by_ean[ean] == name for ean, name in queries["barcode"]))
+        self.assertTrue(all(query == name for query, name in queries["exact"]))
+        self.assertTrue(any(query != name.lower() for query, name in queries["typo"]))
+
+    def test_stub_ollama_server(self):
+        prompt = 'OCR text...\nExample: {"Name": "Dolo", "MRP": "Rs. 30"}\nJSON:'
+        with benchmarking.StubOllamaServer(first_token=0, per_token=0) as server:
+            generated = httpx.post(f"{server.host}/api/generate", json={"model": "phi3", "prompt": prompt, "stream": False}).json()
+            self.assertEqual(json.loads(generated["response"]), {"Name": "Not Found", "MRP": "Not Found"})
+
+            messages = [{"role": "user", "content": "Summarize Dolo 650"}]
+            lines = httpx.post(f"{server.host}/api/chat", json={"model": "phi3", "messages": messages}).text.splitlines()
+            chunks = [json.loads(line) for line in lines]
+            self.assertTrue(chunks[-1]["done"])
+            self.assertIn("💊 Type:", "".join(c["message"]["content"] for c in chunks))
+
+            embedded = httpx.post(f"{server.host}/api/embed", json={"model": "nomic-embed-text", "input": ["a", "b"]}).json()
+            self.assertEqual(len(embedded["embeddings"]), 2)
+
+    def test_compare_flags_slowdowns_over_the_threshold(self):
+        row = {"scale": 10_000, "case": "search/exact", "p50_ms": 1.0, "p99_ms": 2.0, "peak_alloc_kb": 10.0}
+        baseline = {
+            "meta": {"commit": "abc"},
+            "results": [{**row, "p99_ms": 1.0}, {**row, "case": "search/typo"}],
+        }
+        out = io.StringIO()
+        command = BenchmarkCommand(stdout=out)
+        command._compare([row, {**row, "case": "search/typo"}, {**row, "case": "new"}], baseline, "old.json", 0.10)
+        self.assertIn("p99_ms 1.00 -> 2.00 (+100%)", out.getvalue())
+        self.assertIn("1 cases regressed by more than 10%.", out.getvalue())
+
+    def test_search_phase_from_the_agent_log(self):
+        self.assertEqual(BenchmarkCommand._search_phase(" TokenSet matched: x", {}), "tokenset")
+        self.assertEqual(BenchmarkCommand._search_phase("", {"Name": "x"}), "found")
+        self.assertEqual(BenchmarkCommand._search_phase("", None), "none")
+
+    def test_unknown_scale(self):
+        with self.assertRaisesMessage(CommandError, "unknown scale '2m'"):
+            call_command("benchmark_pipeline", scales="10k,2m")
+
+
+@override_settings(METRICS_TOKEN=None, DEBUG=False, INTERNAL_IPS=["127.0.0.1"])
+class MetricsViewTests(SimpleTestCase):
+    def test_internal_clients_only_without_a_token(self):
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"# TYPE", response.content)
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7").status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_token_required_once_set(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        self.assertEqual(self.client.get(reverse("metrics"), headers={"authorization": "Bearer wrong"}).status_code, 401)
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7", headers={"authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+
+
+class StageSchedulerTests(SimpleTestCase):
+    text = "Crocin Advance 500mg Tablet\nParacetamol IP 500 mg\nMFG 05/2024\nEXP 04/2027\nMRP Rs. 45.50"
+    llm_result = {"Name": "Crocin Advance", "MFG Date": "05/2024", "Expiry Date": "04/2027", "MRP": "Rs. 45.50", "Is Expired": False}
+
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.agent = make_search_agent(NameIndexTests.names)
+        self.enterContext(mock.patch.object(search_agent, "search_agent_instance", self.agent))
+
+    def test_speculate_on_the_leading_lines(self):
+        record, name, score = self.agent.speculate(self.text)
+        self.assertEqual((record["Name"], name), ("Crocin Advance 500mg Tablet", "Crocin Advance 500mg Tablet"))
+        self.assertGreaterEqual(score, 85)
+        # A bare brand finds a variant, but doesn't match it closely enough to skip the LLM.
+        self.assertIsNone(self.agent.speculate("Crocin\nMFG 05/2024"))
+        self.assertIsNone(self.agent.speculate("xyzzy plugh\nMFG 05/2024"))
+
+    def test_confident_hit_does_not_wait_for_the_extraction_llm(self):
+        release = threading.Event()
+        extraction = mock.Mock(side_effect=lambda text: release.wait(5) and self.llm_result)
+        try:
+            with mock.patch("medicinebot.scheduler.run_extraction_agent", extraction), \
+                    mock.patch("medicinebot.scheduler.run_search_agent") as search:
+                extracted, record = scheduler.extract_and_search(self.text)
+                self.assertFalse(release.is_set())
+        finally:
+            release.set()
+        self.assertEqual(record["Name"], "Crocin Advance 500mg Tablet")
+        self.assertEqual((extracted["Name"], extracted["Expiry Date"], extracted["MRP"]), (record["Name"], "04/2027", "₹45.50"))
+        search.assert_not_called()
+
+    def test_hit_without_parsed_fields_waits_for_the_extraction(self):
+        text = "Crocin Advance 500mg Tablet\nBatch B123"
+        with mock.patch("medicinebot.scheduler.run_extraction_agent", return_value=self.llm_result), \
+                mock.patch("medicinebot.scheduler.run_search_agent") as search:
+            extracted, record = scheduler.extract_and_search(text)
+        self.assertEqual(extracted, dict(self.llm_result, Name="Crocin Advance 500mg Tablet"))
+        self.assertEqual(record["Name"], "Crocin Advance 500mg Tablet")
+        search.assert_not_called()
+
+    def test_no_hit_searches_the_extracted_name(self):
+        for enabled in (True, False):
+            with self.subTest(speculation=enabled), self.settings(SPECULATIVE_SEARCH=enabled), \
+                    mock.patch("medicinebot.scheduler.run_extraction_agent", return_value=self.llm_result), \
+                    mock.patch("medicinebot.scheduler.run_search_agent", return_value={"Name": "found"}) as search:
+                extracted, record = scheduler.extract_and_search("xyzzy plugh\nMFG 05/2024")
+                self.assertEqual((extracted, record), (self.llm_result, {"Name": "found"}))
+                search.assert_called_once_with("Crocin Advance")
+
+    async def test_async_skipped_extraction_is_cancelled(self):
+        started, cancelled = asyncio.Event(), asyncio.Event()
+
+        async def extraction(text):
+            started.set()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with mock.patch("medicinebot.scheduler.arun_extraction_agent", extraction):
+            extracted, record = await scheduler.aextract_and_search(self.text)
+            await asyncio.wait_for(cancelled.wait(), 5)
+        self.assertTrue(started.is_set())
+        self.assertEqual((extracted["Name"], record["Name"]), ("Crocin Advance 500mg Tablet",) * 2)
+
+
+class DatabaseCatalogueTests(TestCase):
+    names = SearchManyTests.names + ["Calpol 250mg Syrup", "Azee 500 Tablet", "Pantop 40 Tablet", "Dolopar Tablet"]
+
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name, "medicines.csv")
+        self.sync(self.names)
+
+    def sync(self, names, eans=None):
+        eans = eans or [f"{8901000000000 + i}" for i in range(len(names))]
+        rows = [f'"{name}",Allopathy,Fever,Paracetamol,Nausea,{ean}' for name, ean in zip(names, eans)]
+        self.path.write_text("Name,Type ,Uses,Content,Side Effects,EAN\n" + "\n".join(rows) + "\n", encoding="utf-8")
+        out = io.StringIO()
+        call_command("sync_medicines", source=str(self.path), batch_size=4, stdout=out)
+        return out.getvalue()
+
+    def fts_names(self, term):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT name FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid", [f'"{term}"'])
+            return [name for (name,) in cursor.fetchall()]
+
+    def test_sync_is_incremental_and_triggers_keep_the_index_current(self):
+        self.assertTrue(fts_available())
+        self.assertEqual(Medicine.objects.count(), len(self.names))
+        self.assertEqual(self.fts_names("crocin"), ["Crocin Advance 500mg Tablet", "Crocin Pain Relief", "Crocin Cold and Flu Tablet"])
+        self.assertIn("0 added, 0 updated, 0 removed", self.sync(self.names))
+
+        names = ["Crocin Plus Tablet"] + self.names[1:-1]
+        eans = ["8901571007356"] + [f"{8901000000000 + i}" for i in range(1, len(names))]
+        self.assertIn("0 added, 1 updated, 1 removed", self.sync(names, eans))
+        self.assertEqual(self.fts_names("crocin")[0], "Crocin Plus Tablet")
+        self.assertEqual(self.fts_names("dolopar"), [])
+        self.assertEqual(Medicine.objects.get(row=0).medicine_type, "Allopathy")
+        self.assertEqual(DatabaseCatalogue().find_ean("8901571007356")["Name"], "Crocin Plus Tablet")
+        self.assertIsNone(DatabaseCatalogue().find_ean("8901000000000"))
+
+    def test_candidates(self):
+        catalogue = DatabaseCatalogue()
+        self.assertEqual(catalogue.size, len(self.names))
+        self.assertEqual(len(catalogue.candidates("anything", limit=100)), len(self.names))
+        # Every word indexed: the names with all of them.
+        self.assertEqual(catalogue.candidates("crocin tablet", limit=3), ["Crocin Advance 500mg Tablet", "Crocin Cold and Flu Tablet"])
+        # A typo: the names sharing its rarest trigrams.
+        self.assertIn("Azithral 500 Tablet", catalogue.candidates("azitral", limit=3))
+        self.assertEqual(catalogue.candidates("x1 -", limit=3), [])
+
+    def test_records(self):
+        catalogue = DatabaseCatalogue()
+        record = catalogue.find_name("Dolo 650 Tablet")
+        self.assertEqual(record, {
+            "Name": "Dolo 650 Tablet", "Type ": "Allopathy", "Uses": "Fever", "Content": "Paracetamol",
+            "Side Effects": "Nausea", "EAN": "8901000000001",
+        })
+        self.assertEqual(catalogue.find_ean("08901000000001"), record)
+        self.assertIsNone(catalogue.find_name("Dolo"))
+        self.assertIsNone(catalogue.find_ean("not a code"))
+
+    def test_search_matches_the_memory_backend(self):
+        memory = make_search_agent(self.names, SEARCH_SHORTLIST_SIZE=3)
+        with override_settings(SEARCH_BACKEND="database", SEARCH_SHORTLIST_SIZE=3, VECTOR_INDEX_PATH=None):
+            database = SearchAgent()
+        for query in SearchManyTests.queries + ["pantop 40", "calpol syrup"]:
+            with self.subTest(query=query):
+                expected, _ = memory._search(query)
+                record, _ = database._search(query)
+                self.assertEqual(record and record["Name"], expected and expected["Name"])
+
+    def test_autocomplete_from_the_fts_index(self):
+        memory = make_search_agent(self.names)
+        with override_settings(SEARCH_BACKEND="database", VECTOR_INDEX_PATH=None):
+            database = SearchAgent()
+        for query in ("cro", "crocin adv", "dolo 6", "pan 40", "azithral", "azitral", "calpl syrup"):
+            with self.subTest(query=query):
+                self.assertEqual(database.autocomplete(query), memory.autocomplete(query))
+        self.assertEqual(database.autocomplete("x"), [])
+
+    def test_empty_table_is_not_served(self):
+        Medicine.objects.all().delete()
+        self.assertIsNone(load_database_catalogue())
+        self.assertEqual(self.fts_names("crocin"), [])
+
+
+class AutocompleteTests(SimpleTestCase):
+    names = SearchManyTests.names + ["Crocin Advance 500mg Tablet", "Azee 500 Tablet"]
+
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.agent = make_search_agent(self.names)
+
+    def complete(self, query, limit=8):
+        return [s["name"] for s in self.agent.autocomplete(query, limit)]
+
+    def test_prefix_completions_shortest_first(self):
+        self.assertEqual(self.complete("cro"), ["Crocin Pain Relief", "Crocin Cold and Flu Tablet", "Crocin Advance 500mg Tablet"])
+        self.assertEqual(self.complete("cro", limit=1), ["Crocin Pain Relief"])
+        # Later words narrow the first one's names down; the duplicate name is listed once.
+        self.assertEqual(self.complete("crocin adv"), ["Crocin Advance 500mg Tablet"])
+        self.assertEqual(self.complete("Crocin Advance 500mg Tablet"), ["Crocin Advance 500mg Tablet"])
+
+    def test_names_starting_with_the_query_first(self):
+        self.assertEqual(self.complete("500 az"), ["Azee 500 Tablet", "Azithral 500 Tablet"])
+        self.assertEqual(self.complete("tablet pan")[:2], ["Pan 40 Tablet", "Pantocid 40 Tablet"])
+
+    def test_typos(self):
+        self.assertEqual(self.complete("azitral"), ["Azithral 500 Tablet"])
+        self.assertEqual(self.complete("crocni advance "), ["Crocin Advance 500mg Tablet"])
+        # Too short to correct, and a word past the edit budget doesn't blank the others' list.
+        self.assertEqual(self.complete("xyz"), [])
+        self.assertEqual(self.complete("dolo xyzzyq"), ["Dolo 650 Tablet"])
+
+    def test_eans(self):
+        suggestion = self.agent.autocomplete("dolo 6")[0]
+        self.assertEqual(suggestion, {"name": "Dolo 650 Tablet", "eans": ["8901000000001"]})
+        self.assertEqual(display_ean("00000096385074"), "96385074")
+        self.assertEqual(display_ean("00036000291452"), "036000291452")
+
+
+
+@override_settings(AUTOCOMPLETE_MIN_CHARS=2)
+class AutocompleteViewTests(TestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.enterContext(mock.patch("medicinebot.views.search_agent_instance", make_search_agent(AutocompleteTests.names)))
+        self.url = reverse("autocomplete")
+
+    def test_login_required(self):
+        self.assertEqual(self.client.get(self.url, {"q": "cro"}).status_code, 302)
+
+    def test_suggestions(self):
+        self.client.force_login(User.objects.create_user("user"))
+        response = self.client.get(self.url, {"q": "cro", "limit": "2"})
+        self.assertEqual(
+            [s["name"] for s in response.json()["results"]], ["Crocin Pain Relief", "Crocin Cold and Flu Tablet"]
+        )
+        self.assertIn("max-age=300", response["Cache-Control"])
+        self.assertEqual(len(self.client.get(self.url, {"q": "tab", "limit": "500"}).json()["results"]), 9)
+        # AUTOCOMPLETE_LIMIT
+        self.assertEqual(len(self.client.get(self.url, {"q": "tab", "limit": "x"}).json()["results"]), 8)
+        self.assertEqual(self.client.get(self.url, {"q": "c "}).json(), {"query": "c ", "results": []})
@@ -0,0 +1,328 @@
+# medicinebot/tracing.py
+
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+trace_logger = logging.getLogger("medicinebot.trace")
+
+# Seconds: from a cache hit (~0.1 ms) to a slow phi3 summary.
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Only requests at least this slow get a trace log line (milliseconds).
+TRACE_LOG_MIN_MS = 1000
+
+
+# ----------------------------------------------------------------------
+# Metrics (Prometheus text format, per process)
+# ----------------------------------------------------------------------
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    """Fixed buckets; ``observe`` is a bisect and three additions under a lock."""
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((values, list(series)) for values, series in self._series.items())
+        for values, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = _label_text(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_text(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+span_seconds = Histogram("medguard_span_seconds", "Time spent in each agent / pipeline stage.", ["span"])
+span_errors = Counter("medguard_span_errors_total", "Stages that raised.", ["span"])
+payload_bytes = Histogram("medguard_payload_bytes", "Size of stage inputs and outputs.", ["span", "kind"], BYTES_BUCKETS)
+cache_events = Counter("medguard_cache_total", "Result cache lookups.", ["cache", "result"])
+search_phases = Counter("medguard_search_phase_total", "Which fuzzy search phase answered a name search.", ["phase"])
+request_seconds = Histogram("medguard_request_seconds", "Time to the response, per view.", ["view", "method"])
+
+METRICS = [span_seconds, span_errors, payload_bytes, cache_events, search_phases, request_seconds]
+
+
+def _llm_lines():
+    from .agents.llm_gateway import llm_gateway
+
+    stats = llm_gateway.stats()
+    lines = []
+    for metric, kind, help in (
+        ("calls", "counter", "LLM calls completed."),
+        ("coalesced", "counter", "LLM calls answered by an identical in-flight call."),
+        ("errors", "counter", "LLM calls that failed."),
+        ("timeouts", "counter", "LLM calls that timed out or found no free slot."),
+        ("prompt_tokens", "counter", "Prompt tokens sent to the LLM."),
+        ("output_tokens", "counter", "Tokens generated by the LLM."),
+        ("in_flight", "gauge", "LLM calls running now."),
+    ):
+        name = f"medguard_llm_{metric}" + ("_total" if kind == "counter" else "")
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        lines += [f'{name}{{model="{model}"}} {values[metric]}' for model, values in sorted(stats.items())]
+    return lines
+
+
+def render_metrics():
+    """Every metric of this process in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.expose()
+    lines += _llm_lines()
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------------------------
+# Traces
+# ----------------------------------------------------------------------
+
+_current_trace = contextvars.ContextVar("medguard_trace", default=None)
+_current_span = contextvars.ContextVar("medguard_span", default=None)
+
+
+class Trace:
+    """The spans of one request, in start order. Shared by the threads / tasks it hands work to."""
+
+    __slots__ = ("id", "start", "spans")
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = []
+
+
+class Span:
+    __slots__ = ("name", "start", "seconds", "attrs", "error")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.error = None
+
+
+def _tracing_enabled():
+    return getattr(settings, "TRACING_ENABLED", True)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a stage: ``medguard_span_seconds{span=name}``, plus an entry in the
+    request's trace log when there is one. ``annotate`` adds to the
+    innermost open span.
+    """
+    if not _tracing_enabled():
+        yield None
+        return
+    current = Span(name, attrs)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        span_errors.inc(name)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.seconds = time.perf_counter() - current.start
+        span_seconds.observe(current.seconds, name)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append(current)
+
+
+def annotate(**attrs):
+    """
+    Attributes for the current span. ``*_bytes`` values also feed
+    ``medguard_payload_bytes``, ``phase`` feeds ``medguard_search_phase_total``.
+    """
+    current = _current_span.get()
+    if current is None:
+        return
+    current.attrs.update(attrs)
+    _observe_attrs(current.name, attrs)
+
+
+def _observe_attrs(name, attrs):
+    for key, value in attrs.items():
+        if key.endswith("_bytes") and value is not None:
+            payload_bytes.observe(value, name, key)
+    if "phase" in attrs:
+        search_phases.inc(attrs["phase"])
+
+
+def record(name, seconds, **attrs):
+    """
+    A finished span timed by the caller. For async generators, which can't
+    hold ``span`` open across their yields.
+    """
+    if not _tracing_enabled():
+        return
+    span_seconds.observe(seconds, name)
+    _observe_attrs(name, attrs)
+    trace = _current_trace.get()
+    if trace is not None:
+        finished = Span(name, attrs)
+        finished.start -= seconds
+        finished.seconds = seconds
+        trace.spans.append(finished)
+
+
+def cache_event(cache, hit):
+    """A result cache lookup (counted, and noted on the current span)."""
+    result = "hit" if hit else "miss"
+    cache_events.inc(cache, result)
+    current = _current_span.get()
+    if current is not None:
+        current.attrs[f"cache.{cache}"] = result
+
+
+def traced(name):
+    """Decorator: run the (sync or async) function inside ``span(name)``."""
+
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            raise TypeError("traced() does not support async generators; use span() inside them")
+
+        if iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with span(name):
+                    return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def upload_size(image_file):
+    return getattr(image_file, "size", None)
+
+
+def _log_trace(trace, request, response):
+    total_ms = (time.perf_counter() - trace.start) * 1000
+    if not trace.spans or total_ms < getattr(settings, "TRACE_LOG_MIN_MS", TRACE_LOG_MIN_MS):
+        return
+    trace_logger.info(json.dumps({
+        "trace_id": trace.id,
+        "method": request.method,
+        "path": request.path,
+        "status": getattr(response, "status_code", None),
+        "total_ms": round(total_ms, 2),
+        "spans": [
+            {
+                "name": s.name,
+                "start_ms": round((s.start - trace.start) * 1000, 2),
+                "ms": round(s.seconds * 1000, 2),
+                **({"error": s.error} if s.error else {}),
+                **s.attrs,
+            }
+            for s in trace.spans
+        ],
+    }, default=str))
+
+
+def _finish(trace, token, request, response, start):
+    _current_trace.reset(token)
+    match = getattr(request, "resolver_match", None)
+    view = match.view_name if match else "unmatched"
+    request_seconds.observe(time.perf_counter() - start, view, request.method)
+    if response is not None and trace.spans:
+        response["X-Trace-Id"] = trace.id
+    if getattr(settings, "TRACE_LOG", True):
+        _log_trace(trace, request, response)
+
+
+@sync_and_async_middleware
+def trace_middleware(get_response):
+    """
+    One trace per request: agent / stage spans opened while it runs are
+    collected and written as a single JSON line to the ``medicinebot.trace``
+    logger (only requests that ran at least one span).
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not _tracing_enabled():
+                return await get_response(request)
+            trace, start, response = Trace(), time.perf_counter(), None
+            token = _current_trace.set(trace)
+            try:
+                response = await get_response(request)
+                return response
+            finally:
+                _finish(trace, token, request, response, start)
+    else:
+        def middleware(request):
+            if not _tracing_enabled():
+                return get_response(request)
+            trace, start, response = Trace(), time.perf_counter(), None
+            token = _current_trace.set(trace)
+            try:
+                response = get_response(request)
+                return response
+            finally:
+                _finish(trace, token, request, response, start)
+    return middleware
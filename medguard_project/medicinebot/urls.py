@@ -1,11 +1,29 @@
 # medicinebot/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     # This one path handles both showing the home page and processing the form
-    path('', views.home_view, name='home'), # <-- This name is now corrected
+    path('', views.home_view_async if settings.MEDGUARD_ASYNC_PIPELINE else views.home_view, name='home'), # <-- This name is now corrected
     
+    # Analysis job progress (when ANALYSIS_JOB_QUEUE is on)
+    path('jobs/<int:job_id>/', views.job_status_view, name='job_status'),
+    path('jobs/<int:job_id>/events/', views.job_events_view, name='job_events'),
+
+    # Type-ahead suggestions for the search box
+    path('api/autocomplete/', views.autocomplete_view, name='autocomplete'),
+
+    # Prometheus metrics of this process
+    path('metrics', views.metrics_view, name='metrics'),
+
+    # Summary streamed into the page (async pipeline, SUMMARY_STREAMING)
+    path('summary/<str:token>/events/', views.summary_stream_view, name='summary_stream'),
+
+    # Uploaded images (content-addressed blob store)
+    path('images/<str:sha256>/', views.image_blob_view, name='image_blob'),
+    path('images/<str:sha256>/thumb/', views.image_thumbnail_view, name='image_thumbnail'),
+
     # Auth paths
     path('login/', views.login_view, name='login'),
     path('signup/', views.signup_view, name='signup'),
@@ -13,6 +31,9 @@ urlpatterns = [
     
     # Account/History path
     path('account/', views.account_view, name='account'), # <-- This name is now corrected
+    path('account/history/<int:pk>/', views.history_detail_view, name='history_detail'),
+    path('api/history/', views.history_api_view, name='history_api'),
+    path('api/history/<int:pk>/', views.history_detail_json_view, name='history_detail_json'),
 
 ]
 
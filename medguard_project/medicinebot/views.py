@@ -1,5 +1,15 @@
-import base64
-from django.shortcuts import render, redirect
+import asyncio
+import hmac
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_safe
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.decorators import login_required
@@ -7,12 +17,17 @@ from django.contrib import messages
 
 # Local imports
 from .forms import ImageUploadForm, NewUserForm
-from .models import History
+from .models import AnalysisJob, History, ImageBlob
 from .agents.barcode_agent import run_barcode_agent
 from .agents.ocr_agent import run_ocr_agent
-from .agents.extraction_agent import run_extraction_agent
-from .agents.search_agent import run_search_agent
-from .agents.summary_agent import run_summary_agent
+from .agents.search_agent import run_search_agent, search_agent_instance
+from .agents.summary_agent import run_summary_agent, summary_agent_instance
+from .blobstore import get_blob_store, image_key, thumbnail_key
+from .history import InvalidCursor, history_item_json, history_page
+from .jobs import aenqueue_analysis, enqueue_analysis
+from .pipeline import AnalysisError, run_analysis_pipeline
+from .scheduler import extract_and_search, start_image_store
+from .tracing import render_metrics, span
 
 
 @login_required
@@ -30,12 +45,20 @@ def home_view(request):
             packaging_image = form.cleaned_data.get('packaging_image')
             barcode_image = form.cleaned_data.get('barcode_image')
 
-            image_data_url = None
+            if settings.ANALYSIS_JOB_QUEUE:
+                # Hand the analysis to `run_analysis_worker`; the page follows its progress.
+                context['job'] = enqueue_analysis(request.user, search_query_input, packaging_image, barcode_image)
+                context.update(_job_urls(context['job']))
+                return render(request, 'medicinebot/home.html', context)
+
+            image_store = None
             analysis_summary = None
             final_search_query_for_history = None
             is_barcode_search = False
             search_query_for_agents = None
             extracted_data = {}
+            search_results = None
+            searched = False
 
             try:
                 # --- NEW 3-PATH LOGIC ---
@@ -44,17 +67,13 @@ def home_view(request):
                     # --- PATH A: BARCODE IMAGE UPLOADED (Exact Match) ---
                     is_barcode_search = True
                     
-                    # 1. Prepare image for display
+                    # 1. Run BARCODE AGENT ONLY
                     image_file = barcode_image
-                    image_file.seek(0)
-                    image_bytes = image_file.read()
-                    image_data_url = f"data:{image_file.content_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-                    image_file.seek(0) 
-
-                    # 2. Run BARCODE AGENT ONLY
                     barcode_data = run_barcode_agent(image_file)
                     
                     if barcode_data:
+                        # 2. Keep the image for display (stored while search and summary run)
+                        image_store = start_image_store(image_file)
                         search_query_for_agents = barcode_data
                         final_search_query_for_history = f"Barcode Scan: {barcode_data}"
                         extracted_data = {
@@ -70,20 +89,19 @@ def home_view(request):
                     # --- PATH B: PACKAGING IMAGE UPLOADED (OCR/Fuzzy Match) ---
                     is_barcode_search = False
 
-                    # 1. Prepare image for display
+                    # 1. Run OCR/EXTRACTION AGENTS ONLY
                     image_file = packaging_image
-                    image_file.seek(0)
-                    image_bytes = image_file.read()
-                    image_data_url = f"data:{image_file.content_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
-                    image_file.seek(0)
-
-                    # 2. Run OCR/EXTRACTION AGENTS ONLY
                     raw_text = run_ocr_agent(image_file)
                     if not raw_text:
                         messages.error(request, 'OCR failed. Could not read text from image. Please use a clearer picture.')
                         return render(request, 'medicinebot/home.html', context)
 
-                    extracted_data = run_extraction_agent(raw_text)
+                    # 2. Keep the image for display (stored while the other agents run)
+                    image_store = start_image_store(image_file)
+
+                    # 3. Extraction, with the leading OCR lines searched meanwhile
+                    extracted_data, search_results = extract_and_search(raw_text)
+                    searched = True
                     search_query_for_agents = extracted_data.get('Name', raw_text)
                     final_search_query_for_history = extracted_data.get('Name', raw_text).strip()
 
@@ -106,24 +124,30 @@ def home_view(request):
                 # --- Run common agents (Search and Summary) ---
                 
                 # is_barcode_search flag is now correctly set by the logic above
-                search_results = run_search_agent(search_query_for_agents, is_barcode=is_barcode_search)
+                # (an OCR'd package has been searched along with the extraction)
+                if not searched:
+                    search_results = run_search_agent(search_query_for_agents, is_barcode=is_barcode_search)
                 
                 analysis_summary = run_summary_agent(search_results, extracted_data, is_barcode=is_barcode_search)
 
+                # --- The image (deduplicated, with a thumbnail) ---
+                image = image_store.result() if image_store else None
+
                 # --- Save to History ---
                 if final_search_query_for_history or analysis_summary:
-                    History.objects.create(
-                        user=request.user,
-                        search_query=final_search_query_for_history,
-                        analysis_summary=analysis_summary,
-                        image_data_url=image_data_url
-                    )
+                    with span('history.insert'):
+                        History.objects.create(
+                            user=request.user,
+                            search_query=final_search_query_for_history,
+                            analysis_summary=analysis_summary,
+                            image=image
+                        )
                 else:
                     messages.warning(request, "Search did not yield results to save.")
 
                 # Pass results to the template
                 context['analysis_summary'] = analysis_summary
-                context['image_data_url'] = image_data_url
+                context['image_url'] = image.url if image else None
 
             except Exception as e:
                 messages.error(request, f"An unexpected error occurred during analysis: {e}")
@@ -138,6 +162,335 @@ def home_view(request):
     return render(request, 'medicinebot/home.html', context)
 
 
+@login_required
+async def home_view_async(request):
+    """
+    ASGI version of ``home_view``: same form and template, but the analysis
+    runs through the async pipeline, so a request waiting on Vision/Ollama
+    holds no worker thread.
+    """
+    context = {'form': ImageUploadForm()} # Start with a fresh form
+
+    if request.method == 'POST':
+        form = ImageUploadForm(request.POST, request.FILES)
+        # ImageField validation decodes the upload with Pillow.
+        if await asyncio.to_thread(form.is_valid):
+            if settings.ANALYSIS_JOB_QUEUE:
+                context['job'] = await aenqueue_analysis(
+                    await request.auser(),
+                    search_query=form.cleaned_data.get('search_query'),
+                    packaging_image=form.cleaned_data.get('packaging_image'),
+                    barcode_image=form.cleaned_data.get('barcode_image'),
+                )
+                context.update(_job_urls(context['job']))
+                return await sync_to_async(render)(request, 'medicinebot/home.html', context)
+
+            try:
+                result = await run_analysis_pipeline(
+                    await request.auser(),
+                    search_query=form.cleaned_data.get('search_query'),
+                    packaging_image=form.cleaned_data.get('packaging_image'),
+                    barcode_image=form.cleaned_data.get('barcode_image'),
+                    stream_summary=settings.SUMMARY_STREAMING,
+                )
+                if not result['saved']:
+                    messages.warning(request, "Search did not yield results to save.")
+
+                # Pass results to the template
+                context['analysis_summary'] = result['analysis_summary']
+                context['image_url'] = result['image_url']
+                context['form'] = form
+                if result['summary_stream']:
+                    # Written now, not when (or if) the page opens the stream.
+                    start_summary(result['summary_stream'])
+                    context['summary_stream_url'] = _summary_stream_url(result['summary_stream']['history'])
+
+            except AnalysisError as e:
+                messages.error(request, str(e))
+            except Exception as e:
+                messages.error(request, f"An unexpected error occurred during analysis: {e}")
+                context['form'] = form
+        else:
+            context['form'] = form
+            messages.error(request, 'Please correct the errors below.')
+
+    # Context processors may hit the database (request.user), so render in a thread.
+    return await sync_to_async(render)(request, 'medicinebot/home.html', context)
+
+
+# ----------------------------------------------------------------------
+# --- ANALYSIS JOB PROGRESS ---------------------------------------------
+# ----------------------------------------------------------------------
+
+def _job_urls(job):
+    urls = {'job_status_url': reverse('job_status', args=[job.pk])}
+    # Server-sent events need the ASGI server; under WSGI the page polls instead.
+    if settings.MEDGUARD_ASYNC_PIPELINE:
+        urls['job_events_url'] = reverse('job_events', args=[job.pk])
+    return urls
+
+
+def _job_payload(job):
+    payload = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'stage': job.stage,
+        'error': job.error,
+    }
+    if job.status == AnalysisJob.STATUS_DONE:
+        payload['analysis_summary'] = job.analysis_summary
+        image = job.history.image if job.history else None
+        payload['image_url'] = image.url if image else None
+    return payload
+
+
+@login_required
+def job_status_view(request, job_id):
+    """
+    Polling endpoint: current status/stage of one of the user's analysis jobs.
+    """
+    job = get_object_or_404(
+        AnalysisJob.objects.select_related('history__image').defer('image_data', 'history__image_data_url'), pk=job_id, user=request.user
+    )
+    return JsonResponse(_job_payload(job))
+
+
+@login_required
+async def job_events_view(request, job_id):
+    """
+    Server-sent events: one `progress` event per status/stage change, then
+    a final `done` event with the result.
+    """
+    user = await request.auser()
+    jobs = AnalysisJob.objects.select_related('history__image').defer('image_data', 'history__image_data_url').filter(pk=job_id, user=user)
+    if not await jobs.aexists():
+        raise Http404("No such analysis job.")
+
+    interval = getattr(settings, 'ANALYSIS_JOB_EVENT_INTERVAL', 0.5)
+
+    async def events():
+        last = None
+        while True:
+            job = await jobs.aget()
+            payload = _job_payload(job)
+            finished = job.status in (AnalysisJob.STATUS_DONE, AnalysisJob.STATUS_FAILED)
+            if (job.status, job.stage) != last or finished:
+                last = (job.status, job.stage)
+                event = 'done' if finished else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(interval)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ----------------------------------------------------------------------
+# --- STREAMED SUMMARIES ------------------------------------------------
+# ----------------------------------------------------------------------
+
+SUMMARY_STREAM_SALT = 'medicinebot.summary_stream'
+
+# Summaries being written by this process, by History id: the events so
+# far and the queues of the streams following them. A reconnecting
+# EventSource (or a second tab) joins the running generation.
+_summary_runs = {}
+
+
+def _summary_stream_url(history_id):
+    # Only the History id travels (signed): the stream reads the summary, it never starts one.
+    token = signing.dumps(history_id, salt=SUMMARY_STREAM_SALT)
+    return reverse('summary_stream', args=[token])
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def start_summary(summary_stream):
+    """
+    Write the summary of a just-saved History row in the background, from
+    the request that saved it, so it is finished and stored whether or not
+    a browser ever opens the stream.
+    """
+    run = {'events': [], 'listeners': []}
+    _summary_runs[summary_stream['history']] = run
+    run['task'] = asyncio.create_task(_write_summary(dict(summary_stream), run))
+    return run['task']
+
+
+async def _write_summary(stream_args, run):
+    """Runs the summary stream, fanning its events out to ``run``'s listeners, and saves the result to History."""
+    history_id = stream_args.pop('history')
+
+    def publish(item):
+        if item is not None:
+            run['events'].append(item)
+        for queue in run['listeners']:
+            queue.put_nowait(item)
+
+    summary_html = None
+    try:
+        async for event, data in summary_agent_instance.astream_summary(**stream_args):
+            if event == 'done':
+                summary_html = data
+            publish((event, data))
+        if summary_html:
+            await History.objects.filter(pk=history_id).aupdate(analysis_summary=summary_html)
+    except Exception as e:
+        print(f"Summary stream ERROR: {e}")
+        publish(('error', f"An unexpected error occurred during analysis: {e}"))
+    finally:
+        _summary_runs.pop(history_id, None)
+        publish(None)
+
+
+@login_required
+async def summary_stream_view(request, token):
+    """
+    Server-sent events for a summary started by ``home_view_async``:
+    `chunk` (a finished paragraph, html), `partial` (the line being
+    written, text), then `done` with the full summary, or `error`.
+
+    Follows the generation when it runs in this process; otherwise (another
+    worker wrote it, or is still writing it) the History row is polled.
+    """
+    max_age = getattr(settings, 'SUMMARY_STREAM_MAX_AGE', 600)
+    try:
+        history_id = signing.loads(token, salt=SUMMARY_STREAM_SALT, max_age=max_age)
+    except signing.BadSignature:
+        raise Http404("No such summary.")
+
+    user = await request.auser()
+    history = History.objects.filter(pk=history_id, user=user).only('analysis_summary')
+    entry = await history.afirst()
+    if entry is None:
+        raise Http404("No such summary.")
+
+    async def follow(run):
+        queue = asyncio.Queue()
+        # Replay and subscribe in one step (no await in between): nothing is missed.
+        for item in run['events']:
+            queue.put_nowait(item)
+        run['listeners'].append(queue)
+        try:
+            while (item := await queue.get()) is not None:
+                yield _sse(*item)
+        finally:
+            run['listeners'].remove(queue)
+
+    async def poll():
+        interval = getattr(settings, 'SUMMARY_STREAM_POLL_INTERVAL', 1.0)
+        deadline = asyncio.get_running_loop().time() + max_age
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(interval)
+            done = await history.afirst()
+            if done is not None and done.analysis_summary:
+                yield _sse('done', done.analysis_summary)
+                return
+        yield _sse('error', 'The summary is taking too long. It will appear in your history once written.')
+
+    async def events():
+        if entry.analysis_summary:
+            yield _sse('done', entry.analysis_summary)
+            return
+        run = _summary_runs.get(history_id)
+        async for event in (follow(run) if run is not None else poll()):
+            yield event
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ----------------------------------------------------------------------
+# --- METRICS -----------------------------------------------------------
+# ----------------------------------------------------------------------
+
+@require_safe
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint (this process's metrics). With METRICS_TOKEN
+    set it needs `Authorization: Bearer <token>`; without one it is only
+    served in DEBUG or to clients in INTERNAL_IPS.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG and request.META.get('REMOTE_ADDR') not in getattr(settings, 'INTERNAL_IPS', ()):
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@require_safe
+def autocomplete_view(request):
+    """
+    Type-ahead for the search box:
+    ``?q=<typed text>&limit=<n>`` -> ``{"query": ..., "results": [{"name": ..., "eans": [...]}]}``.
+    """
+    query = request.GET.get('q', '')[:getattr(settings, 'AUTOCOMPLETE_MAX_QUERY_LENGTH', 100)]
+    try:
+        limit = max(1, min(int(request.GET['limit']), 20))
+    except (KeyError, ValueError):
+        limit = None  # AUTOCOMPLETE_LIMIT
+    results = []
+    if len(query.strip()) >= getattr(settings, 'AUTOCOMPLETE_MIN_CHARS', 2):
+        results = search_agent_instance.autocomplete(query, limit)
+    response = JsonResponse({'query': query, 'results': results})
+    # The same prefix comes back as the user edits; let the browser answer it.
+    patch_cache_control(response, private=True, max_age=300)
+    return response
+
+
+# ----------------------------------------------------------------------
+# --- IMAGE BLOBS -------------------------------------------------------
+# ----------------------------------------------------------------------
+
+def _serve_blob(request, sha256, key, content_type):
+    # Only the users whose history contains the image may fetch it.
+    if not History.objects.filter(user=request.user, image__sha256=sha256).exists():
+        raise Http404("No such image.")
+
+    # Content-addressed: a key never changes, so browsers may cache it forever.
+    etag = f'"{key.replace("/", "-")}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponseNotModified()
+    else:
+        data = get_blob_store().get(key)
+        if data is None:
+            raise Http404("Image missing from the blob store.")
+        response = HttpResponse(data, content_type=content_type)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=31536000, immutable=True)
+    return response
+
+
+@require_safe
+@login_required
+def image_blob_view(request, sha256):
+    """
+    Full-size uploaded image.
+    """
+    blob = get_object_or_404(ImageBlob, sha256=sha256)
+    return _serve_blob(request, sha256, image_key(sha256), blob.content_type)
+
+
+@require_safe
+@login_required
+def image_thumbnail_view(request, sha256):
+    """
+    Small WebP preview used by the history page.
+    """
+    return _serve_blob(request, sha256, thumbnail_key(sha256), 'image/webp')
+
+
 # ----------------------------------------------------------------------
 # --- AUTHENTICATION VIEWS (Unchanged) ---------------------------------
 # ----------------------------------------------------------------------
@@ -146,15 +499,61 @@ def home_view(request):
 @login_required
 def account_view(request):
     """
-    Displays the user's search history.
+    Displays the first page of the user's search history; the rest is
+    loaded from history_api_view as the user scrolls.
     """
-    history_list = History.objects.filter(user=request.user).order_by('-timestamp')
+    try:
+        history_list, next_cursor = history_page(request.user, request.GET.get('cursor'))
+    except InvalidCursor:
+        history_list, next_cursor = history_page(request.user)
     context = {
-        'history_list': history_list
+        'history_list': history_list,
+        'next_cursor': next_cursor,
     }
     return render(request, 'medicinebot/account-history.html', context)
 
 
+@login_required
+def history_api_view(request):
+    """
+    JSON page of the user's history for infinite scroll:
+    ``?cursor=<next_cursor>&limit=<n>`` -> ``{"results": [...], "next_cursor": ...}``.
+    """
+    try:
+        items, next_cursor = history_page(request.user, request.GET.get('cursor'), request.GET.get('limit'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+    return JsonResponse({
+        'results': [history_item_json(item) for item in items],
+        'next_cursor': next_cursor,
+    })
+
+
+def _history_item(request, pk):
+    return get_object_or_404(
+        History.objects.select_related('image').defer('image_data_url'), pk=pk, user=request.user
+    )
+
+
+@login_required
+def history_detail_view(request, pk):
+    """
+    One history entry with its full analysis summary.
+    """
+    return render(request, 'medicinebot/history-detail.html', {'item': _history_item(request, pk)})
+
+
+@login_required
+def history_detail_json_view(request, pk):
+    """
+    The heavy columns of one history entry, fetched when a card is expanded.
+    """
+    item = _history_item(request, pk)
+    payload = history_item_json(item)
+    payload['analysis_summary'] = item.analysis_summary
+    return JsonResponse(payload)
+
+
 def login_view(request):
     """
     Handles user login.
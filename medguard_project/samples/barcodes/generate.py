@@ -0,0 +1,162 @@
+"""
+Regenerates the barcode benchmark images in this folder (see the
+benchmark_barcodes management command): synthetic pack photos with one
+EAN-13 each, under the conditions that trip up a single zbar pass.
+
+    python samples/barcodes/generate.py
+"""
+import json
+import os
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+# EAN-13 digit patterns (1 = bar): left half odd (L) / even (G) parity, right half (R).
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+G_CODES = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+R_CODES = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+# Parity of the six left-half digits, chosen by the first (unprinted) digit.
+PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+# Text scattered around the code, as on a real strip.
+PACK_TEXT = [
+    "Paracetamol IP 500 mg", "Store below 25C", "MFG 05/2024", "EXP 04/2027",
+    "Keep out of reach of children", "Batch B1234", "MRP Rs 30.00",
+]
+BODIES = [
+    "890157100735", "890123456789", "890400012345", "890765432101", "890111122223", "890999888777",
+    "890246813579", "890135792468", "890555000111", "890707070707", "890321321321", "890654987321",
+]
+
+OUTPUT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Fixed seed: the same images every run.
+rng = random.Random(7)
+
+
+def check_digit(body):
+    total = sum(int(c) * (3 if i % 2 == 0 else 1) for i, c in enumerate(reversed(body)))
+    return str((10 - total % 10) % 10)
+
+
+def ean13(body):
+    """The full code for a 12-digit body, and its bar pattern."""
+    code = body + check_digit(body)
+    parity = PARITY[int(code[0])]
+    bits = "101"
+    for i, digit in enumerate(code[1:7]):
+        bits += (L_CODES if parity[i] == "L" else G_CODES)[int(digit)]
+    bits += "01010"
+    for digit in code[7:]:
+        bits += R_CODES[int(digit)]
+    bits += "101"
+    return code, bits
+
+
+def font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 has only the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def render(bits, code, module=4, height=220):
+    """The barcode with its quiet zone and the digits printed below."""
+    quiet = 10 * module
+    img = Image.new('L', (len(bits) * module + 2 * quiet, height + 40), 255)
+    draw = ImageDraw.Draw(img)
+    for i, bit in enumerate(bits):
+        if bit == "1":
+            draw.rectangle([quiet + i * module, 10, quiet + (i + 1) * module - 1, 10 + height], fill=0)
+    draw.text((quiet // 3, height + 10), code, fill=0, font=font(module * 7))
+    return img
+
+
+def scene(size, background=230):
+    """A plain pack surface with some printed text on it."""
+    img = Image.new('L', size, background)
+    draw = ImageDraw.Draw(img)
+    text_font = font(28)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.text((x, y), rng.choice(PACK_TEXT), fill=rng.randrange(40, 120), font=text_font)
+    return img
+
+
+def place(background, barcode, angle, center, scale=1.0):
+    barcode = barcode.resize((int(barcode.width * scale), int(barcode.height * scale)), Image.BILINEAR)
+    barcode = barcode.convert('RGBA').rotate(angle, expand=True, resample=Image.BICUBIC, fillcolor=(0, 0, 0, 0))
+    background = background.convert('RGBA')
+    background.alpha_composite(barcode, (int(center[0] - barcode.width / 2), int(center[1] - barcode.height / 2)))
+    return background.convert('L')
+
+
+def shade(img, strength=0.6):
+    """A light gradient across the photo, darkest in the bottom-left corner."""
+    a = np.asarray(img).astype(float)
+    h, w = a.shape
+    gradient = np.linspace(1 - strength, 1, w)[None, :] * np.linspace(1, 1 - strength / 2, h)[:, None]
+    return Image.fromarray(np.clip(a * gradient, 0, 255).astype('uint8'))
+
+
+def low_contrast(img, low=90, high=170):
+    a = np.asarray(img).astype(float) / 255
+    return Image.fromarray((low + a * (high - low)).astype('uint8'))
+
+
+def noise(img, sigma=12):
+    a = np.asarray(img).astype(float)
+    a += np.random.default_rng(3).normal(0, sigma, a.shape)
+    return Image.fromarray(np.clip(a, 0, 255).astype('uint8'))
+
+
+def colorize(img):
+    """Slightly warm RGB, like a phone photo of a white pack."""
+    a = np.asarray(img)
+    return Image.fromarray(np.stack([a, (a * 0.95).astype('uint8'), (a * 0.85).astype('uint8')], -1))
+
+
+# name -> photo size, code angle and scale, where it sits (fraction of the
+# photo), what happens to the photo afterwards and the JPEG quality.
+CASES = [
+    ("clean", dict(size=(1600, 1200), angle=0, scale=1.2)),
+    ("small_in_large", dict(size=(4000, 3000), angle=0, scale=0.55, pos=(0.7, 0.75))),
+    ("rotated_30", dict(size=(2000, 1500), angle=30, scale=1.0)),
+    ("rotated_45_small", dict(size=(3000, 2250), angle=45, scale=0.7, pos=(0.35, 0.4))),
+    ("low_contrast_blur", dict(
+        size=(1600, 1200), angle=0, scale=1.0,
+        post=lambda img: low_contrast(img).filter(ImageFilter.GaussianBlur(1.6)),
+    )),
+    ("shadow", dict(size=(2000, 1500), angle=5, scale=1.0, post=lambda img: shade(img, 0.75))),
+    ("upside_down", dict(size=(1600, 1200), angle=180, scale=1.0)),
+    ("vertical", dict(size=(1500, 2000), angle=90, scale=1.0)),
+    ("noisy", dict(size=(1600, 1200), angle=-12, scale=0.8, post=lambda img: noise(img, 18), quality=60)),
+    ("tiny_code", dict(size=(3000, 2250), angle=0, scale=0.38, pos=(0.5, 0.6))),
+    ("rotated_-60_shadow", dict(size=(2400, 1800), angle=-60, scale=0.9, post=lambda img: shade(img, 0.6))),
+    ("jpeg_heavy", dict(size=(1600, 1200), angle=8, scale=0.8, quality=25)),
+]
+
+
+def main():
+    expected = {}
+    for (name, case), body in zip(CASES, BODIES):
+        code, bits = ean13(body)
+        width, height = case['size']
+        x, y = case.get('pos', (0.5, 0.5))
+        img = place(scene(case['size']), render(bits, code), case['angle'], (width * x, height * y), case['scale'])
+        if 'post' in case:
+            img = case['post'](img)
+        filename = f"{name}.jpg"
+        colorize(img).save(os.path.join(OUTPUT_DIR, filename), quality=case.get('quality', 80))
+        expected[filename] = code
+
+    with open(os.path.join(OUTPUT_DIR, 'expected.json'), 'w') as f:
+        json.dump(expected, f, indent=2)
+        f.write('\n')
+    print(expected)
+
+
+if __name__ == '__main__':
+    main()